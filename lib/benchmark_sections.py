@@ -0,0 +1,104 @@
+"""
+Benchmark the Section Splitter
+
+Type: Command-Line Tool
+
+It generates programs of increasing size with the QiskitFuzzer and splits
+them in sections with get_sections, comparing the time against the
+previous ast/astunparse round-trip (and checking the sections are equal).
+
+python -m lib.benchmark_sections config/qmt_v52.yaml --n_ops 30 300 3000
+"""
+import ast
+import random
+import re
+from timeit import default_timer as timer
+from typing import Any, Dict, List
+
+import astunparse
+import click
+import numpy as np
+
+from lib.generation_strategy_python import QiskitFuzzer
+from lib.metamorph import get_sections, remove_comments
+from lib.utils import load_config_and_check
+
+
+# LEVEL 2
+
+
+def get_sections_via_ast(circ_source_code: str) -> Dict[str, str]:
+    """Split in sections as get_sections, with the ast round-trip."""
+    regex_name_extr = r"^# NAME:\s([a-zA-Z_]+)\s"
+    return {
+        re.match(regex_name_extr, content).group(1):
+            astunparse.unparse(ast.parse(content))
+        for content in circ_source_code.split("# SECTION\n")
+        if re.match(regex_name_extr, content) is not None
+    }
+
+
+def get_sections_without_cache(circ_source_code: str) -> Dict[str, str]:
+    """Split in sections with get_sections, ignoring memoized sections."""
+    remove_comments.cache_clear()
+    return get_sections(circ_source_code)
+
+
+# LEVEL 1
+
+
+def generate_programs(
+        gate_set: List[Dict[str, Any]], n_ops: int, n_programs: int,
+        n_qubits: int) -> List[str]:
+    """Generate programs with the given number of operations."""
+    generator = QiskitFuzzer()
+    return [
+        generator.generate_file(
+            gate_set=gate_set, n_qubits=n_qubits, n_ops=n_ops,
+            optimizations=[], backend="qasm_simulator", shots=1024,
+            level_auto_optimization=random.randint(0, 3),
+            target_gates=None)[0]
+        for _ in range(n_programs)
+    ]
+
+
+def time_splitter(splitter, programs: List[str]) -> float:
+    """Get the average time (in seconds) to split a program."""
+    start = timer()
+    for program in programs:
+        splitter(program)
+    return (timer() - start) / len(programs)
+
+
+# LEVEL 0
+
+
+@click.command()
+@click.argument('config_file')
+@click.option('--n_ops', multiple=True, type=int, default=[30, 300, 3000],
+              help='Number of operations in the generated programs.')
+@click.option('--n_programs', default=10, help='Programs per size.')
+@click.option('--n_qubits', default=10, help='Qubits of the programs.')
+@click.option('--seed', default=42, help='Random seed of the generation.')
+def benchmark_sections(config_file, n_ops, n_programs, n_qubits, seed):
+    """Compare get_sections against the ast round-trip."""
+    config = load_config_and_check(config_file)
+    gate_set = config["generation_strategy"]["gate_set"]
+    random.seed(seed)
+    np.random.seed(seed)
+    print(f"{'n_ops':>8} {'ast (ms)':>12} {'tokens (ms)':>12} {'speedup':>8}")
+    for i_n_ops in n_ops:
+        programs = generate_programs(
+            gate_set, n_ops=i_n_ops, n_programs=n_programs,
+            n_qubits=n_qubits)
+        for program in programs:
+            assert get_sections_via_ast(program) == \
+                get_sections_without_cache(program), "Different sections."
+        time_ast = time_splitter(get_sections_via_ast, programs)
+        time_tokens = time_splitter(get_sections_without_cache, programs)
+        print(f"{i_n_ops:>8} {time_ast * 1000:>12.2f} " +
+              f"{time_tokens * 1000:>12.2f} {time_ast / time_tokens:>7.1f}x")
+
+
+if __name__ == '__main__':
+    benchmark_sections()
@@ -0,0 +1,68 @@
+"""Permutation of the bits of the outcomes, in bulk.
+
+The MRs that move qubits around read the follow-up counts back via the
+qubit mapping. Instead of rebuilding each outcome character by character,
+the outcomes of the same width are stacked once as a matrix of characters
+and the permutation is a single gather of its columns (with the column
+indices precomputed from the mapping).
+"""
+
+from typing import Dict, List
+
+import numpy as np
+
+
+def get_permutation_indices(direct_mapping: Dict[int, int], n_bits: int,
+                            little_endian: bool = True) -> np.ndarray:
+    """Get the column of each character of the remapped outcome.
+
+    With little_endian the bit i is the character i from the right (as in
+    the counts of Qiskit), otherwise it is the character i from the left.
+    The bit i of the remapped outcome is the bit direct_mapping[i] of the
+    original one.
+    """
+    sources = np.array([direct_mapping[i] for i in range(n_bits)])
+    if not little_endian:
+        return sources
+    return (n_bits - 1 - sources)[::-1]
+
+
+def permute_outcomes(outcomes: List[str], direct_mapping: Dict[int, int],
+                     little_endian: bool = True) -> List[str]:
+    """Remap the bits of all the outcomes (see get_permutation_indices)."""
+    remapped = [None] * len(outcomes)
+    positions_by_width = {}
+    for position, outcome in enumerate(outcomes):
+        positions_by_width.setdefault(len(outcome), []).append(position)
+    for n_bits, positions in positions_by_width.items():
+        if n_bits == 0:
+            for position in positions:
+                remapped[position] = outcomes[position]
+            continue
+        chars = np.frombuffer(
+            "".join([outcomes[p] for p in positions]).encode("ascii"),
+            dtype=np.uint8).reshape(len(positions), n_bits)
+        indices = get_permutation_indices(
+            direct_mapping, n_bits, little_endian=little_endian)
+        flat = chars[:, indices].tobytes().decode("ascii")
+        for row, position in enumerate(positions):
+            remapped[position] = flat[row * n_bits:(row + 1) * n_bits]
+    return remapped
+
+
+def permute_counts(counts: Dict[str, int], direct_mapping: Dict[int, int],
+                   little_endian: bool = True) -> Dict[str, int]:
+    """Remap the bits of the outcomes of the counts (see permute_outcomes).
+
+    If the mapping is not a permutation, the frequencies of the outcomes
+    that collide are summed.
+    """
+    outcomes = list(counts.keys())
+    remapped = permute_outcomes(
+        outcomes, direct_mapping, little_endian=little_endian)
+    if len(set(remapped)) == len(remapped):
+        return dict(zip(remapped, counts.values()))
+    remapped_counts = {}
+    for outcome, freq in zip(remapped, counts.values()):
+        remapped_counts[outcome] = remapped_counts.get(outcome, 0) + freq
+    return remapped_counts
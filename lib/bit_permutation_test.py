@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from lib.bit_permutation import permute_counts
+from lib.bit_permutation import permute_outcomes
+
+
+def read_str_with_mapping(bitstring, direct_mapping, little_endian=True):
+    """Remap a single outcome character by character (as before)."""
+    n_bits = len(bitstring)
+    if not little_endian:
+        return "".join([bitstring[direct_mapping[i]] for i in range(n_bits)])
+    bitstring = bitstring[::-1]
+    return "".join([bitstring[direct_mapping[i]]
+                    for i in range(n_bits)])[::-1]
+
+
+def random_counts(rng, n_bits, n_outcomes):
+    """Random counts over (at most n_outcomes) outcomes of n_bits."""
+    bits = rng.integers(0, 2, size=(n_outcomes, n_bits))
+    return {"".join(map(str, row)): int(rng.integers(1, 100))
+            for row in bits}
+
+
+@pytest.mark.parametrize("little_endian", [True, False])
+@pytest.mark.parametrize("n_bits", [1, 2, 5, 12, 70])
+def test_permute_counts_as_per_character_remap(n_bits, little_endian):
+    rng = np.random.default_rng(n_bits)
+    for _ in range(5):
+        mapping = dict(enumerate(rng.permutation(n_bits).tolist()))
+        counts = random_counts(rng, n_bits, n_outcomes=200)
+        expected = {
+            read_str_with_mapping(outcome, mapping, little_endian): freq
+            for outcome, freq in counts.items()}
+        remapped = permute_counts(
+            counts, mapping, little_endian=little_endian)
+        assert remapped == expected
+        assert list(remapped.keys()) == list(expected.keys())
+
+
+@pytest.mark.parametrize("little_endian", [True, False])
+def test_permute_outcomes_of_mixed_widths(little_endian):
+    # a permutation of the first 2, 3, 5 and 6 bits
+    mapping = {0: 1, 1: 0, 2: 2, 3: 4, 4: 3, 5: 5}
+    outcomes = ["101101", "", "10", "110", "000111", "01", "11010"]
+    expected = [read_str_with_mapping(outcome, mapping, little_endian)
+                for outcome in outcomes]
+    assert permute_outcomes(
+        outcomes, mapping, little_endian=little_endian) == expected
+
+
+def test_permute_counts_sums_the_collisions():
+    # not a permutation: the bits 0 and 1 both come from the bit 0
+    mapping = {0: 0, 1: 0, 2: 2}
+    counts = {"000": 1, "010": 2, "001": 3, "101": 4}
+    expected = {}
+    for outcome, freq in counts.items():
+        remapped = read_str_with_mapping(outcome, mapping)
+        expected[remapped] = expected.get(remapped, 0) + freq
+    assert permute_counts(counts, mapping) == expected
+    assert sum(permute_counts(counts, mapping).values()) == 10
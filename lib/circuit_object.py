@@ -0,0 +1,101 @@
+"""Generated programs as objects (object mode of the pipeline).
+
+A program is its circuit, as the operations appended by the generator,
+together with its execution settings (optimization level, basis gates,
+backend and shots). It builds and executes its QuantumCircuit directly,
+without writing and exec-ing a Python file, while to_source() emits the
+same program as the generator would (only when the source is needed).
+"""
+
+from copy import deepcopy
+from typing import List, Dict, Any, Tuple
+
+import qiskit
+from qiskit import QuantumCircuit, ClassicalRegister, QuantumRegister
+from qiskit import Aer, execute
+from qiskit.circuit.library import standard_gates
+
+from lib.generation_strategy_python import QiskitFuzzer
+
+
+# an operation: gate name, parameters and qubit indices
+Operation = Tuple[str, List[float], List[int]]
+
+
+class ObjectProgram(object):
+    """A generated circuit with its execution settings."""
+
+    def __init__(self, n_qubits: int, operations: List[Operation],
+                 opt_level: int, target_gates: List[str],
+                 backend: str, shots: int,
+                 circuit_id: str = "qc", id_quantum_reg: str = "qr",
+                 id_classical_reg: str = "cr"):
+        self.n_qubits = n_qubits
+        self.operations = operations
+        self.opt_level = opt_level
+        self.target_gates = target_gates
+        self.backend = backend
+        self.shots = shots
+        self.circuit_id = circuit_id
+        self.id_quantum_reg = id_quantum_reg
+        self.id_classical_reg = id_classical_reg
+
+    def with_settings(self, **settings) -> "ObjectProgram":
+        """Derive a new program with the given settings changed."""
+        new_program = deepcopy(self)
+        for name, value in settings.items():
+            setattr(new_program, name, value)
+        return new_program
+
+    def build_circuit(self) -> QuantumCircuit:
+        """Build the circuit, with the measurement of all the qubits."""
+        qr = QuantumRegister(self.n_qubits, name=self.id_quantum_reg)
+        cr = ClassicalRegister(self.n_qubits, name=self.id_classical_reg)
+        circuit = QuantumCircuit(qr, cr, name=self.circuit_id)
+        for gate_name, params, qubits in self.operations:
+            circuit.append(
+                getattr(standard_gates, gate_name)(*params),
+                qargs=[qr[q] for q in qubits], cargs=[])
+        circuit.measure(qr, cr)
+        return circuit
+
+    def execute(self) -> Dict[str, int]:
+        """Transpile and execute the circuit, as the generated program."""
+        circuit = qiskit.transpile(
+            self.build_circuit(), basis_gates=self.target_gates,
+            optimization_level=self.opt_level, coupling_map=None)
+        backend = Aer.get_backend(self.backend)
+        return execute(circuit, backend=backend, shots=self.shots).result()\
+            .get_counts(circuit)
+
+    def circuit_section(self) -> str:
+        """Emit the CIRCUIT section (via the emitters of the generator)."""
+        fuzzer = QiskitFuzzer()
+        source_code = fuzzer.circuit_declaration(
+            self.circuit_id, self.id_quantum_reg, self.id_classical_reg,
+            self.n_qubits)
+        for gate_name, params, qubits in self.operations:
+            source_code += fuzzer.circuit_append(
+                self.circuit_id, gate_name,
+                fuzzer.format_params(params),
+                fuzzer.format_qubits(self.id_quantum_reg, qubits))
+        return source_code
+
+    def to_source(self) -> str:
+        """Emit the source code of the program (as generate_file)."""
+        fuzzer = QiskitFuzzer()
+        py_file = fuzzer.circuit_prologue()
+        py_file += self.circuit_section()
+        py_file += fuzzer.register_measure(
+            id_target_circuit=self.circuit_id,
+            id_quantum_reg=self.id_quantum_reg,
+            id_classical_reg=self.id_classical_reg)
+        py_file += fuzzer.circuit_optimization_levels(
+            id_target_circuit=self.circuit_id,
+            level=self.opt_level,
+            target_gate_set=self.target_gates)
+        py_file += fuzzer.circuit_execution(
+            id_target_circuit=self.circuit_id,
+            backend=self.backend,
+            shots=self.shots)
+        return py_file
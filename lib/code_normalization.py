@@ -0,0 +1,340 @@
+"""Fast normalization of Python source code (as astunparse does).
+
+The sections of the generated programs are normalized by parsing and
+unparsing them with astunparse, which drops comments and blank lines and
+gives a canonical layout to each statement. Running astunparse on every
+section is slow, thus here we render directly the statements written in
+the simple subset of Python used by the generators (assignments, calls,
+attributes, subscripts, literals and imports) and delegate to astunparse
+only the statements outside of it.
+
+Programming Mantra:
+- every function should have 3-5 lines + return statement.
+- max one if per function (which gives +3 lines to use).
+"""
+import ast
+import keyword
+import math
+import re
+from typing import List, Tuple
+
+import astunparse
+
+
+TOKEN_REGEX = re.compile(r"""
+    [ \t]*(?:
+    (?P<name>[A-Za-z_][A-Za-z0-9_]*)|
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|
+    (?P<string>'[^'\\\r\n]*'|"[^"\\\r\n]*")|
+    (?P<op>[()\[\]{},.:=*])|
+    (?P<end>\#.*$|$))""", re.VERBOSE)
+
+CONSTANT_NAMES = ["None", "True", "False"]
+
+NAME = r"[A-Za-z_][A-Za-z0-9_]*"
+NUMBER = r"(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+QUBIT = NAME + r"\[ *\d+ *\]"
+QUBIT_REGEX = re.compile(rf"({NAME})\[ *(\d+) *\]")
+
+# layout of the operations appended by the QiskitFuzzer, e.g.:
+# qc.append(CRZGate(1.25,2.22), qargs=[qr[0], qr[1]], cargs=[])
+GATE_APPEND_REGEX = re.compile(
+    rf"({NAME})\.append\(({NAME})\(((?: *{NUMBER} *(?:, *{NUMBER} *)*)?)\), *"
+    rf"qargs=\[((?: *{QUBIT} *(?:, *{QUBIT} *)*)?)\], *cargs=\[\]\)"
+    r"[ \t]*(?:#.*)?")
+
+
+class NotCanonical(Exception):
+    """The code is outside the subset rendered without astunparse."""
+    pass
+
+
+def tokenize_line(line: str) -> List[Tuple[str, str]]:
+    """Split a line in (kind, text) tokens, None if a token is unknown."""
+    tokens = []
+    position = 0
+    while position < len(line):
+        match = TOKEN_REGEX.match(line, position)
+        if match is None or match.lastgroup == "end":
+            return tokens if match is not None else None
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        position = match.end()
+    return tokens
+
+
+def update_depth(depth: int, tokens: List[Tuple[str, str]]) -> int:
+    """Get the bracket depth after the given tokens."""
+    for kind, text in tokens:
+        if kind == "op" and text in "([{":
+            depth += 1
+        elif kind == "op" and text in ")]}":
+            depth -= 1
+    return depth
+
+
+def split_statements(source_code: str):
+    """Group the lines in statements, with their tokens.
+
+    It yields (statement code, tokens), where the tokens are None if the
+    statement has the layout of a gate append or uses tokens unknown to
+    the fast renderer (in both cases it is a single line). It raises
+    NotCanonical if the statements cannot be delimited without a full
+    parse (e.g. indented blocks or multi-line strings).
+    """
+    lines, tokens, depth = [], [], 0
+    for line in source_code.split("\n"):
+        is_empty = line.strip() == "" or line.lstrip().startswith("#")
+        if depth == 0 and is_empty:
+            continue
+        if depth == 0 and line[0] in " \t":
+            raise NotCanonical("Indented statement.")
+        if depth == 0 and GATE_APPEND_REGEX.fullmatch(line) is not None:
+            yield line, None
+            continue
+        line_tokens = tokenize_line(line)
+        if line_tokens is None and depth > 0:
+            raise NotCanonical("Unknown token in a multi-line statement.")
+        lines.append(line)
+        tokens = None if (tokens is None or line_tokens is None) \
+            else tokens + line_tokens
+        depth = 0 if line_tokens is None else \
+            update_depth(depth, line_tokens)
+        if depth == 0:
+            yield "\n".join(lines), tokens
+            lines, tokens = [], []
+    if depth != 0:
+        raise NotCanonical("Unbalanced brackets.")
+
+
+class StatementRenderer(object):
+    """Render a statement in the layout of astunparse, from its tokens.
+
+    It supports only the subset of Python of the generated programs and
+    raises NotCanonical for everything else.
+    """
+
+    def __init__(self, tokens: List[Tuple[str, str]]):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self, offset: int = 0) -> str:
+        if self.position + offset < len(self.tokens):
+            return self.tokens[self.position + offset][1]
+        return ""
+
+    def next(self) -> Tuple[str, str]:
+        if self.position >= len(self.tokens):
+            raise NotCanonical("Unexpected end of statement.")
+        self.position += 1
+        return self.tokens[self.position - 1]
+
+    def accept(self, text: str) -> bool:
+        if self.peek() == text:
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, text: str):
+        if not self.accept(text):
+            raise NotCanonical(f"Expected: {text}")
+
+    def identifier(self) -> str:
+        kind, text = self.next()
+        if kind != "name" or keyword.iskeyword(text) or text == "__debug__":
+            raise NotCanonical(f"Not an identifier: {text}")
+        return text
+
+    def render(self) -> str:
+        """Render the whole statement."""
+        if self.peek() in ["import", "from"]:
+            rendered = self.render_import()
+        else:
+            rendered = self.render_assignment_or_expression()
+        if self.position < len(self.tokens):
+            raise NotCanonical("Trailing tokens.")
+        return rendered
+
+    def render_import(self) -> str:
+        if self.accept("import"):
+            return "import " + self.render_aliases(dotted=True)
+        self.expect("from")
+        module = self.render_dotted_name()
+        self.expect("import")
+        if self.accept("*"):
+            return f"from {module} import *"
+        return f"from {module} import " + self.render_aliases(dotted=False)
+
+    def render_dotted_name(self) -> str:
+        names = [self.identifier()]
+        while self.accept("."):
+            names.append(self.identifier())
+        return ".".join(names)
+
+    def render_aliases(self, dotted: bool) -> str:
+        aliases = []
+        while len(aliases) == 0 or self.accept(","):
+            name = self.render_dotted_name() if dotted else self.identifier()
+            if self.accept("as"):
+                name += " as " + self.identifier()
+            aliases.append(name)
+        return ", ".join(aliases)
+
+    def render_assignment_or_expression(self) -> str:
+        rendered, is_assignable = self.render_operand()
+        while self.accept("="):
+            if not is_assignable:
+                raise NotCanonical("Not an assignable target.")
+            value, is_assignable = self.render_operand()
+            rendered += " = " + value
+        return rendered
+
+    def render_expression(self) -> str:
+        return self.render_operand()[0]
+
+    def render_operand(self) -> Tuple[str, bool]:
+        """Render an operand and tell if it can be assigned to."""
+        kind, text = self.next()
+        if kind == "number":
+            return self.render_number(text), False
+        if kind == "name" and text in CONSTANT_NAMES:
+            rendered = self.render_constant(text)
+        elif kind == "name":
+            self.position -= 1
+            rendered = self.identifier()
+        elif kind == "string":
+            rendered = repr(text[1:-1])
+        elif text == "[":
+            rendered = self.render_nested(self.render_expression, "]")
+            rendered = "[" + rendered + "]"
+        elif text == "{":
+            rendered = self.render_nested(self.render_dict_item, "}")
+            rendered = "{" + rendered + "}"
+        else:
+            raise NotCanonical(f"Unexpected token: {text}")
+        return self.render_trailers(rendered, is_assignable=kind == "name"
+                                    and text not in CONSTANT_NAMES)
+
+    def render_constant(self, text: str) -> str:
+        if text != "None" and self.peek() == ".":
+            raise NotCanonical("Attribute of a bool (spaced by astunparse).")
+        return text
+
+    def render_number(self, text: str) -> str:
+        if text.isdigit():
+            if text != "0" and text.startswith("0"):
+                raise NotCanonical("Leading zeros.")
+            return repr(int(text))
+        value = float(text)
+        if not math.isfinite(value):
+            raise NotCanonical("Infinite value.")
+        return repr(value)
+
+    def render_trailers(self, rendered: str, is_assignable: bool):
+        while self.peek() in [".", "(", "["]:
+            text = self.next()[1]
+            if text == ".":
+                rendered += "." + self.identifier()
+            elif text == "(":
+                rendered += "(" + self.render_arguments() + ")"
+            else:
+                rendered += "[" + self.render_subscript() + "]"
+            is_assignable = text != "("
+        return rendered, is_assignable
+
+    def render_nested(self, render_element: callable, closing: str) -> str:
+        """Render comma-separated elements up to the closing bracket."""
+        elements = []
+        while not self.accept(closing):
+            if len(elements) > 0:
+                self.expect(",")
+            if len(elements) > 0 and self.accept(closing):
+                break
+            elements.append(render_element())
+        return ", ".join(elements)
+
+    def render_dict_item(self) -> str:
+        key = self.render_expression()
+        self.expect(":")
+        return key + ": " + self.render_expression()
+
+    def render_arguments(self) -> str:
+        keywords_seen = []
+
+        def render_argument() -> str:
+            if self.peek(1) != "=":
+                if len(keywords_seen) > 0:
+                    raise NotCanonical("Positional argument after keyword.")
+                return self.render_expression()
+            name = self.identifier()
+            self.expect("=")
+            if name in keywords_seen:
+                raise NotCanonical(f"Repeated keyword argument: {name}")
+            keywords_seen.append(name)
+            return name + "=" + self.render_expression()
+
+        return self.render_nested(render_argument, ")")
+
+    def render_subscript(self) -> str:
+        """Render an index or a slice (without the step if missing)."""
+        parts = [""]
+        while not self.accept("]"):
+            if self.accept(":"):
+                parts.append("")
+            elif parts[-1] == "":
+                parts[-1] = self.render_expression()
+            else:
+                raise NotCanonical("Unexpected token in subscript.")
+        if len(parts) > 3 or parts == [""]:
+            raise NotCanonical("Invalid subscript.")
+        if len(parts) == 3 and parts[2] == "":
+            parts = parts[:2]
+        return ":".join(parts)
+
+
+def render_gate_append(match: re.Match) -> str:
+    """Render an operation appended with the layout of the QiskitFuzzer."""
+    circuit, gate, params, qubits = match.groups()
+    renderer = StatementRenderer([])
+    params = [renderer.render_number(p.strip())
+              for p in params.split(",") if p.strip() != ""]
+    qubits = [(register, renderer.render_number(index))
+              for register, index in QUBIT_REGEX.findall(qubits)]
+    names = [circuit, gate] + [register for register, _ in qubits]
+    if any(keyword.iskeyword(n) or n == "__debug__" for n in names):
+        raise NotCanonical("Keyword used as a name.")
+    return f"{circuit}.append({gate}({', '.join(params)}), " + \
+        f"qargs=[{', '.join(f'{r}[{i}]' for r, i in qubits)}], cargs=[])"
+
+
+def render_statement(statement: str, tokens: List[Tuple[str, str]]) -> str:
+    """Render the statement as astunparse would (or raise NotCanonical)."""
+    match = GATE_APPEND_REGEX.fullmatch(statement)
+    if match is not None:
+        return render_gate_append(match)
+    if tokens is None:
+        raise NotCanonical("Unknown tokens.")
+    return StatementRenderer(tokens).render()
+
+
+def unparse_statement(statement: str) -> str:
+    """Render a single statement with astunparse."""
+    return astunparse.unparse(ast.parse(statement))[:-1]
+
+
+def normalize_code(source_code: str) -> str:
+    """Get the same code of astunparse.unparse(ast.parse(source_code)).
+
+    Note that the statements outside the supported subset are unparsed one
+    by one with astunparse, and the whole code when they cannot be
+    delimited (or parsed) on their own.
+    """
+    try:
+        rendered = []
+        for statement, tokens in split_statements(source_code):
+            try:
+                rendered.append("\n" + render_statement(statement, tokens))
+            except NotCanonical:
+                rendered.append(unparse_statement(statement))
+        return "".join(rendered) + "\n"
+    except (NotCanonical, SyntaxError):
+        return astunparse.unparse(ast.parse(source_code))
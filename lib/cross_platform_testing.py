@@ -42,6 +42,9 @@ from utils import convert
 from utils import run_programs
 from utils import iterate_over_program_ids
 from utils import iterate_over_pairs_of_group
+from result_cache import get_result_cache
+from result_cache import get_execution_key
+from result_cache import execute_with_cache
 import time
 
 
@@ -236,6 +239,13 @@ def generate_once_and_derive(
             break
 
 
+def run_executor(executor, qasm_content: str, n_shots: int):
+    """Load the QASM program in the executor and execute it."""
+    executor.from_qasm(qasm_content)
+    executor.execute(n_shots)
+    return executor.get_result()
+
+
 def execute_single_compiler(compiler: Dict[str, Any], comparison_config: Dict[str, Any], config: Dict[str, Any]):
     """Execute the programs of the given compiler."""
     click.echo("Joint execution...")
@@ -245,16 +255,23 @@ def execute_single_compiler(compiler: Dict[str, Any], comparison_config: Dict[st
     exec_folder = get_folder(
         config, comparison_config["name"], "executions", compiler["name"])
     executor = eval(compiler["execution_object"])(repetitions=n_shots)
+    cache = get_result_cache(
+        config.get("result_cache"),
+        default_folder=os.path.join(config["experiment_folder"], "result_cache"))
     for circuit_id, qasm_content in iterate_over(program_folder, ".qasm"):
+        key = get_execution_key(
+            program=qasm_content, platform=compiler["execution_object"],
+            shots=n_shots)
         for exec_iteration in range(int(config["n_executions"])):
-            # load the program
-            executor.from_qasm(qasm_content)
-            # execute the program
-            executor.execute(n_shots)
-            result = executor.get_result()
+            # load and execute the program (or reuse a recorded execution)
+            result = execute_with_cache(
+                cache, key, draw=exec_iteration,
+                execute=lambda: run_executor(executor, qasm_content, n_shots))
             with open(os.path.join(exec_folder, f"{circuit_id}_{exec_iteration}.json"), "w") as execution_file:
                 print(f"Saving execution of: {circuit_id}.json")
                 json.dump(result, execution_file)
+    if cache is not None:
+        click.echo(f"Result cache: {cache.get_hit_rates()}")
 
 
 def generate_and_run_programs(config: Dict[str, Any], benchmark_mode: bool=False) -> None:
@@ -369,7 +386,8 @@ def detect_divergence(config: Dict[str, Any], benchmark_mode: bool = False) -> N
     for detector in detectors:
         print("-" * 80)
         print("Running detector:", detector["name"])
-        detector_object = eval(detector["detector_object"])()
+        detector_object = get_detector(
+            detector["detector_object"], kwargs=detector.get("kwargs"))
         for comparison in config["comparisons"]:
 
             if comparison.get("is_benchmark", False) != benchmark_mode:
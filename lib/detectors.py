@@ -2,13 +2,26 @@
 
 from abc import ABC
 from abc import abstractmethod
+from typing import Any, Dict
+
+from math import gcd
 
 from scipy.stats import ks_2samp
+from scipy.stats import kstwo
+from scipy.stats import chi2
 import numpy as np
 
-import torch
 from scipy.spatial.distance import jensenshannon
-from lib.inspector import convert_dict_to_df
+
+try:
+    from scipy.stats._stats_py import _attempt_exact_2kssamp
+except ImportError:
+    # scipy < 1.8
+    from scipy.stats.stats import _attempt_exact_2kssamp
+
+
+# largest sample size for which ks_2samp (mode='auto') uses the exact p-value
+KS_MAX_AUTO_N = 10000
 
 
 def obtain_raw_samples(summary_dict, representation='binary'):
@@ -42,6 +55,142 @@ def obtain_multivariate_samples(summary_dict):
     return multivariate_samples
 
 
+class AlignedCounts(object):
+    """The two results of a comparison aligned on the same outcomes.
+
+    It is computed once per pair of results and shared by all the
+    detectors: outcomes is the sorted union of the outcomes of the two
+    results (the position of an outcome is its integer code), counts_A and
+    counts_B are the int64 count vectors on those outcomes. The bit matrix
+    (one row of bits per outcome) is built only if a detector needs it.
+    """
+
+    def __init__(self, result_A: Dict[str, int], result_B: Dict[str, int]):
+        self.result_A = result_A
+        self.result_B = result_B
+        self.outcomes = sorted(set(result_A.keys()) | set(result_B.keys()))
+        self.counts_A = np.array(
+            [result_A.get(o, 0) for o in self.outcomes], dtype=np.int64)
+        self.counts_B = np.array(
+            [result_B.get(o, 0) for o in self.outcomes], dtype=np.int64)
+        self.n_A = int(self.counts_A.sum())
+        self.n_B = int(self.counts_B.sum())
+        self._bits = None
+
+    @property
+    def bits(self) -> np.ndarray:
+        """Outcomes as multivariate vectors (shape: n. outcomes x n. bits)."""
+        if self._bits is None:
+            self._bits = np.vstack([
+                np.array([int(x) for x in bin_string])
+                for bin_string in self.outcomes
+            ])
+        return self._bits
+
+
+def ks_2samp_from_counts(summary_dict_A, summary_dict_B):
+    """Two-sided KS test on two count dictionaries (no raw samples)."""
+    return ks_2samp_aligned(AlignedCounts(summary_dict_A, summary_dict_B))
+
+
+def ks_2samp_aligned(aligned: AlignedCounts):
+    """Two-sided KS test on the aligned counts (no raw samples).
+
+    It gives the same statistic and p-value of ks_2samp (mode 'auto') on
+    the raw samples, but the ECDFs are weighted by the counts and
+    evaluated only on the sorted union of the outcomes, thus the memory is
+    proportional to the number of distinct outcomes.
+    """
+    freq_A, freq_B = aligned.counts_A, aligned.counts_B
+    n1, n2 = aligned.n_A, aligned.n_B
+    if min(n1, n2) == 0:
+        raise ValueError('Data passed to ks_2samp must not be empty')
+    cddiffs = np.cumsum(freq_A) / n1 - np.cumsum(freq_B) / n2
+    min_s = np.clip(-np.min(cddiffs), 0, 1)
+    max_s = np.max(cddiffs)
+    d = max(min_s, max_s)
+    # p-value as in ks_2samp: exact for small samples, otherwise asymptotic
+    if max(n1, n2) <= KS_MAX_AUTO_N:
+        success, d, prob = _attempt_exact_2kssamp(
+            n1, n2, gcd(n1, n2), d, 'two-sided')
+        if success:
+            return d, np.clip(prob, 0, 1)
+    m, n = sorted([float(n1), float(n2)], reverse=True)
+    en = m * n / (m + n)
+    prob = kstwo.sf(d, np.round(en))
+    return d, np.clip(prob, 0, 1)
+
+
+class GroupSequentialKSTest(object):
+    """Group-sequential two-sample KS test with error spending.
+
+    The counts of the two programs grow batch after batch (a look) up to
+    max_shots per program. At each look the KS test rejects the equality
+    of the two distributions if its p-value is below the alpha spent on
+    that look, and it accepts it (futility) if the KS distance between
+    the two true distributions is surely below the threshold.
+
+    The cumulative error spent at the information fraction t (shots done
+    over max_shots) is error * t^spending_exponent, and the look spends
+    the increment. The guarantees follow from the union bound over the
+    looks, whatever their number and correlation:
+    - if the two distributions are the same, the probability to declare
+      them divergent is at most alpha (the exact KS test is conservative);
+    - if their KS distance is at least the threshold, the probability to
+      declare them equivalent is at most beta. By the DKW inequality, with
+      probability at least 1 - beta_k each empirical CDF is within
+      sqrt(ln(4 / beta_k) / (2 n)) of its true CDF, thus the true distance
+      is below the observed distance plus the two margins.
+    If neither happens before max_shots, the decision is 'undecided' and
+    the caller falls back to the p-values of the detectors on all the
+    shots. The p-values of the detectors on a sample stopped early are
+    nominal (each look is a new chance to be small), thus the caller
+    records the decision instead (see qfl.apply_sequential_decision).
+    """
+
+    def __init__(self, max_shots: int, alpha: float = 0.05,
+                 beta: float = 0.05, threshold: float = 0.1,
+                 spending_exponent: float = 1.):
+        self.max_shots = max_shots
+        self.alpha = alpha
+        self.beta = beta
+        self.threshold = threshold
+        self.spending_exponent = spending_exponent
+        self.alpha_spent = 0.
+        self.beta_spent = 0.
+        self.n_looks = 0
+        self.decision = "continue"
+
+    def spent(self, error: float, n_shots: int) -> float:
+        """Cumulative error spent after n_shots."""
+        fraction = min(1., n_shots / self.max_shots)
+        return error * fraction ** self.spending_exponent
+
+    def update(self, aligned: AlignedCounts) -> str:
+        """Look at the counts so far and return the decision.
+
+        It is 'divergent', 'equivalent', 'undecided' (max_shots reached)
+        or 'continue'.
+        """
+        n_shots = min(aligned.n_A, aligned.n_B)
+        alpha_k = self.spent(self.alpha, n_shots) - self.alpha_spent
+        beta_k = self.spent(self.beta, n_shots) - self.beta_spent
+        self.alpha_spent += alpha_k
+        self.beta_spent += beta_k
+        self.n_looks += 1
+        statistic, p_value = ks_2samp_aligned(aligned)
+        margin = sum(
+            np.sqrt(np.log(4 / beta_k) / (2 * n)) if beta_k > 0 else np.inf
+            for n in [aligned.n_A, aligned.n_B])
+        if p_value < alpha_k:
+            self.decision = "divergent"
+        elif statistic + margin < self.threshold:
+            self.decision = "equivalent"
+        elif n_shots >= self.max_shots:
+            self.decision = "undecided"
+        return self.decision
+
+
 class Detector(ABC):
 
     def load_results(self, result_A, result_B):
@@ -52,9 +201,14 @@ class Detector(ABC):
         self.samples_A = obtain_raw_samples(result_A)
         self.samples_B = obtain_raw_samples(result_B)
 
-    @abstractmethod
-    def check(self, result_A, result_B):
+    def check(self, result_A, result_B, random_seed=None):
         """Check if the two distributions are significantly different."""
+        return self.check_aligned(
+            AlignedCounts(result_A, result_B), random_seed=random_seed)
+
+    @abstractmethod
+    def check_aligned(self, aligned: AlignedCounts, random_seed=None):
+        """Check the two distributions, given as aligned counts."""
         pass
 
 
@@ -63,10 +217,11 @@ class KS_Detector(Detector):
     def __init__(self):
         self.name = "Kolmogorov–Smirnov Test"
 
-    def check(self, result_A, result_B, random_seed=None):
+    def check_aligned(self, aligned: AlignedCounts, random_seed=None):
         """Compare two distributions with KS Test"""
-        self.load_results(result_A, result_B)
-        self.statistics, self.p_value = ks_2samp(self.samples_A, self.samples_B)
+        self.result_A = aligned.result_A
+        self.result_B = aligned.result_B
+        self.statistics, self.p_value = ks_2samp_aligned(aligned)
         return self.statistics, np.float64(self.p_value)
 
 
@@ -75,147 +230,198 @@ class JS_Detector(Detector):
     def __init__(self):
         self.name = "Jensen–Shannon Distance"
 
-    def check(self, result_A, result_B, random_seed=None):
+    def check_aligned(self, aligned: AlignedCounts, random_seed=None):
         """Compare two distributions with JS Distance"""
-        df = convert_dict_to_df(
-            result_A, result_B, platform_a='A', platform_b='B')
-        df = df.pivot(index='name', columns='string', values='counter')
-        df = df.fillna(0)
-        self.statistics = jensenshannon(p=list(df.loc["A"]), q=list(df.loc["B"]))
+        self.result_A = aligned.result_A
+        self.result_B = aligned.result_B
+        self.statistics = jensenshannon(p=aligned.counts_A, q=aligned.counts_B)
         self.p_value = -1
         return self.statistics, np.float64(self.p_value)
 
 
 
 
+def stack_counts(pairs_of_results):
+    """Stack the count dicts of many pairs into two count matrices.
+
+    The columns are the sorted union of the outcomes of all the pairs, the
+    row i of the two matrices contains the counts of the pair i.
+    """
+    outcomes = sorted(set(
+        outcome
+        for result_A, result_B in pairs_of_results
+        for outcome in list(result_A.keys()) + list(result_B.keys())))
+    position = {outcome: i for i, outcome in enumerate(outcomes)}
+    counts_A = np.zeros((len(pairs_of_results), len(outcomes)), dtype=np.int64)
+    counts_B = np.zeros((len(pairs_of_results), len(outcomes)), dtype=np.int64)
+    for i, (result_A, result_B) in enumerate(pairs_of_results):
+        for outcome, count in result_A.items():
+            counts_A[i, position[outcome]] = count
+        for outcome, count in result_B.items():
+            counts_B[i, position[outcome]] = count
+    return counts_A, counts_B
+
+
+def chi_square_homogeneity_batch(counts_A, counts_B, min_expected=5):
+    """Chi-square homogeneity test on many 2 x k contingency tables at once.
+
+    The row i of counts_A and counts_B (shape (m, k)) are the two rows of
+    the i-th table. The cells whose expected count is below min_expected
+    (in any of the two rows) are merged in a single cell, thus the test
+    stays valid with many rare outcomes. If the merged cell is itself below
+    min_expected (e.g. a single rare outcome), it is folded in the smallest
+    of the other cells. The empty cells (e.g. outcomes of other pairs) do
+    not count in the degrees of freedom.
+    Return the arrays of statistics and p-values (shape (m,)).
+    """
+    counts_A = np.atleast_2d(counts_A).astype(np.float64)
+    counts_B = np.atleast_2d(counts_B).astype(np.float64)
+    n_A = counts_A.sum(axis=1, keepdims=True)
+    n_B = counts_B.sum(axis=1, keepdims=True)
+    total = counts_A + counts_B
+    n = n_A + n_B
+    with np.errstate(divide='ignore', invalid='ignore'):
+        min_expected_cell = total * np.minimum(n_A, n_B) / n
+    non_empty = total > 0
+    sparse = non_empty & (min_expected_cell < min_expected)
+    dense = non_empty & ~sparse
+    dense_A = np.where(dense, counts_A, 0)
+    dense_B = np.where(dense, counts_B, 0)
+    merged_A = np.sum(np.where(sparse, counts_A, 0), axis=1, keepdims=True)
+    merged_B = np.sum(np.where(sparse, counts_B, 0), axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        merged_min_expected = \
+            (merged_A + merged_B) * np.minimum(n_A, n_B) / n
+    under_filled = (
+        (merged_min_expected[:, 0] < min_expected) &
+        (merged_A + merged_B > 0)[:, 0] & np.any(dense, axis=1))
+    # fold the under-filled merged cell in the smallest dense cell
+    rows = np.flatnonzero(under_filled)
+    columns = np.argmin(np.where(dense, total, np.inf), axis=1)[rows]
+    dense_A[rows, columns] += merged_A[rows, 0]
+    dense_B[rows, columns] += merged_B[rows, 0]
+    merged_A[rows], merged_B[rows] = 0, 0
+    # the merged cell of the sparse ones is appended as the last column
+    obs_A = np.hstack([dense_A, merged_A])
+    obs_B = np.hstack([dense_B, merged_B])
+    obs_total = obs_A + obs_B
+    exp_A = obs_total * n_A / n
+    exp_B = obs_total * n_B / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        contributions = (
+            np.where(exp_A > 0, (obs_A - exp_A) ** 2 / exp_A, 0) +
+            np.where(exp_B > 0, (obs_B - exp_B) ** 2 / exp_B, 0))
+    statistics = contributions.sum(axis=1)
+    dof = np.sum(obs_total > 0, axis=1) - 1
+    p_values = np.where(
+        dof > 0, chi2.sf(statistics, np.maximum(dof, 1)), 1.)
+    return statistics, p_values
+
+
 class ChiSquare_Detector(Detector):
 
-    def __init__(self):
+    def __init__(self, min_expected: int = 5):
         self.name = "Chi-Square Test"
+        self.min_expected = min_expected
 
-    def check(self, result_A, result_B, random_seed=None):
+    def check_aligned(self, aligned: AlignedCounts, random_seed=None):
         """Compare two distributions with Chi-Square Test"""
-        return 0, 0
-        #self.load_results(result_A, result_B)
-        #self.statistics, self.p_value = ks_2samp(self.samples_A, self.samples_B)
-        #return self.statistics, self.p_value
+        self.result_A = aligned.result_A
+        self.result_B = aligned.result_B
+        statistics, p_values = chi_square_homogeneity_batch(
+            aligned.counts_A, aligned.counts_B,
+            min_expected=self.min_expected)
+        self.statistics, self.p_value = statistics[0], p_values[0]
+        return self.statistics, np.float64(self.p_value)
+
+    def check_batch(self, pairs_of_results):
+        """Compare many pairs of distributions in one vectorized call."""
+        counts_A, counts_B = stack_counts(pairs_of_results)
+        return chi_square_homogeneity_batch(
+            counts_A, counts_B, min_expected=self.min_expected)
 
 
 class Faster_Energy_Detector(Detector):
+    """Energy statistic computed on the distinct outcomes.
+
+    Each distinct outcome is a vector of bits weighted by its counts, thus
+    the distance matrix is u x u, where u is the number of distinct
+    outcomes of the two results, and not (n_1 + n_2) x (n_1 + n_2) as with
+    one row per shot. The p-value comes from a permutation test on the
+    same weighted form: a permutation of the shot labels is a random
+    split of the pooled counts (multivariate hypergeometric).
+
+    Note that the p-value is at least 1 / (n_permutations + 1), e.g. about
+    1e-3 with the default 1000 permutations: with a multiple-testing
+    correction over many comparisons (e.g. Holm or Bonferroni with alpha
+    0.05 over 100 comparisons: 5e-4) set n_permutations high enough (via
+    the kwargs of the detector in the config file) for the floor to be
+    below the corrected threshold. Each permutation costs two products of
+    the u x u distance matrix.
+    """
 
-    def __init__(self) -> None:
+    def __init__(self, n_permutations: int = 1000,
+                 batch_size: int = 100) -> None:
         self.name = "Energy Statistic (faster distance)"
+        self.n_permutations = n_permutations
+        self.batch_size = batch_size
 
-    def check(self, result_A, result_B, random_seed=None):
+    def check_aligned(self, aligned: AlignedCounts, random_seed=None):
         """Compare two distributions with Energy Statistic"""
-        self.statistics = self.energy_call(result_A, result_B)
-        self.p_value = -1
-        cut_off = 0.001
-        if self.statistics < cut_off:
-            self.p_value = 1
-        else:
-            self.p_value = 10e-6
-        if isinstance(self.p_value, torch.Tensor):
-            self.p_value = self.p_value.item()
-        if isinstance(self.statistics, torch.Tensor):
-            self.statistics = self.statistics.item()
-        return self.statistics, self.p_value
-
-    def unique_multivariates_and_frequencies(self, result_dictionary):
-        """Return keys as multivariate vectors and their frequecies."""
-        keys, frequencies = zip(*result_dictionary.items())
-        multivariate_keys = np.vstack([
-            np.array([int(x) for x in bin_string])
-            for bin_string in keys
-        ])
-        return multivariate_keys, frequencies
-
-    def pdist(self, sample_1, sample_2, norm=2, eps=1e-5):
-        r"""Compute the matrix of all squared pairwise distances.
-        Arguments
-        ---------
-        sample_1 : torch.Tensor or Variable
-            The first sample, should be of shape ``(n_1, d)``.
-        sample_2 : torch.Tensor or Variable
-            The second sample, should be of shape ``(n_2, d)``.
-        norm : float
-            The l_p norm to be used.
-        Returns
-        -------
-        torch.Tensor or Variable
-            Matrix of shape (n_1, n_2). The [i, j]-th entry is equal to
-            ``|| sample_1[i, :] - sample_2[j, :] ||_p``."""
-        n_1, n_2 = sample_1.size(0), sample_2.size(0)
-        norm = float(norm)
-        if norm == 2.:
-            norms_1 = torch.sum(sample_1**2, dim=1, keepdim=True)
-            norms_2 = torch.sum(sample_2**2, dim=1, keepdim=True)
-            norms = (norms_1.expand(n_1, n_2) +
-                    norms_2.transpose(0, 1).expand(n_1, n_2))
-            distances_squared = norms - 2 * sample_1.mm(sample_2.t())
-            return torch.sqrt(eps + torch.abs(distances_squared))
-        else:
-            dim = sample_1.size(1)
-            expanded_1 = sample_1.unsqueeze(1).expand(n_1, n_2, dim)
-            expanded_2 = sample_2.unsqueeze(0).expand(n_1, n_2, dim)
-            differences = torch.abs(expanded_1 - expanded_2) ** norm
-            inner = torch.sum(differences, dim=2, keepdim=False)
-            return (eps + inner) ** (1. / norm)
+        self.result_A = aligned.result_A
+        self.result_B = aligned.result_B
+        freq_A, freq_B = aligned.counts_A, aligned.counts_B
+        distances = self.pdist(aligned.bits)
+        self.statistics = float(self.weighted_energy(
+            distances, freq_A[np.newaxis, :], freq_B[np.newaxis, :])[0])
+        self.p_value = self.permutation_p_value(
+            distances, freq_A, freq_B, random_seed=random_seed)
+        return self.statistics, np.float64(self.p_value)
 
-    def increase_dimension(self, small_matrix, record_frequencies):
-        """Duplicate row and column based on the frquencies.
+    def pdist(self, values, eps=1e-5):
+        """Compute the matrix of all the pairwise euclidean distances.
 
-        Note that record_frequencies contains record like:
+        As the previous torch implementation, eps is added to the squared
+        distances (thus also on the diagonal).
+        """
+        values = values.astype(np.float64)
+        norms = np.sum(values ** 2, axis=1, keepdims=True)
+        distances_squared = norms + norms.T - 2 * values.dot(values.T)
+        return np.sqrt(eps + np.abs(distances_squared))
 
-        7: 128,
+    def weighted_energy(self, distances, freq_1, freq_2):
+        """Energy statistic of each row of frequencies (shape (k, u)).
 
-        which means that the row and column 7 have to be replicated 128 times,
-        vertically and horizontally respectively.
+        With D the distance matrix of the outcomes and w_1, w_2 the
+        frequencies summing to n_1, n_2 it is:
+        2 w_1 D w_2 / (n_1 n_2) - w_1 D w_1 / n_1^2 - w_2 D w_2 / n_2^2
         """
-        repeat_tensor = torch.tensor(np.array(record_frequencies))
-        # print(repeat_tensor)
-        small_matrix = torch.repeat_interleave(small_matrix, repeat_tensor, dim=1)
-        small_matrix = torch.repeat_interleave(small_matrix, repeat_tensor, dim=0)
-        # print(small_matrix)
-        return small_matrix
-
-    def energy_call(self, res_1, res_2):
-
-            values_1, freq_1 = self.unique_multivariates_and_frequencies(result_dictionary=res_1)
-            values_2, freq_2 = self.unique_multivariates_and_frequencies(result_dictionary=res_2)
-
-
-            values_1 = torch.from_numpy(values_1)
-            values_2 = torch.from_numpy(values_2)
-            sample_12 = torch.cat((values_1, values_2), 0)
-
-            small_matrix = self.pdist(sample_12, sample_12, norm=2)
-            distances = self.increase_dimension(
-                small_matrix=small_matrix,
-                record_frequencies=np.hstack((np.array(freq_1), np.array(freq_2))))
-            #distances = pdist(sample_12, sample_12, norm=2)
-
-            n_1 = sum(freq_1)
-            print("n_1:", n_1)
-            n_2 = sum(freq_2)
-            a00 = - 1. / (n_1 * n_1)
-            a11 = - 1. / (n_2 * n_2)
-            a01 = 1. / (n_1 * n_2)
-            print("a00:", a00)
-            print("a11:", a11)
-            print("a01:", a01)
-
-            d_1 = distances[:n_1, :n_1].sum()
-            d_2 = distances[-n_2:, -n_2:].sum()
-            d_12 = distances[:n_1, -n_2:].sum()
-            print("d_1:", d_1)
-            print("d_2:", d_2)
-            print("d_12:", d_12)
-
-            loss = 2 * a01 * d_12 + a00 * d_1 + a11 * d_2
-            print("loss:", loss)
-            print(type(loss))
-            return loss
+        n_1 = freq_1.sum(axis=1)
+        n_2 = freq_2.sum(axis=1)
+        d_1_all = freq_1.dot(distances)
+        d_12 = np.sum(d_1_all * freq_2, axis=1)
+        d_1 = np.sum(d_1_all * freq_1, axis=1)
+        d_2 = np.sum(freq_2.dot(distances) * freq_2, axis=1)
+        return 2 * d_12 / (n_1 * n_2) - d_1 / n_1 ** 2 - d_2 / n_2 ** 2
+
+    def permutation_p_value(self, distances, freq_A, freq_B,
+                            random_seed=None):
+        """Permutation test p-value of the weighted energy statistic."""
+        rng = np.random.default_rng(random_seed)
+        pooled = freq_A + freq_B
+        n_1 = int(freq_A.sum())
+        observed = self.weighted_energy(
+            distances, freq_A[np.newaxis, :], freq_B[np.newaxis, :])[0]
+        n_greater_equal = 0
+        n_done = 0
+        while n_done < self.n_permutations:
+            size = min(self.batch_size, self.n_permutations - n_done)
+            perm_A = rng.multivariate_hypergeometric(pooled, n_1, size=size)
+            perm_B = pooled[np.newaxis, :] - perm_A
+            perm_stats = self.weighted_energy(distances, perm_A, perm_B)
+            n_greater_equal += int(np.sum(perm_stats >= observed))
+            n_done += size
+        return (1 + n_greater_equal) / (1 + self.n_permutations)
 
 
 class Energy_Detector(Detector):
@@ -223,8 +429,9 @@ class Energy_Detector(Detector):
     def __init__(self):
         self.name = "Energy Statistic"
 
-    def check(self, result_A, result_B, random_seed=None):
+    def check_aligned(self, aligned: AlignedCounts, random_seed=None):
         """Compare two distributions with Energy Test"""
+        import torch
         try:
             from torch_two_sample import statistics_diff
         except ImportError:
@@ -232,7 +439,7 @@ class Energy_Detector(Detector):
                 "torch_two_sample is not installed. " +
                 "Please install it from " +
                 "https://github.com/josipd/torch-two-sample.")
-        self.load_results(result_A, result_B)
+        self.load_results(aligned.result_A, aligned.result_B)
         # convert the binary string in a vector
         n_subsamples = 100
 
@@ -270,3 +477,226 @@ class Energy_Detector(Detector):
         if isinstance(self.statistics, torch.Tensor):
             self.statistics = self.statistics.item()
         return self.statistics, self.p_value
+
+
+def total_variation_distance(distribution_A, distribution_B):
+    """Total variation distance of two probability dictionaries."""
+    outcomes = set(distribution_A.keys()) | set(distribution_B.keys())
+    return 0.5 * sum(
+        abs(distribution_A.get(o, 0.) - distribution_B.get(o, 0.))
+        for o in outcomes)
+
+
+def hellinger_distance(distribution_A, distribution_B):
+    """Hellinger distance of two probability dictionaries."""
+    outcomes = set(distribution_A.keys()) | set(distribution_B.keys())
+    squared = 0.5 * sum(
+        (np.sqrt(distribution_A.get(o, 0.)) -
+         np.sqrt(distribution_B.get(o, 0.))) ** 2
+        for o in outcomes)
+    return float(np.sqrt(squared))
+
+
+class ExactDistance_Detector(object):
+    """Compare two exact distributions (probabilities, not counts).
+
+    There is no sampling error, thus the distributions diverge if their
+    distance is above the numerical tolerance. As for the energy
+    detectors, the p-value encodes the decision: 0 (divergent) or 1.
+    """
+
+    DISTANCES = {
+        "total_variation": total_variation_distance,
+        "hellinger": hellinger_distance,
+    }
+
+    def __init__(self, distance: str = "total_variation",
+                 tolerance: float = 1e-6):
+        self.name = f"Exact Distance ({distance})"
+        self.distance = self.DISTANCES[distance]
+        self.tolerance = tolerance
+
+    def check(self, result_A, result_B, random_seed=None):
+        """Compare two exact distributions with their distance."""
+        self.result_A = result_A
+        self.result_B = result_B
+        self.statistics = self.distance(result_A, result_B)
+        self.p_value = 0. if self.statistics > self.tolerance else 1.
+        return self.statistics, np.float64(self.p_value)
+
+
+def align_with_reference(reference, result):
+    """Align the counts of a result to the probabilities of a reference.
+
+    It returns the sorted union of the outcomes and the probability and
+    count vectors on them.
+    """
+    outcomes = sorted(set(reference.keys()) | set(result.keys()))
+    probabilities = np.array(
+        [reference.get(o, 0.) for o in outcomes], dtype=np.float64)
+    counts = np.array([result.get(o, 0) for o in outcomes], dtype=np.int64)
+    return outcomes, probabilities / probabilities.sum(), counts
+
+
+class ReferenceDetector(ABC):
+    """Check if a sample comes from an exact reference distribution.
+
+    Compared to the two-sample detectors, only the follow-up is sampled,
+    and the test is more powerful at the same number of shots. An outcome
+    with null reference probability is enough to reject (p-value 0).
+    """
+
+    def check_reference(self, reference, result, random_seed=None):
+        """Test the counts of the result against the reference."""
+        self.reference = reference
+        self.result = result
+        outcomes, probabilities, counts = \
+            align_with_reference(reference, result)
+        if np.any(counts[probabilities == 0] > 0):
+            self.statistics, self.p_value = np.inf, 0.
+        else:
+            self.statistics, self.p_value = self.test(
+                probabilities, counts, random_seed=random_seed)
+        return self.statistics, np.float64(self.p_value)
+
+    @abstractmethod
+    def test(self, probabilities, counts, random_seed=None):
+        """Test the aligned counts against the aligned probabilities."""
+        pass
+
+
+class KS_GoF_Detector(ReferenceDetector):
+    """One-sample KS test on the sorted outcomes (as KS_Detector).
+
+    The p-value of the continuous case is conservative for a discrete
+    reference.
+    """
+
+    def __init__(self):
+        self.name = "Kolmogorov–Smirnov Goodness of Fit Test"
+
+    def test(self, probabilities, counts, random_seed=None):
+        n = int(counts.sum())
+        statistic = np.max(np.abs(
+            np.cumsum(counts) / n - np.cumsum(probabilities)))
+        return statistic, kstwo.sf(statistic, n)
+
+
+class ChiSquareGoF_Detector(ReferenceDetector):
+    """Chi-square goodness of fit test.
+
+    The cells whose expected count is below min_expected are merged in a
+    single cell, as in ChiSquare_Detector.
+    """
+
+    def __init__(self, min_expected: int = 5):
+        self.name = "Chi-Square Goodness of Fit Test"
+        self.min_expected = min_expected
+
+    def test(self, probabilities, counts, random_seed=None):
+        expected = probabilities * counts.sum()
+        sparse = (expected > 0) & (expected < self.min_expected)
+        dense = (expected > 0) & ~sparse
+        obs = np.append(counts[dense], counts[sparse].sum())
+        exp = np.append(expected[dense], expected[sparse].sum())
+        obs, exp = obs[exp > 0], exp[exp > 0]
+        statistic = np.sum((obs - exp) ** 2 / exp)
+        dof = len(exp) - 1
+        p_value = chi2.sf(statistic, dof) if dof > 0 else 1.
+        return statistic, p_value
+
+
+class MultinomialGoF_Detector(ReferenceDetector):
+    """Monte Carlo version of the exact multinomial test.
+
+    The statistic is the likelihood ratio (G statistic) and its null
+    distribution is estimated with n_samples multinomial samples of the
+    reference, thus it is valid also with many rare outcomes.
+    """
+
+    def __init__(self, n_samples: int = 1000, batch_size: int = 100):
+        self.name = "Multinomial Goodness of Fit Test (Monte Carlo)"
+        self.n_samples = n_samples
+        self.batch_size = batch_size
+
+    def g_statistic(self, probabilities, counts):
+        """G statistic of each row of counts (shape (k, u))."""
+        n = counts.sum(axis=1, keepdims=True)
+        expected = n * probabilities[np.newaxis, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = np.where(
+                counts > 0, counts * np.log(counts / expected), 0.)
+        return 2 * terms.sum(axis=1)
+
+    def test(self, probabilities, counts, random_seed=None):
+        rng = np.random.default_rng(random_seed)
+        n = int(counts.sum())
+        observed = self.g_statistic(probabilities, counts[np.newaxis, :])[0]
+        n_greater_equal = 0
+        n_done = 0
+        while n_done < self.n_samples:
+            size = min(self.batch_size, self.n_samples - n_done)
+            samples = rng.multinomial(n, probabilities, size=size)
+            n_greater_equal += int(np.sum(
+                self.g_statistic(probabilities, samples) >= observed))
+            n_done += size
+        return observed, (1 + n_greater_equal) / (1 + self.n_samples)
+
+
+DETECTORS_REGISTRY = {
+    "KS_Detector": KS_Detector,
+    "JS_Detector": JS_Detector,
+    "ChiSquare_Detector": ChiSquare_Detector,
+    "Faster_Energy_Detector": Faster_Energy_Detector,
+    "Energy_Detector": Energy_Detector,
+}
+
+# one-sample counterpart of each detector, to test against an exact
+# reference distribution (a detector config can choose another one with
+# the key reference_detector_object)
+REFERENCE_DETECTORS_REGISTRY = {
+    "KS_Detector": KS_GoF_Detector,
+    "ChiSquare_Detector": ChiSquareGoF_Detector,
+    "KS_GoF_Detector": KS_GoF_Detector,
+    "ChiSquareGoF_Detector": ChiSquareGoF_Detector,
+    "MultinomialGoF_Detector": MultinomialGoF_Detector,
+}
+
+_DETECTOR_INSTANCES = {}
+
+
+def get_detector(detector_object: str,
+                 kwargs: Dict[str, Any] = None) -> Detector:
+    """Get the (shared) instance of the detector with the given class name.
+
+    The detector_object is the name of the class in the config file and
+    kwargs the arguments of its constructor (the kwargs of the detector in
+    the config file, e.g. n_permutations of Faster_Energy_Detector). The
+    instance is created at the first request and reused afterwards.
+    """
+    if detector_object not in DETECTORS_REGISTRY:
+        raise ValueError(
+            f"Unknown detector: {detector_object}. " +
+            f"Available: {list(DETECTORS_REGISTRY.keys())}")
+    kwargs = kwargs or {}
+    key = (detector_object, tuple(sorted(kwargs.items())))
+    if key not in _DETECTOR_INSTANCES:
+        _DETECTOR_INSTANCES[key] = DETECTORS_REGISTRY[detector_object](
+            **kwargs)
+    return _DETECTOR_INSTANCES[key]
+
+
+def get_reference_detector(detector_config: Dict[str, str]) -> ReferenceDetector:
+    """Get the (shared) one-sample detector of the detector config.
+
+    It returns None if the detector has no one-sample counterpart.
+    """
+    detector_object = detector_config.get(
+        "reference_detector_object", detector_config["detector_object"])
+    if detector_object not in REFERENCE_DETECTORS_REGISTRY:
+        return None
+    key = f"reference.{detector_object}"
+    if key not in _DETECTOR_INSTANCES:
+        _DETECTOR_INSTANCES[key] = \
+            REFERENCE_DETECTORS_REGISTRY[detector_object]()
+    return _DETECTOR_INSTANCES[key]
@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+from scipy.stats import chi2_contingency
+from scipy.stats import ks_2samp
+
+from lib.detectors import AlignedCounts
+from lib.detectors import ChiSquare_Detector
+from lib.detectors import Faster_Energy_Detector
+from lib.detectors import KS_MAX_AUTO_N
+from lib.detectors import get_detector
+from lib.detectors import ks_2samp_aligned
+from lib.detectors import obtain_raw_samples
+
+
+def random_counts(rng, n_shots: int, n_qubits: int = 4, skew: float = 1.):
+    """Random counts of n_shots over the bitstrings of n_qubits."""
+    probabilities = rng.dirichlet(np.ones(2 ** n_qubits) * skew)
+    frequencies = rng.multinomial(n_shots, probabilities)
+    return {
+        format(i, f"0{n_qubits}b"): int(freq)
+        for i, freq in enumerate(frequencies) if freq > 0
+    }
+
+
+def assert_same_as_ks_2samp(counts_A, counts_B):
+    statistic, p_value = ks_2samp_aligned(AlignedCounts(counts_A, counts_B))
+    # on the raw samples (as integers: same order of the bitstrings)
+    expected = ks_2samp(
+        obtain_raw_samples(counts_A, representation='natural'),
+        obtain_raw_samples(counts_B, representation='natural'))
+    assert statistic == pytest.approx(expected.statistic, abs=1e-12)
+    assert p_value == pytest.approx(expected.pvalue, rel=1e-9, abs=1e-12)
+
+
+@pytest.mark.parametrize("n_A, n_B", [(30, 50), (700, 1000), (1000, 1000)])
+def test_ks_2samp_aligned_exact_regime(n_A, n_B):
+    rng = np.random.default_rng(n_A + n_B)
+    for skew in [0.3, 1., 10.]:
+        assert_same_as_ks_2samp(
+            random_counts(rng, n_A, skew=skew),
+            random_counts(rng, n_B, skew=skew))
+
+
+@pytest.mark.parametrize("n_A, n_B", [
+    (KS_MAX_AUTO_N, KS_MAX_AUTO_N - 1),
+    (KS_MAX_AUTO_N + 1, KS_MAX_AUTO_N),
+    (50000, 20000)])
+def test_ks_2samp_aligned_around_and_beyond_exact_limit(n_A, n_B):
+    rng = np.random.default_rng(n_A)
+    assert_same_as_ks_2samp(
+        random_counts(rng, n_A), random_counts(rng, n_B))
+
+
+def test_ks_2samp_aligned_identical_and_disjoint():
+    counts = {"00": 40, "01": 60, "11": 20}
+    assert_same_as_ks_2samp(counts, counts)
+    assert_same_as_ks_2samp({"00": 100}, {"11": 80})
+
+
+def test_ks_2samp_aligned_empty_result():
+    with pytest.raises(ValueError):
+        ks_2samp_aligned(AlignedCounts({}, {"0": 10}))
+
+
+def test_get_detector_passes_the_kwargs():
+    detector = get_detector(
+        "Faster_Energy_Detector", kwargs={"n_permutations": 99})
+    assert detector.n_permutations == 99
+    assert get_detector("Faster_Energy_Detector").n_permutations == 1000
+    assert get_detector(
+        "Faster_Energy_Detector", kwargs={"n_permutations": 99}) is detector
+
+
+def test_energy_p_value_floor_is_one_over_n_permutations_plus_one():
+    detector = Faster_Energy_Detector(n_permutations=199)
+    _, p_value = detector.check({"00": 500}, {"11": 500}, random_seed=1)
+    assert p_value == pytest.approx(1 / 200)
+
+
+def dense_counts(rng, n_outcomes: int, n_shots: int):
+    """Counts where every outcome is frequent (no cell to merge)."""
+    probabilities = rng.dirichlet(np.ones(n_outcomes) * 20)
+    return {
+        format(i, "03b"): int(freq) for i, freq in
+        enumerate(rng.multinomial(n_shots, probabilities))}
+
+
+@pytest.mark.parametrize("n_outcomes", [2, 4, 8])
+def test_chi_square_as_chi2_contingency_on_dense_tables(n_outcomes):
+    rng = np.random.default_rng(n_outcomes)
+    for n_A, n_B in [(1000, 1000), (2000, 700)]:
+        counts_A = dense_counts(rng, n_outcomes, n_A)
+        counts_B = dense_counts(rng, n_outcomes, n_B)
+        statistic, p_value = ChiSquare_Detector().check_aligned(
+            AlignedCounts(counts_A, counts_B))
+        expected = chi2_contingency([
+            [counts_A[k] for k in sorted(counts_A)],
+            [counts_B[k] for k in sorted(counts_A)]], correction=False)
+        assert statistic == pytest.approx(expected[0])
+        assert p_value == pytest.approx(expected[1])
+
+
+def test_chi_square_merges_the_rare_outcomes():
+    counts_A = {"00": 500, "01": 480, "10": 3, "11": 2}
+    counts_B = {"00": 470, "01": 510, "10": 4, "11": 1}
+    statistic, p_value = ChiSquare_Detector().check_aligned(
+        AlignedCounts(counts_A, counts_B))
+    expected = chi2_contingency(
+        [[500, 480, 5], [470, 510, 5]], correction=False)
+    assert statistic == pytest.approx(expected[0])
+    assert p_value == pytest.approx(expected[1])
+
+
+def test_chi_square_folds_an_under_filled_merged_cell():
+    # the merged cell of the single rare outcome is still below 5
+    counts_A = {"00": 500, "01": 300, "11": 1}
+    counts_B = {"00": 520, "01": 280}
+    statistic, p_value = ChiSquare_Detector().check_aligned(
+        AlignedCounts(counts_A, counts_B))
+    expected = chi2_contingency(
+        [[500, 301], [520, 280]], correction=False)
+    assert statistic == pytest.approx(expected[0])
+    assert p_value == pytest.approx(expected[1])
+
+
+def test_chi_square_batch_as_single_pairs():
+    rng = np.random.default_rng(0)
+    pairs = [
+        (random_counts(rng, n_A, skew=skew), random_counts(rng, n_B))
+        for n_A, n_B, skew in [
+            (1000, 1000, 1.), (500, 2000, 0.3), (50, 80, 0.1),
+            (3000, 3000, 10.)]]
+    pairs.append(({"0000": 100}, {"1111": 100}))
+    detector = ChiSquare_Detector()
+    statistics, p_values = detector.check_batch(pairs)
+    for (counts_A, counts_B), statistic, p_value in zip(
+            pairs, statistics, p_values):
+        expected = detector.check_aligned(AlignedCounts(counts_A, counts_B))
+        assert statistic == pytest.approx(expected[0])
+        assert p_value == pytest.approx(expected[1])
@@ -0,0 +1,129 @@
+"""Exact output distribution of small circuits (no sampling).
+
+For a circuit whose measurements are all at the end, the distribution of
+its counts is given by the statevector of its unitary part, thus we can
+compute it exactly instead of sampling thousands of shots.
+"""
+
+from collections import OrderedDict
+import hashlib
+from typing import Dict, List, Any, Tuple
+
+import numpy as np
+from qiskit import QuantumCircuit
+from qiskit.quantum_info import Statevector
+
+
+# instructions that do not change the state of the qubits
+NO_OP_INSTRUCTIONS = ["barrier", "delay", "id"]
+
+
+def get_measurement_map(circuit: QuantumCircuit) -> Dict[int, int]:
+    """Get the measured qubit of each classical bit (by their indices).
+
+    It returns None if the circuit cannot be simulated exactly via its
+    statevector: a gate after the measurement of one of its qubits
+    (mid-circuit measurement), a conditional gate or a reset.
+    """
+    qubit_index = {qubit: i for i, qubit in enumerate(circuit.qubits)}
+    clbit_index = {clbit: i for i, clbit in enumerate(circuit.clbits)}
+    measurement_map = {}
+    for instruction, qargs, cargs in circuit.data:
+        qubits = [qubit_index[q] for q in qargs]
+        if instruction.name == "measure":
+            measurement_map[clbit_index[cargs[0]]] = qubits[0]
+        elif instruction.name in NO_OP_INSTRUCTIONS:
+            continue
+        elif (instruction.name == "reset" or
+                getattr(instruction, "condition", None) is not None or
+                len(set(qubits) & set(measurement_map.values())) > 0):
+            return None
+    return measurement_map
+
+
+def is_exactly_simulable(circuit: QuantumCircuit, max_qubits: int = 20):
+    """Check if the output distribution of the circuit can be exact."""
+    return (circuit.num_qubits <= max_qubits and
+            get_measurement_map(circuit) is not None)
+
+
+def format_outcome(clbit_values: List[int],
+                   circuit: QuantumCircuit,
+                   clbit_index: Dict[Any, int]) -> str:
+    """Format the classical bits as the keys of get_counts.
+
+    One bitstring per classical register (last bit on the left), the first
+    register is on the right and the registers are separated by a space.
+    """
+    return " ".join([
+        "".join([str(clbit_values[clbit_index[clbit]])
+                 for clbit in reversed(list(creg))])
+        for creg in reversed(circuit.cregs)
+    ])
+
+
+def get_exact_probabilities(
+        circuit: QuantumCircuit,
+        min_probability: float = 1e-12) -> Dict[str, float]:
+    """Get the exact probability of each outcome (formatted as get_counts).
+
+    The outcomes with a probability below min_probability are dropped. A
+    qubit measured in several classical bits writes the same value in all
+    of them.
+    """
+    measurement_map = get_measurement_map(circuit)
+    if measurement_map is None:
+        raise ValueError("The circuit has mid-circuit measurements.")
+    clbit_index = {clbit: i for i, clbit in enumerate(circuit.clbits)}
+    if len(measurement_map) == 0:
+        return {format_outcome(
+            [0] * len(circuit.clbits), circuit, clbit_index): 1.}
+    qubits = sorted(set(measurement_map.values()))
+    position = {qubit: i for i, qubit in enumerate(qubits)}
+    unitary_part = circuit.remove_final_measurements(inplace=False)
+    probabilities = Statevector(unitary_part).probabilities(qargs=qubits)
+    distribution = {}
+    for outcome in np.flatnonzero(probabilities >= min_probability):
+        clbit_values = [0] * len(circuit.clbits)
+        for clbit, qubit in measurement_map.items():
+            clbit_values[clbit] = (int(outcome) >> position[qubit]) & 1
+        key = format_outcome(clbit_values, circuit, clbit_index)
+        distribution[key] = \
+            distribution.get(key, 0) + float(probabilities[outcome])
+    return distribution
+
+
+def hash_program(source_code: str) -> str:
+    """Hash of the source code of a program (key of its distribution)."""
+    return hashlib.sha256(source_code.encode("utf-8")).hexdigest()
+
+
+class ProgramResultCache(object):
+    """LRU cache of what we know exactly about programs, by their hash.
+
+    E.g. the exact distribution of a source program: all the follow-ups
+    of the source reuse it. A negative answer (e.g. None: the source
+    cannot be simulated exactly) is cached too, to not try again.
+    """
+
+    def __init__(self, max_size: int = 128):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key: str) -> Tuple[bool, Any]:
+        """Return whether the key is cached, and its value."""
+        if key not in self.entries:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return True, self.entries[key]
+
+    def put(self, key: str, value: Any):
+        """Store the value, evicting the least recently used."""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
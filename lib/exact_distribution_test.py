@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+from qiskit import Aer
+from qiskit import ClassicalRegister
+from qiskit import QuantumCircuit
+from qiskit import QuantumRegister
+from qiskit import transpile
+from qiskit.circuit.random import random_circuit
+
+from lib.exact_distribution import get_exact_probabilities
+from lib.exact_distribution import get_measurement_map
+from lib.exact_distribution import is_exactly_simulable
+
+
+N_SHOTS = 20000
+
+
+def sample(circuit, seed=42):
+    """Counts of the circuit on Aer (with a seed)."""
+    backend = Aer.get_backend("aer_simulator")
+    return backend.run(
+        transpile(circuit, backend), shots=N_SHOTS,
+        seed_simulator=seed).result().get_counts()
+
+
+def assert_as_sampled(circuit):
+    """The exact distribution explains the counts of the circuit."""
+    exact = get_exact_probabilities(circuit)
+    counts = sample(circuit)
+    assert sum(exact.values()) == pytest.approx(1.)
+    # same format of the keys (registers, spaces, order of the bits)
+    assert set(counts.keys()) <= set(exact.keys())
+    total_variation = 0.5 * sum(
+        abs(exact.get(k, 0) - counts.get(k, 0) / N_SHOTS)
+        for k in set(exact) | set(counts))
+    assert total_variation < 0.03
+
+
+def random_unitary_part(rng, n_qubits, depth=4):
+    return random_circuit(
+        n_qubits, depth, max_operands=2, seed=int(rng.integers(1e6)))
+
+
+@pytest.mark.parametrize("n_qubits", [1, 2, 3, 4])
+def test_exact_probabilities_of_random_circuits(n_qubits):
+    rng = np.random.default_rng(n_qubits)
+    for _ in range(3):
+        circuit = random_unitary_part(rng, n_qubits)
+        circuit.measure_all()
+        assert_as_sampled(circuit)
+
+
+def test_exact_probabilities_of_multiple_registers():
+    rng = np.random.default_rng(0)
+    qr = QuantumRegister(4, "qr")
+    cr_1, cr_2 = ClassicalRegister(1, "c1"), ClassicalRegister(3, "c2")
+    circuit = QuantumCircuit(qr, cr_1, cr_2)
+    circuit.compose(random_unitary_part(rng, 4), inplace=True)
+    circuit.measure(qr[2], cr_1[0])
+    circuit.measure([qr[0], qr[3], qr[1]], [cr_2[2], cr_2[0], cr_2[1]])
+    assert all(len(k.split(" ")) == 2 for k in get_exact_probabilities(
+        circuit))
+    assert_as_sampled(circuit)
+
+
+def test_exact_probabilities_of_partial_measurement():
+    rng = np.random.default_rng(1)
+    qr, cr = QuantumRegister(4, "qr"), ClassicalRegister(3, "cr")
+    circuit = QuantumCircuit(qr, cr)
+    circuit.compose(random_unitary_part(rng, 4), inplace=True)
+    # a qubit not measured, a classical bit never written
+    circuit.measure([qr[3], qr[1]], [cr[0], cr[2]])
+    assert all(k[1] == "0" for k in get_exact_probabilities(circuit))
+    assert_as_sampled(circuit)
+
+
+def test_exact_probabilities_of_qubit_measured_twice():
+    circuit = QuantumCircuit(2, 3)
+    circuit.h(0)
+    circuit.cx(0, 1)
+    circuit.measure(0, 0)
+    circuit.measure(0, 2)
+    circuit.measure(1, 1)
+    assert get_exact_probabilities(circuit) == pytest.approx(
+        {"000": 0.5, "111": 0.5})
+    assert_as_sampled(circuit)
+
+
+def test_exact_probabilities_without_measurements():
+    circuit = QuantumCircuit(2, 2)
+    circuit.h(0)
+    assert get_exact_probabilities(circuit) == {"00": 1.}
+
+
+def test_measurement_map_of_final_measurements():
+    circuit = QuantumCircuit(3, 2)
+    circuit.h(0)
+    circuit.measure(2, 0)
+    circuit.barrier()
+    circuit.measure(0, 1)
+    assert get_measurement_map(circuit) == {0: 2, 1: 0}
+    assert is_exactly_simulable(circuit)
+    assert not is_exactly_simulable(circuit, max_qubits=2)
+
+
+def test_measurement_map_of_gate_after_measure():
+    circuit = QuantumCircuit(2, 2)
+    circuit.measure(0, 0)
+    circuit.cx(0, 1)
+    circuit.measure(1, 1)
+    assert get_measurement_map(circuit) is None
+    with pytest.raises(ValueError):
+        get_exact_probabilities(circuit)
+
+
+def test_measurement_map_of_reset():
+    circuit = QuantumCircuit(1, 1)
+    circuit.h(0)
+    circuit.reset(0)
+    circuit.measure(0, 0)
+    assert get_measurement_map(circuit) is None
+
+
+def test_measurement_map_of_conditional_gate():
+    circuit = QuantumCircuit(2, 2)
+    circuit.h(0)
+    circuit.x(1).c_if(circuit.clbits[0], 1)
+    circuit.measure([0, 1], [0, 1])
+    assert get_measurement_map(circuit) is None
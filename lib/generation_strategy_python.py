@@ -17,6 +17,9 @@ import random
 
 class Fuzzer(ABC):
 
+    # whether it can generate programs as objects (generate_program_object)
+    supports_object_mode = False
+
     def __init__(self):
         pass
 
@@ -92,6 +95,8 @@ class Fuzzer(ABC):
 
 class QiskitFuzzer(Fuzzer):
 
+    supports_object_mode = True
+
     def circuit_prologue(self):
         prologue = "\n# SECTION\n# NAME: PROLOGUE\n\n"
         prologue += "import qiskit\n"
@@ -133,15 +138,43 @@ class QiskitFuzzer(Fuzzer):
     def _generate_n_params(self, n_params: int):
         numeric_prams = np.random.uniform(
             low=0, high=2 * math.pi, size=n_params)
-        str_params = [str(e) for e in numeric_prams]
-        return ",".join(str_params)
+        return self.format_params(numeric_prams)
 
     def _generate_n_qubits(self, register_name: str, n_qubits: int, total_qubits: int):
         if total_qubits == 0:
             return ""
         numeric_qubits = np.random.choice(np.arange(total_qubits), n_qubits, replace=False)
-        str_qubits = [f"{register_name}[{e}]" for e in numeric_qubits]
-        return ", ".join(str_qubits)
+        return self.format_qubits(register_name, numeric_qubits)
+
+    def format_params(self, params: List[float]) -> str:
+        """Format the parameters of a gate (as its arguments)."""
+        return ",".join([str(e) for e in params])
+
+    def format_qubits(self, register_name: str, qubits: List[int]) -> str:
+        """Format the qubits of a gate (as its qargs)."""
+        return ", ".join([f"{register_name}[{e}]" for e in qubits])
+
+    def circuit_declaration(
+            self, id_circuit: str, id_quantum_reg: str,
+            id_classical_reg: str, n_qubits: int,
+            only_circuit: bool = False,
+            disable_section_header: bool = False) -> str:
+        """Emit the header of the CIRCUIT section: registers and circuit."""
+        if disable_section_header:
+            source_code = ""
+        else:
+            source_code = "\n# SECTION\n# NAME: CIRCUIT\n\n"
+        if not only_circuit:
+            source_code += f"{id_quantum_reg} = QuantumRegister({n_qubits}, name='{id_quantum_reg}')\n"
+            source_code += f"{id_classical_reg} = ClassicalRegister({n_qubits}, name='{id_classical_reg}')\n"
+        source_code += f"{id_circuit} = QuantumCircuit({id_quantum_reg}, {id_classical_reg}, name='{id_circuit}')\n"
+        return source_code
+
+    def circuit_append(self, id_circuit: str, gate_name: str,
+                       list_params: str, list_involved_qubits: str) -> str:
+        """Emit the append of a gate (parameters and qubits formatted)."""
+        return f'{id_circuit}.append({gate_name}({list_params}), ' + \
+            f'qargs=[{list_involved_qubits}], cargs=[])\n'
 
     def generate_circuit_via_atomic_ops(
             self,
@@ -168,11 +201,6 @@ class QiskitFuzzer(Fuzzer):
         """
         # DISABLED BECAUSE IT IS FIXED AT OBJECT INITIALIZATION TIME
         # np.random.seed(self.random_seed)
-        if disable_section_header:
-            source_code = ""
-        else:
-            source_code = "\n# SECTION\n# NAME: CIRCUIT\n\n"
-
         id_quantum_reg = "qr_" + uuid.uuid4().hex
         id_classical_reg = "cr_" + uuid.uuid4().hex
         id_circuit = "c_" + uuid.uuid4().hex
@@ -183,10 +211,10 @@ class QiskitFuzzer(Fuzzer):
         if force_classical_reg_identifier is not None:
             id_classical_reg = force_classical_reg_identifier
 
-        if not only_circuit:
-            source_code += f"{id_quantum_reg} = QuantumRegister({n_qubits}, name='{id_quantum_reg}')\n"
-            source_code += f"{id_classical_reg} = ClassicalRegister({n_qubits}, name='{id_classical_reg}')\n"
-        source_code += f"{id_circuit} = QuantumCircuit({id_quantum_reg}, {id_classical_reg}, name='{id_circuit}')\n"
+        source_code = self.circuit_declaration(
+            id_circuit, id_quantum_reg, id_classical_reg, n_qubits,
+            only_circuit=only_circuit,
+            disable_section_header=disable_section_header)
 
         # on very small circuits some gates cannot be used because we do not
         # have enough qubits
@@ -199,18 +227,16 @@ class QiskitFuzzer(Fuzzer):
             # we add operations only if we have at least one qubit
             for i_op in range(n_ops):
                 op = np.random.choice(compatible_gate_set, 1)[0]
-                i_instr = f'{id_circuit}.append({op["name"]}('
                 gates_in_circuit.add(op["name"])
+                list_params = ""
                 if op["n_params"] > 0:
-                    list_params: str = self._generate_n_params(n_params=op["n_params"])
-                    i_instr += f'{list_params}'
+                    list_params = self._generate_n_params(n_params=op["n_params"])
                 list_involved_qubits: str = self._generate_n_qubits(
                     register_name=id_quantum_reg,
                     n_qubits=op["n_bits"],
                     total_qubits=n_qubits)
-                i_instr += f'), qargs=[{list_involved_qubits}], cargs=[])\n'
-
-                source_code += i_instr
+                source_code += self.circuit_append(
+                    id_circuit, op["name"], list_params, list_involved_qubits)
 
         metadata = {
             "circuit_id": id_circuit,
@@ -222,9 +248,50 @@ class QiskitFuzzer(Fuzzer):
 
         return source_code, metadata
 
+    def generate_program_object(
+            self,
+            gate_set: List[Dict[str, Any]],
+            n_qubits: int,
+            n_ops: int,
+            backend: str,
+            shots: int,
+            level_auto_optimization: int,
+            target_gates: List[str]):
+        """Generate the program as an object (see generate_file).
+
+        The circuit is the list of operations, drawn as in
+        generate_circuit_via_atomic_ops, thus no source code is produced.
+        """
+        from lib.circuit_object import ObjectProgram
+        compatible_gate_set = [
+            g for g in gate_set if n_qubits >= g["n_bits"]]
+        operations = []
+        if n_qubits > 0:
+            for i_op in range(n_ops):
+                op = np.random.choice(compatible_gate_set, 1)[0]
+                params = list(np.random.uniform(
+                    low=0, high=2 * math.pi, size=op["n_params"]))
+                qubits = [int(q) for q in np.random.choice(
+                    np.arange(n_qubits), op["n_bits"], replace=False)]
+                operations.append((op["name"], params, qubits))
+        program = ObjectProgram(
+            n_qubits=n_qubits, operations=operations,
+            opt_level=level_auto_optimization, target_gates=target_gates,
+            backend=backend, shots=shots)
+        metadata = {
+            "circuit_id": program.circuit_id,
+            "id_quantum_reg": program.id_quantum_reg,
+            "id_classical_reg": program.id_classical_reg,
+            "gate_set": compatible_gate_set,
+            "gates_in_circuit": list(set([op[0] for op in operations]))
+        }
+        return program, metadata
+
 
 class QiskitSeparableFuzzer(QiskitFuzzer):
 
+    supports_object_mode = False
+
     def generate_circuit_via_atomic_ops(
             self,
             gate_set: List[Dict[str, Any]],
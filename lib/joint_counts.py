@@ -0,0 +1,105 @@
+"""Joint output of independent partitions, from the counts of each one.
+
+The follow-up of RunIndependentPartitions runs each partition as its own
+circuit. Their joint output is the product of the partition outputs, but
+the product of the counts has as many outcomes as the product of their
+distinct outcomes and as many shots as the product of their shots. Here
+each partition is an integer-coded array (outcome index -> frequency):
+- a sampled joint output of exactly n shots pairs n shots of each
+    partition at random (the shots of a partition are independent, thus a
+    random pairing is a sample of the joint distribution), with no joint
+    outcome built beyond the (at most n) observed ones;
+- an exact joint distribution (partitions of probabilities) is the
+    Kronecker product of the probability vectors, computed on request.
+"""
+
+from typing import Dict, List
+
+import numpy as np
+
+
+class PartitionCounts(object):
+    """Counts of a partition as outcomes and an array of frequencies."""
+
+    def __init__(self, counts: Dict[str, float]):
+        self.outcomes = list(counts.keys())
+        self.frequencies = np.array(list(counts.values()))
+
+    @property
+    def total(self):
+        return self.frequencies.sum()
+
+    def is_sampled(self) -> bool:
+        """Check if the frequencies are shot counts (not probabilities)."""
+        return np.issubdtype(self.frequencies.dtype, np.integer)
+
+    def draw_codes(self, n_shots: int) -> np.ndarray:
+        """Draw the codes of n_shots of this partition.
+
+        They are a random subset of its shots if it has enough of them,
+        otherwise they are resampled from its empirical distribution.
+        """
+        if self.total >= n_shots:
+            codes = np.repeat(
+                np.arange(len(self.outcomes)), self.frequencies)
+            return np.random.permutation(codes)[:n_shots]
+        return np.random.choice(
+            len(self.outcomes), size=n_shots,
+            p=self.frequencies / self.total)
+
+
+class JointCounts(object):
+    """Joint output of independent partitions.
+
+    The first partition is the rightmost part of the joint outcomes (the
+    lower qubit indices, as in the counts of Qiskit).
+    """
+
+    def __init__(self, partition_counts: List[Dict[str, float]]):
+        self.partitions = [PartitionCounts(c) for c in partition_counts]
+
+    @property
+    def n_outcomes(self) -> int:
+        """Number of joint outcomes of the full product."""
+        return int(np.prod([len(p.outcomes) for p in self.partitions]))
+
+    def is_sampled(self) -> bool:
+        return all(p.is_sampled() for p in self.partitions)
+
+    def get_outcome(self, codes: List[int]) -> str:
+        """Join the outcomes of the partitions (given by their codes)."""
+        return "".join([
+            partition.outcomes[code] for partition, code in
+            reversed(list(zip(self.partitions, codes)))])
+
+    def sample(self, n_shots: int = None) -> Dict[str, int]:
+        """Sample the joint counts of exactly n_shots.
+
+        By default n_shots is the smallest number of shots of a partition.
+        """
+        if n_shots is None:
+            n_shots = int(min(p.total for p in self.partitions))
+        codes = np.stack([p.draw_codes(n_shots) for p in self.partitions],
+                         axis=1)
+        unique_codes, frequencies = np.unique(
+            codes, axis=0, return_counts=True)
+        return {
+            self.get_outcome(row): int(freq)
+            for row, freq in zip(unique_codes, frequencies)
+        }
+
+    def distribution(self) -> Dict[str, float]:
+        """Compute the joint distribution (Kronecker product of the parts)."""
+        probabilities = np.ones(1)
+        for partition in self.partitions:
+            probabilities = np.kron(
+                probabilities, partition.frequencies / partition.total)
+        sizes = [len(p.outcomes) for p in self.partitions]
+        # the code of the last partition varies the fastest (as in the
+        # product of the counts, partition by partition)
+        all_codes = np.stack(np.unravel_index(
+            np.arange(len(probabilities)), sizes), axis=1)
+        return {
+            self.get_outcome(codes): float(probability)
+            for codes, probability in zip(all_codes, probabilities)
+        }
@@ -0,0 +1,75 @@
+from functools import reduce
+
+import numpy as np
+import pytest
+
+from lib.joint_counts import JointCounts
+
+
+def reconstruct(counts):
+    """Full product of the partition counts (as before)."""
+    return reduce(lambda counts_1, counts_2: {
+        k2 + k1: v1 * v2 for k1, v1 in counts_1.items()
+        for k2, v2 in counts_2.items()
+    }, counts)
+
+
+def random_partitions(rng, widths, n_shots=100):
+    """Random counts of n_shots for partitions of the given widths."""
+    partitions = []
+    for n_bits in widths:
+        frequencies = rng.multinomial(
+            n_shots, rng.dirichlet(np.ones(2 ** n_bits)))
+        partitions.append({
+            format(i, f"0{n_bits}b"): int(freq)
+            for i, freq in enumerate(frequencies) if freq > 0})
+    return partitions
+
+
+@pytest.mark.parametrize("widths", [[1], [2, 1], [1, 2, 3], [3, 1, 1, 2]])
+def test_distribution_as_full_product(widths):
+    rng = np.random.default_rng(len(widths))
+    partitions = random_partitions(rng, widths)
+    expected = reconstruct(partitions)
+    total = sum(expected.values())
+    distribution = JointCounts(partitions).distribution()
+    # same joint outcomes (k2 + k1: the first partition on the right)
+    assert list(distribution.keys()) == list(expected.keys())
+    for outcome, freq in expected.items():
+        assert distribution[outcome] == pytest.approx(freq / total)
+
+
+def test_distribution_of_probabilities():
+    partitions = [{"0": 0.25, "1": 0.75}, {"10": 0.5, "01": 0.5}]
+    assert JointCounts(partitions).distribution() == {
+        "100": 0.125, "010": 0.125, "101": 0.375, "011": 0.375}
+
+
+@pytest.mark.parametrize("widths", [[2, 1], [1, 2, 3]])
+def test_sample_of_the_full_product(widths):
+    np.random.seed(0)
+    rng = np.random.default_rng(0)
+    partitions = random_partitions(rng, widths)
+    joint = JointCounts(partitions)
+    counts = joint.sample()
+    assert sum(counts.values()) == 100
+    assert set(counts.keys()) <= set(reconstruct(partitions).keys())
+    # with all the shots of each partition, its marginal is unchanged
+    offset = 0
+    for partition, n_bits in zip(partitions, widths):
+        marginal = {}
+        for outcome, freq in counts.items():
+            bits = outcome[len(outcome) - offset - n_bits:
+                           len(outcome) - offset]
+            marginal[bits] = marginal.get(bits, 0) + freq
+        assert marginal == partition
+        offset += n_bits
+
+
+def test_sample_of_partitions_with_different_shots():
+    np.random.seed(0)
+    partitions = [{"0": 30, "1": 70}, {"1": 500}]
+    counts = JointCounts(partitions).sample()
+    assert sum(counts.values()) == 100
+    assert counts == {"10": 30, "11": 70}
+    assert sum(JointCounts(partitions).sample(n_shots=300).values()) == 300
@@ -13,7 +13,7 @@ from qiskit import Aer, transpile
 from qiskit.tools.visualization import circuit_drawer
 from qiskit.quantum_info import state_fidelity
 
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, FrozenSet
 import re
 import ast
 import astunparse
@@ -24,12 +24,13 @@ from sys import version_info
 from timeit import default_timer as timer
 
 from copy import deepcopy
+from functools import lru_cache
 
 from lib.generation_strategy_python import *
 from lib.generation_strategy_python import Fuzzer
+from lib.code_normalization import normalize_code
 import re
-import networkx as nx
-from itertools import combinations
+from collections import Counter
 from deprecated import deprecated
 
 
@@ -104,13 +105,19 @@ def add_section(sections: Dict[str, str],
     return new_sections
 
 
+@lru_cache(maxsize=4096)
 def remove_comments(source_code: str) -> str:
     """Remove comments from the source code via ast.
 
     Note that the comments are separated by lines like this:
     # COMMENT
+
+    The result is memoized: the same sections are normalized over and over
+    along a chain of transformations. The code is the same of
+    astunparse.unparse(ast.parse(source_code)), but the plain statements of
+    the generated programs are rendered without the ast round-trip.
     """
-    return astunparse.unparse(ast.parse(source_code))
+    return normalize_code(source_code)
 
 
 def create_random_mapping(qubit_indices: List[int]):
@@ -302,15 +309,19 @@ def create_random_connected_coupling_map(
         adjacency_matrix.row, adjacency_matrix.col)]
 
 
-def get_registers_used(circ_definition: str) -> List[Dict[str, Any]]:
+def get_registers_used(circ_definition: str,
+                       tree: ast.AST = None) -> List[Dict[str, Any]]:
     """Extract the available quantum and classical registers.
 
     For each register in the main program report:
     - the number of qubit used
     - the identifier name
     - the type or register
+
+    Pass the tree if the definition is already parsed.
     """
-    tree = ast.parse(circ_definition)
+    if tree is None:
+        tree = ast.parse(circ_definition)
 
     class RegisterHunter(ast.NodeVisitor):
 
@@ -346,7 +357,8 @@ def get_registers_used(circ_definition: str) -> List[Dict[str, Any]]:
     return register_hunter.get_registers()
 
 
-def get_circuits_used(circ_definition: str) -> List[Dict[str, Any]]:
+def get_circuits_used(circ_definition: str,
+                      tree: ast.AST = None) -> List[Dict[str, Any]]:
     """Extract the available quantum circuits and their registers.
 
     For each quantum circuit in the main program report:
@@ -354,10 +366,13 @@ def get_circuits_used(circ_definition: str) -> List[Dict[str, Any]]:
     - the identifier name
     - the name of its quantum register
     - the name of its classical register
+
+    Pass the tree if the definition is already parsed.
     """
-    tree = ast.parse(circ_definition)
+    if tree is None:
+        tree = ast.parse(circ_definition)
 
-    registers = get_registers_used(circ_definition=circ_definition)
+    registers = get_registers_used(circ_definition=circ_definition, tree=tree)
 
     class CircuitHunter(ast.NodeVisitor):
 
@@ -427,9 +442,12 @@ def to_code(node):
     )(node)
 
 
-def get_instructions(circ_with_instructions: str) -> List[Dict[str, str]]:
+def get_instructions(circ_with_instructions: str,
+                     tree: ast.AST = None) -> List[Dict[str, str]]:
     """Return extract all the instructions with the name of the circuit.
 
+    Pass the tree if the code is already parsed.
+
     Example Input:
     qc_2.append(RZXGate(2.5674333, p_29392d), qargs=[qr_2[2], qr_2[1]], cargs=[])
     qc_1.append(CUGate(p_a7c416, p_53f0d4, 1.1382126210061985, p_b2bdc1), qargs
@@ -517,17 +535,158 @@ def get_instructions(circ_with_instructions: str) -> List[Dict[str, str]]:
 
                 self.instructions.append(new_instr)
 
-    tree = ast.parse(circ_with_instructions)
+    if tree is None:
+        tree = ast.parse(circ_with_instructions)
     instrCollector = InstructionsCollector()
     instrCollector.visit(tree)
 
     return instrCollector.instructions
 
 
+def get_wires(instruction: Dict[str, Any]) -> List[Tuple[str, str, int]]:
+    """Get the wires (circuit, register, qubit) used by the instruction."""
+    return [
+        (instruction["circuit_id"], qreg, qbit)
+        for qreg, qbit in zip(instruction["qregs"], instruction["qbits"])]
+
+
+def is_same_gate_on_same_wires(
+        instruction: Dict[str, Any], other: Dict[str, Any]) -> bool:
+    """Check if the two instructions apply the same gate on the same wires.
+
+    Note that the order of the qubits matters.
+    """
+    if other is None:
+        return False
+    return (instruction["gate"] == other["gate"] and
+            get_wires(instruction) == get_wires(other))
+
+
+def describe_gate_pair(
+        instruction: Dict[str, Any],
+        next_instruction: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe a pair of consecutive gates (as get_consecutive_gates)."""
+    return {
+        "lineno": instruction["lineno"],
+        "end_lineno": instruction["end_lineno"],
+        "next_lineno": next_instruction["lineno"],
+        "next_end_lineno": next_instruction["end_lineno"],
+        "qregs": instruction["qregs"],
+        "qbits": instruction["qbits"],
+        "cregs": instruction["cregs"],
+        "cbits": instruction["cbits"],
+        "circuit_id": instruction["circuit_id"],
+        "gate": instruction["gate"]
+    }
+
+
+def index_consecutive_gates(
+        instructions: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Find the pairs of consecutive gates of all types, by gate name.
+
+    In a single pass over the instructions (in line order) it keeps the
+    last instruction applied on each wire: an instruction forms a pair with
+    the previous one if that is the last instruction on all its wires and
+    it applies the same gate on the same wires.
+    """
+    pairs_by_gate = {}
+    last_on_wire = {}
+    for instruction in sorted(instructions, key=lambda i: i["lineno"]):
+        wires = get_wires(instruction)
+        previous = [last_on_wire.get(wire) for wire in wires]
+        if (len(wires) > 0 and
+                all(p is previous[0] for p in previous) and
+                is_same_gate_on_same_wires(instruction, previous[0])):
+            pairs_by_gate.setdefault(instruction["gate"], []).append(
+                describe_gate_pair(previous[0], instruction))
+        last_on_wire.update({wire: instruction for wire in wires})
+    return pairs_by_gate
+
+
+class QubitClusters(object):
+    """Clusters of the qubits of a circuit that interact with each other.
+
+    It is a union-find over the qubits of the given circuit and register:
+    every instruction joins the clusters of its qubits. It is incremental
+    (add_instruction) and keeps the size of each cluster.
+    """
+
+    def __init__(self, circuit_name: str, register_name: str):
+        self.circuit_name = circuit_name
+        self.register_name = register_name
+        self.parent = {}
+        self.size = {}
+
+    @classmethod
+    def of(cls, instructions: List[Dict[str, Any]],
+           circuit_name: str, register_name: str) -> "QubitClusters":
+        """Cluster the qubits used by the instructions."""
+        clusters = cls(circuit_name, register_name)
+        for instruction in instructions:
+            clusters.add_instruction(instruction)
+        return clusters
+
+    def find(self, qubit: int) -> int:
+        """Get the representative qubit of the cluster of the qubit."""
+        while self.parent[qubit] != qubit:
+            self.parent[qubit] = self.parent[self.parent[qubit]]
+            qubit = self.parent[qubit]
+        return qubit
+
+    def add_qubit(self, qubit: int):
+        if qubit not in self.parent:
+            self.parent[qubit] = qubit
+            self.size[qubit] = 1
+
+    def union(self, qubit_a: int, qubit_b: int):
+        """Join the clusters of the two qubits (the smaller in the larger)."""
+        root_a, root_b = self.find(qubit_a), self.find(qubit_b)
+        if root_a == root_b:
+            return
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size.pop(root_b)
+
+    def add_instruction(self, instruction: Dict[str, Any]):
+        """Add an instruction (as in get_instructions) to the clusters."""
+        if instruction["circuit_id"] != self.circuit_name:
+            return
+        qubits = [
+            qubit for register, qubit in
+            zip(instruction["qregs"], instruction["qbits"])
+            if register == self.register_name]
+        for qubit in qubits:
+            self.add_qubit(qubit)
+        for qubit in qubits[1:]:
+            self.union(qubits[0], qubit)
+
+    @property
+    def n_clusters(self) -> int:
+        return len(self.size)
+
+    def get_clusters(self) -> List[FrozenSet[int]]:
+        """Get the clusters, ordered by their smallest qubit."""
+        members = {}
+        for qubit in sorted(self.parent.keys()):
+            members.setdefault(self.find(qubit), []).append(qubit)
+        return [frozenset(qubits) for qubits in members.values()]
+
+    def get_cluster_sizes(self) -> List[int]:
+        """Get the size of each cluster (in the order of get_clusters)."""
+        return [len(cluster) for cluster in self.get_clusters()]
+
+
 def get_consecutive_gates(
-        source_code: str, gate_name: str) -> List[Dict[str, str]]:
+        source_code: str, gate_name: str,
+        instructions: List[Dict[str, Any]] = None) -> List[Dict[str, str]]:
     """Return a list of pairs of consecutive gates acting on the same bit(s).
 
+    Pass the instructions if they are already extracted from the code.
+
+    Two gates are consecutive if no other gate acts on their wires (circuit,
+    register and qubit) in between (see index_consecutive_gates).
+
     Limitation: note that some gates, such as SwapGate do not care about the
     order used in qubits but this function doesn't handle that case.
 
@@ -556,73 +715,147 @@ def get_consecutive_gates(
         'gate': 'HGate'}
     ]
     """
-    suitable_line_pairs = []
-    instructions = get_instructions(source_code)
-    if len(instructions) == 0:
-        return suitable_line_pairs
-    df_instr = pd.DataFrame.from_records(instructions)
-    # get all the registers
-    nested_list = list(df_instr["qregs"])
-    flat_list = [x for xs in nested_list for x in xs]
-    unique_registers = list(set(flat_list))
-    # print("unique_registers: ", unique_registers)
-    # keep only operations referring to this register
-    for register in unique_registers:
-        df_instr_curr_register = df_instr[
-            (df_instr["qregs"].apply(
-                lambda used_regs: all([r == register for r in used_regs])))]
-        df_instr_curr_register = \
-            df_instr_curr_register.sort_values(by="lineno")
-        # get all the used qbits
-        possible_qubits_combinations = list(
-            df_instr_curr_register["qbits"])
-        # remove duplicates
-        possible_qubits_combinations = list(set([
-            tuple(e) for e in possible_qubits_combinations
-        ]))
-        # print("possible_qubits_combinations: ", possible_qubits_combinations)
-
-        # for each used qubits (more than once), check if there are
-        # two consecutive operations of the given gate
-        for qubits_combination in possible_qubits_combinations:
-            df_instr_c_bit = df_instr_curr_register[
-                df_instr_curr_register.apply(
-                    lambda row:
-                        any([qbit in qubits_combination
-                             for qbit in row["qbits"]]),
-                    axis=1
-                )
-            ]
-            # find directly contiguous HGates
-            for i in range(len(df_instr_c_bit) - 1):
-                i_next = i + 1
-                i_instr = df_instr_c_bit.iloc[i]
-                next_instr = df_instr_c_bit.iloc[i_next]
-                target_bits = list(qubits_combination)
-                if (    # same gate name
-                        i_instr["gate"] == gate_name and
-                        next_instr["gate"] == gate_name and
-                        # same bits
-                        i_instr["qbits"] == target_bits and
-                        next_instr["qbits"] == target_bits):
-                    suitable_line_pairs += [
-                        {
-                            "lineno": i_instr["lineno"],
-                            "end_lineno": i_instr["end_lineno"],
-                            "next_lineno": next_instr["lineno"],
-                            "next_end_lineno": next_instr["end_lineno"],
-                            "qregs": i_instr["qregs"],
-                            "qbits": i_instr["qbits"],
-                            "cregs": i_instr["cregs"],
-                            "cbits": i_instr["cbits"],
-                            "circuit_id": i_instr["circuit_id"],
-                            "gate": i_instr["gate"]
-                        }
-                    ]
-    df_suitable_line_pairs = pd.DataFrame.from_records(suitable_line_pairs)
+    if instructions is None:
+        instructions = get_instructions(source_code)
+    return index_consecutive_gates(instructions).get(gate_name, [])
+
 
-    return df_suitable_line_pairs.to_dict("records")
 
+class CircuitProgram(object):
+    """Parse-once representation of a generated program.
+
+    It holds the sections of the program and lazily derives (once) their
+    normalized code, AST, registers, circuits, instructions and gate
+    census. A transformation reads the current sections, changes some of
+    them and gets the new program via with_sections(): the views are
+    cached by section content and the cache is shared along the chain,
+    thus the unchanged sections are never parsed again. The source code
+    is produced only when needed (e.g. to write the follow-up file).
+
+    Note that the cached trees are shared: do not modify them (parse the
+    section again to transform it), while the analyses are returned as
+    copies.
+    """
+
+    def __init__(self, raw_sections: Dict[str, str], source_code: str = None,
+                 cache: Dict[Tuple[str, str], Any] = None):
+        self.raw_sections = raw_sections
+        self.source_code = source_code
+        self.cache = cache if cache is not None else {}
+
+    @classmethod
+    def of(cls, code: Any) -> "CircuitProgram":
+        """Get the program of the given source code (or program)."""
+        if isinstance(code, CircuitProgram):
+            return code
+        section_contents = code.split("# SECTION\n")
+        regex_name_extr = r"^# NAME:\s([a-zA-Z_]+)\s"
+        raw_sections = {
+            re.match(regex_name_extr, content).group(1): content
+            for content in section_contents
+            if re.match(regex_name_extr, content) is not None
+        }
+        return cls(raw_sections, source_code=code)
+
+    def with_sections(self, sections: Dict[str, str]) -> "CircuitProgram":
+        """Derive a new program with the given sections."""
+        return CircuitProgram(dict(sections), cache=self.cache)
+
+    def to_source(self) -> str:
+        """Get the source code of the program."""
+        if self.source_code is None:
+            self.source_code = reconstruct_sections(self.raw_sections)
+        return self.source_code
+
+    def __str__(self):
+        return self.to_source()
+
+    def _cached(self, view: str, content: str, compute_view: callable):
+        """Compute the view of the content, unless already in cache."""
+        if (view, content) not in self.cache:
+            self.cache[(view, content)] = compute_view(content)
+        return self.cache[(view, content)]
+
+    @property
+    def sections(self) -> Dict[str, str]:
+        """Get a copy of the (normalized) sections, as get_sections."""
+        return {
+            name: remove_comments(content)
+            for name, content in self.raw_sections.items()
+        }
+
+    def get_section(self, section_name: str) -> str:
+        """Get the normalized code of a section."""
+        return remove_comments(self.raw_sections[section_name])
+
+    def get_tree(self, section_name: str) -> ast.AST:
+        """Get the AST of a section (shared, do not modify it)."""
+        return self._cached(
+            "tree", self.get_section(section_name), ast.parse)
+
+    def get_registers(self, section_name: str = "CIRCUIT"):
+        """Get the registers declared in the section."""
+        return deepcopy(self._cached(
+            "registers", self.get_section(section_name),
+            lambda content: get_registers_used(
+                content, tree=self.get_tree(section_name))))
+
+    def get_circuits(self, section_name: str = "CIRCUIT"):
+        """Get the circuits declared in the section."""
+        return deepcopy(self._cached(
+            "circuits", self.get_section(section_name),
+            lambda content: get_circuits_used(
+                content, tree=self.get_tree(section_name))))
+
+    def get_instructions(self, section_name: str = "CIRCUIT"):
+        """Get the instructions appended to the circuits of the section."""
+        return deepcopy(self._cached(
+            "instructions", self.get_section(section_name),
+            lambda content: get_instructions(
+                content, tree=self.get_tree(section_name))))
+
+    def get_gate_census(self, section_name: str = "CIRCUIT") -> Dict[str, int]:
+        """Count the gates appended in the section, by gate name."""
+        return dict(self._cached(
+            "gate_census", self.get_section(section_name),
+            lambda content: Counter(
+                instr["gate"]
+                for instr in self.get_instructions(section_name))))
+
+    def get_consecutive_gates(self, gate_name: str,
+                              section_name: str = "CIRCUIT"):
+        """Get the pairs of consecutive gates with the given name.
+
+        The pairs of all the gates are indexed at once for the section.
+        """
+        return deepcopy(self._cached(
+            "consecutive_gates", self.get_section(section_name),
+            lambda content: index_consecutive_gates(
+                self.get_instructions(section_name))).get(gate_name, []))
+
+    def get_qubit_clusters(self, circuit_name: str, register_name: str,
+                           section_name: str = "CIRCUIT") -> QubitClusters:
+        """Get the clusters of interacting qubits of the circuit.
+
+        They are computed once per section (shared, do not modify them).
+        """
+        return self._cached(
+            f"qubit_clusters.{circuit_name}.{register_name}",
+            self.get_section(section_name),
+            lambda content: QubitClusters.of(
+                self.get_instructions(section_name),
+                circuit_name=circuit_name, register_name=register_name))
+
+    def get_source_tree(self) -> ast.AST:
+        """Get the AST of the whole program (shared, do not modify it)."""
+        return self._cached("tree", self.to_source(), ast.parse)
+
+    def has_call(self, func_name: str) -> bool:
+        """Check if the program calls the given function."""
+        return self._cached(
+            f"has_call.{func_name}", self.to_source(),
+            lambda content: check_function_call_in_code(
+                content, func_name, tree=self.get_source_tree()))
 
 
 @deprecated(version='qmt_v08', reason="You should use ChangeBackend class")
@@ -892,20 +1125,26 @@ def mr_change_qubit_order(source_code: str, scramble_percentage: float) -> str:
     sections["CIRCUIT"] = changed_section
 
     helper_function = '''
-def read_str_with_mapping(bitstring, direct_mapping):
-    """Given a bitstring convert it to the original mapping."""
-    n_bits = len(bitstring)
-    bitstring = bitstring[::-1]
-    return "".join([bitstring[direct_mapping[i]] for i in range(n_bits)])[::-1]
+import numpy as np
+
+def read_counts_with_mapping(counts, direct_mapping):
+    """Convert all the bitstrings to the original mapping at once."""
+    bitstrings = list(counts.keys())
+    n_bits = len(bitstrings[0])
+    sources = np.array([direct_mapping[i] for i in range(n_bits)])
+    chars = np.frombuffer("".join(bitstrings).encode("ascii"), dtype=np.uint8)
+    flat = chars.reshape(len(bitstrings), n_bits)[
+        :, (n_bits - 1 - sources)[::-1]].tobytes().decode("ascii")
+    return {
+        flat[i * n_bits:(i + 1) * n_bits]: freq
+        for i, freq in enumerate(counts.values())
+    }
     '''
     full_mapping = {**mapping, **{
         i: i for i in range(n_idx) if i not in mapping.keys()}}
 
     conversion = '''
-counts = {
-    read_str_with_mapping(bitstring, ''' + f"{full_mapping}" + '''): freq
-    for bitstring, freq in counts.items()
-}
+counts = read_counts_with_mapping(counts, ''' + f"{full_mapping}" + ''')
 RESULT = counts
     '''
 
@@ -1148,10 +1387,7 @@ def check_separable_by_design(source_code: str):
     Namely if there are three subcircuits, one main and two with sizes that
     give the size of the main one when summed.
     """
-    code_sections = get_sections(source_code)
-    circuit = code_sections["CIRCUIT"]
-
-    circuits_used = get_circuits_used(circuit)
+    circuits_used = CircuitProgram.of(source_code).get_circuits("CIRCUIT")
     main_circuits = [c for c in circuits_used if "main" in c["name"]]
     other_circuits = [c for c in circuits_used if "main" not in c["name"]]
     has_exactly_one_main = len(main_circuits) == 1
@@ -1173,30 +1409,12 @@ def cluster_qubits(circuit_code: str, circuit_name: str, register_name: str):
 
     Note that the groups/cluster do not intereact with each other, meaning
     that there is no two-qubit gate involving two qubits from different
-    groups.
+    groups (see QubitClusters).
     """
-    lines = circuit_code.split("\n")
-    connections = []
-    circuit_related_lines = [
-        line for line in lines if f"{circuit_name}." in line]
-    qubit_interaction_graph = nx.Graph()
-    for line in circuit_related_lines:
-        regex = fr"{register_name}\[(\d+)\]"
-        qubits_involved = re.findall(regex, line)
-        qubits_involved = [int(q) for q in qubits_involved]
-        if qubits_involved:
-            # print(qubits_involved)
-
-            for q in qubits_involved:
-                qubit_interaction_graph.add_node(q)
-
-            if len(qubits_involved) > 1:
-                # consider it as edge
-                new_edges = combinations(qubits_involved, 2)
-                qubit_interaction_graph.add_edges_from(new_edges)
-    sub_graphs = nx.connected_components(qubit_interaction_graph)
-    connected_components_set = set([frozenset(g) for g in sub_graphs])
-    return connected_components_set
+    return set(QubitClusters.of(
+        get_instructions(circuit_code),
+        circuit_name=circuit_name,
+        register_name=register_name).get_clusters())
 
 
 def check_separable(source_code: str, n_partitions: int):
@@ -1208,10 +1426,9 @@ def check_separable(source_code: str, n_partitions: int):
     Namely if there is a single three subcircuits, one main and two with sizes that
     give the size of the main one when summed.
     """
-    code_sections = get_sections(source_code)
-    circuit = code_sections["CIRCUIT"]
+    program = CircuitProgram.of(source_code)
 
-    circuits_used = get_circuits_used(circuit)
+    circuits_used = program.get_circuits("CIRCUIT")
     if len(circuits_used) == 0:
         print("No circuit used. Impossible to sepearate (check_separable).")
         return False
@@ -1223,38 +1440,35 @@ def check_separable(source_code: str, n_partitions: int):
 
     main_size = larger_circuit["size"]
 
-    connected_qubits = cluster_qubits(
-        circuit_code=circuit,
+    qubit_clusters = program.get_qubit_clusters(
         circuit_name=larger_circuit['name'],
         register_name=larger_circuit['quantum_register'])
 
-    # print("connected_qubits: ", connected_qubits)
-    if len(connected_qubits) >= n_partitions:
-        return True
-    return False
+    return qubit_clusters.n_clusters >= n_partitions
 
 
 def check_single_circuit(source_code: str):
     """Check if the code has only one circuit in the program."""
-    code_sections = get_sections(source_code)
-    circuit = code_sections["CIRCUIT"]
-
-    circuits_used = get_circuits_used(circuit)
+    circuits_used = CircuitProgram.of(source_code).get_circuits("CIRCUIT")
     return len(circuits_used) == 1
 
 
 def check_get_backend(source_code: str):
     """Check if the code uses the get_backend function call."""
-    return check_function_call_in_code(source_code, "get_backend")
+    return CircuitProgram.of(source_code).has_call("get_backend")
 
 
 def check_transpile(source_code: str):
     """Check if the code uses the transpile function call."""
-    return check_function_call_in_code(source_code, "transpile")
+    return CircuitProgram.of(source_code).has_call("transpile")
+
 
+def check_function_call_in_code(source_code: str, func_name: str,
+                                tree: ast.AST = None):
+    """Check if the code has the specific function call.
 
-def check_function_call_in_code(source_code: str, func_name: str):
-    """Check if the code has the specific function call."""
+    Pass the tree if the code is already parsed.
+    """
     class FunctionDetector(ast.NodeVisitor):
 
         def __init__(self, call_to_check: str):
@@ -1269,7 +1483,8 @@ def check_function_call_in_code(source_code: str, func_name: str):
                         node.func.attr == self.call_to_check))):
                 self.found = True
 
-    tree = ast.parse(source_code)
+    if tree is None:
+        tree = ast.parse(source_code)
     detector = FunctionDetector(call_to_check=func_name)
     detector.visit(tree)
     return detector.found
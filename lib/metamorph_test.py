@@ -2,6 +2,7 @@
 import pytest
 import ast
 import astpretty
+import astunparse
 from qmt import get_mr_function_and_kwargs
 from metamorph import *
 from metamorph import get_circuits_used
@@ -188,3 +189,168 @@ qc_1.append(CUGate(p_a7c416, p_53f0d4, 1.1382126210061985, p_b2bdc1), qargs
             'code': 'qc_1.append(CUGate(p_a7c416, p_53f0d4, 1.1382126210061985, p_b2bdc1), qargs =[qr_1[4], qr_1[3]], cargs=[])'
         }
     ]
+
+
+PROGRAM_WITH_SECTIONS = """
+# SECTION
+# NAME: PROLOGUE
+
+import qiskit
+from qiskit import QuantumCircuit, ClassicalRegister, QuantumRegister
+from qiskit.circuit.library.standard_gates import *
+
+# SECTION
+# NAME: CIRCUIT
+
+qr = QuantumRegister(2, name='qr')
+cr = ClassicalRegister(2, name='cr')
+qc = QuantumCircuit(qr, cr, name='qc')
+qc.append(HGate(), qargs=[qr[0]], cargs=[])
+qc.append(HGate(), qargs=[qr[0]], cargs=[])
+qc.append(CXGate(), qargs=[qr[0], qr[1]], cargs=[])
+
+# SECTION
+# NAME: EXECUTION
+
+from qiskit import Aer, transpile, execute
+backend_6b62557ac33843e7a8245322cae17865 = Aer.get_backend('qasm_simulator')
+counts = execute(qc, backend=backend_6b62557ac33843e7a8245322cae17865, shots=692).result().get_counts(qc)
+RESULT = counts
+"""
+
+
+def test_circuit_program_views_as_string_functions():
+    program = CircuitProgram.of(PROGRAM_WITH_SECTIONS)
+    sections = get_sections(PROGRAM_WITH_SECTIONS)
+    assert program.sections == sections
+    assert program.get_circuits("CIRCUIT") == \
+        get_circuits_used(sections["CIRCUIT"])
+    assert program.get_gate_census("CIRCUIT") == {"HGate": 2, "CXGate": 1}
+    assert program.has_call("get_backend")
+    assert not program.has_call("transpile")
+    assert str(program) == PROGRAM_WITH_SECTIONS
+
+
+def test_circuit_program_derive_as_reconstruct():
+    program = CircuitProgram.of(PROGRAM_WITH_SECTIONS)
+    sections = program.sections
+    sections["CIRCUIT"] = sections["CIRCUIT"].replace("HGate", "XGate")
+    new_program = program.with_sections(sections)
+    assert new_program.to_source() == reconstruct_sections(sections)
+    assert new_program.sections == get_sections(
+        reconstruct_sections(sections))
+    assert new_program.get_gate_census("CIRCUIT") == {"XGate": 2, "CXGate": 1}
+    # the original program is untouched
+    assert program.get_gate_census("CIRCUIT") == {"HGate": 2, "CXGate": 1}
+
+
+def test_remove_comments_as_ast_round_trip():
+    section = """
+# NAME: CIRCUIT
+
+qc.append(RXGate(1e5,0.50), qargs=[qr[ 1 ]], cargs=[])  # comment
+qc.append(HGate(), qargs=[True[0]], cargs=[])
+x = y = f("a", [1,], {'k': x[1::]}, opt=None,)
+if x:
+    y = -1
+"""
+    # the indented block falls back to astunparse for the whole section
+    plain_section = section.split("if x:")[0]
+    for code in [section, plain_section]:
+        assert remove_comments(code) == astunparse.unparse(ast.parse(code))
+
+
+def get_consecutive_gates_via_dataframe(
+        instructions, gate_name: str):
+    """Pairs of consecutive gates, per register and qubits (as before)."""
+    import pandas as pd
+    suitable_line_pairs = []
+    if len(instructions) == 0:
+        return suitable_line_pairs
+    df_instr = pd.DataFrame.from_records(instructions)
+    unique_registers = list(set(
+        [r for regs in df_instr["qregs"] for r in regs]))
+    for register in unique_registers:
+        df_register = df_instr[df_instr["qregs"].apply(
+            lambda used_regs: all([r == register for r in used_regs]))]
+        df_register = df_register.sort_values(by="lineno")
+        for qubits in set([tuple(e) for e in df_register["qbits"]]):
+            df_qubits = df_register[df_register.apply(
+                lambda row: any([q in qubits for q in row["qbits"]]),
+                axis=1)]
+            for i in range(len(df_qubits) - 1):
+                i_instr = df_qubits.iloc[i]
+                next_instr = df_qubits.iloc[i + 1]
+                if (i_instr["gate"] == gate_name and
+                        next_instr["gate"] == gate_name and
+                        i_instr["qbits"] == list(qubits) and
+                        next_instr["qbits"] == list(qubits)):
+                    suitable_line_pairs.append((
+                        i_instr["lineno"], next_instr["lineno"]))
+    return sorted(suitable_line_pairs)
+
+
+def get_line_pairs(source_code: str, gate_name: str):
+    return sorted([
+        (pair["lineno"], pair["next_lineno"])
+        for pair in get_consecutive_gates(source_code, gate_name)])
+
+
+def test_consecutive_gates_same_wires_in_two_circuits():
+    code = """
+qc_1.append(HGate(), qargs=[qr[0]], cargs=[])
+qc_2.append(HGate(), qargs=[qr[0]], cargs=[])
+qc_1.append(HGate(), qargs=[qr[0]], cargs=[])
+"""
+    # qc_1 and qc_2 use different wires, even with the same register name
+    assert get_line_pairs(code, "HGate") == [(2, 4)]
+
+
+def test_consecutive_gates_split_by_overlapping_wire():
+    code = """
+qc.append(CXGate(), qargs=[qr[0], qr[1]], cargs=[])
+qc.append(XGate(), qargs=[qr[1]], cargs=[])
+qc.append(CXGate(), qargs=[qr[0], qr[1]], cargs=[])
+qc.append(HGate(), qargs=[qr[2]], cargs=[])
+qc.append(CXGate(), qargs=[qr[0], qr[1]], cargs=[])
+qc.append(CXGate(), qargs=[qr[1], qr[0]], cargs=[])
+"""
+    # the HGate is on another wire, the reversed CXGate is another gate
+    assert get_line_pairs(code, "CXGate") == [(4, 6)]
+
+
+def test_consecutive_gates_split_by_multi_register_gate():
+    code = """
+qc.append(HGate(), qargs=[qr_1[0]], cargs=[])
+qc.append(CXGate(), qargs=[qr_1[0], qr_2[0]], cargs=[])
+qc.append(HGate(), qargs=[qr_1[0]], cargs=[])
+qc.append(CXGate(), qargs=[qr_1[0], qr_2[0]], cargs=[])
+qc.append(CXGate(), qargs=[qr_1[0], qr_2[0]], cargs=[])
+"""
+    assert get_line_pairs(code, "HGate") == []
+    assert get_line_pairs(code, "CXGate") == [(5, 6)]
+
+
+@pytest.mark.parametrize("fuzzer_class", [
+    "QiskitFuzzer", "QiskitSeparableFuzzer"])
+def test_consecutive_gates_as_dataframe_version(fuzzer_class):
+    from generation_strategy_python import QiskitFuzzer
+    from generation_strategy_python import QiskitSeparableFuzzer
+    fuzzer = eval(fuzzer_class)()
+    gate_set = [
+        {"name": "HGate", "n_bits": 1, "n_params": 0},
+        {"name": "XGate", "n_bits": 1, "n_params": 0},
+        {"name": "CXGate", "n_bits": 2, "n_params": 0},
+        {"name": "CZGate", "n_bits": 2, "n_params": 0}]
+    np.random.seed(42)
+    for _ in range(10):
+        circuit_code, _ = fuzzer.generate_circuit_via_atomic_ops(
+            gate_set=gate_set, n_qubits=3, n_ops=40)
+        instructions = get_instructions(circuit_code)
+        n_pairs = 0
+        for gate in gate_set:
+            expected = get_consecutive_gates_via_dataframe(
+                instructions, gate["name"])
+            assert get_line_pairs(circuit_code, gate["name"]) == expected
+            n_pairs += len(expected)
+        assert n_pairs > 0
@@ -14,8 +14,11 @@ from lib.qfl import detect_divergence
 
 class AddUnusedRegister(MetamorphicTransformation):
 
+    precondition_sections = ["OPTIMIZATION_LEVEL"]
+
     def check_precondition(self, code_of_source: str) -> bool:
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
         code_transpiler = sections["OPTIMIZATION_LEVEL"]
         is_coupling_map_free = \
             "coupling_map=None" in code_transpiler.replace(" ", "")
@@ -24,7 +27,7 @@ class AddUnusedRegister(MetamorphicTransformation):
     def is_semantically_equivalent(self) -> bool:
         return True
 
-    def derive(self, code_of_source: str) -> str:
+    def derive(self, code_of_source: str) -> metamorph.CircuitProgram:
         """Add unused Quantum registers.
         """
         min_n_bit = self.mr_config["min_n_bit"]
@@ -33,7 +36,8 @@ class AddUnusedRegister(MetamorphicTransformation):
 
         n_bits = random.randint(min_n_bit, max_n_bit)
 
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
 
         if "USELESS_ENTITIES" not in sections.keys():
             sections = metamorph.add_section(
@@ -41,9 +45,7 @@ class AddUnusedRegister(MetamorphicTransformation):
                 new_section_name="USELESS_ENTITIES",
                 after_section="CIRCUIT")
 
-        circuit = sections["CIRCUIT"]
-        available_circuits = metamorph.get_circuits_used(
-            circ_definition=circuit)
+        available_circuits = program.get_circuits("CIRCUIT")
         circuit_to_extend = random.choice(available_circuits)
 
         register_type = random.choice(reg_types)
@@ -65,4 +67,4 @@ class AddUnusedRegister(MetamorphicTransformation):
 
         self.metadata = mr_metadata
 
-        return metamorph.reconstruct_sections(sections)
+        return program.with_sections(sections)
@@ -4,10 +4,16 @@ import random
 from typing import List, Tuple, Dict, Any
 
 from lib.qfl import detect_divergence
+from lib.metamorph import CircuitProgram
+from lib.circuit_object import ObjectProgram
 
 
 class MetamorphicTransformation(ABC):
 
+    # sections read by check_precondition (None means the whole program):
+    # its result is kept until a derive changes one of them
+    precondition_sections: List[str] = None
+
     def __init__(self, name: str,
                  metamorphic_strategies_config: Dict[str, Any],
                  detectors_config: Dict[str, Any],
@@ -25,12 +31,35 @@ class MetamorphicTransformation(ABC):
 
     @abstractmethod
     def check_precondition(self, code_of_source: str):
+        """Check if the transformation applies to the code (or program)."""
         pass
 
     @abstractmethod
-    def derive(self, code_of_source: str) -> str:
+    def derive(self, code_of_source: str) -> CircuitProgram:
+        """Derive the follow-up program from the code (or program)."""
         pass
 
+    def check_precondition_object(self, program: ObjectProgram) -> bool:
+        """Check if the transformation applies to the program object.
+
+        By default a transformation works only on source code.
+        """
+        return False
+
+    def derive_object(self, program: ObjectProgram) -> ObjectProgram:
+        """Derive the follow-up of the program object (see object mode)."""
+        raise NotImplementedError(
+            f"{self.__class__.__name__} has no object mode.")
+
+    def read_followup_result(
+            self, result_b: Any, n_shots: int = None) -> Dict[str, int]:
+        """Read the follow-up result as comparable to the source one.
+
+        n_shots is the number of shots of the source result (if any), for
+        the follow-ups whose result has to be resampled.
+        """
+        return result_b
+
     def check_output_relationship(
             self,
             result_a: Dict[str, int],
@@ -38,7 +67,8 @@ class MetamorphicTransformation(ABC):
         """Check that the two results are equivalent."""
         exec_metadata = {
             "res_A": result_a,
-            "res_B": result_b
+            "res_B": self.read_followup_result(
+                result_b, n_shots=sum(result_a.values()))
         }
         detectors = self.detectors
         return detect_divergence(exec_metadata, detectors)
@@ -4,6 +4,8 @@ import random
 
 from lib.mr import MetamorphicTransformation
 from lib.mr import *
+from lib.metamorph import CircuitProgram
+from lib.circuit_object import ObjectProgram
 
 
 class ChainedTransformation(MetamorphicTransformation):
@@ -25,15 +27,104 @@ class ChainedTransformation(MetamorphicTransformation):
         self.detectors = detectors_config
         self.metadata = {}
         self.transf_applied_count = 0
+        # precondition results (by transformation index) for the program
+        # state in current_program
+        self.precondition_cache: Dict[int, bool] = {}
+        self.current_program = None
 
     def select_random_transformation(self):
         """Select a transformation from the list of transformations."""
         self.main_transformation = random.choice(
             self.metamorphic_transformations)
 
+    def use_program_state(self, code_of_source: str) -> CircuitProgram:
+        """Get the program, forgetting the preconditions of other programs."""
+        program = CircuitProgram.of(code_of_source)
+        if program is not self.current_program:
+            self.precondition_cache = {}
+            self.current_program = program
+        return program
+
+    def is_applicable(self, i_transf: int, program: CircuitProgram) -> bool:
+        """Check the precondition of the i-th transformation (cached)."""
+        if i_transf not in self.precondition_cache.keys():
+            transf = self.metamorphic_transformations[i_transf]
+            self.precondition_cache[i_transf] = \
+                transf.check_precondition(program)
+        return self.precondition_cache[i_transf]
+
+    def get_applicable_transformations(
+            self, code_of_source: str) -> List[MetamorphicTransformation]:
+        """Get the transformations whose precondition holds on the program.
+
+        Each precondition is evaluated once per program state: the results
+        are cached and only those that the last derive could affect are
+        evaluated again (see invalidate_preconditions).
+        """
+        program = self.use_program_state(code_of_source)
+        return [
+            transf for i, transf in enumerate(self.metamorphic_transformations)
+            if self.is_applicable(i, program)]
+
+    def select_applicable_transformation(self, code_of_source: str) -> bool:
+        """Select a transformation at random among the applicable ones.
+
+        The preconditions are checked (once per program state) following a
+        random order and the first applicable transformation is selected,
+        thus each applicable one has the same probability. It returns False
+        if no transformation applies to the program.
+        """
+        program = self.use_program_state(code_of_source)
+        n_transf = len(self.metamorphic_transformations)
+        for i_transf in random.sample(range(n_transf), n_transf):
+            if self.is_applicable(i_transf, program):
+                self.main_transformation = \
+                    self.metamorphic_transformations[i_transf]
+                return True
+        return False
+
+    def select_applicable_object_transformation(
+            self, program: ObjectProgram) -> bool:
+        """Select at random among the transformations of the object mode.
+
+        It returns False if no transformation applies to the program.
+        """
+        n_transf = len(self.metamorphic_transformations)
+        for i_transf in random.sample(range(n_transf), n_transf):
+            transf = self.metamorphic_transformations[i_transf]
+            if transf.check_precondition_object(program):
+                self.main_transformation = transf
+                return True
+        return False
+
+    def invalidate_preconditions(
+            self, old_program: CircuitProgram, new_program: CircuitProgram):
+        """Forget the preconditions that the last derive could affect.
+
+        Namely those reading a section that changed (or all the program),
+        and the one of the applied transformation, which may keep state
+        from its precondition.
+        """
+        old_sections = old_program.sections
+        new_sections = new_program.sections
+        changed_sections = [
+            name for name in set(old_sections) | set(new_sections)
+            if old_sections.get(name) != new_sections.get(name)]
+        for i, transf in enumerate(self.metamorphic_transformations):
+            read_sections = transf.precondition_sections
+            if (transf is self.main_transformation or read_sections is None
+                    or len(set(read_sections) & set(changed_sections)) > 0):
+                self.precondition_cache.pop(i, None)
+        self.current_program = new_program
+
     def check_precondition(self, code_of_source: str):
         return self.main_transformation.check_precondition(code_of_source)
 
+    def read_followup_result(
+            self, result_b: Any, n_shots: int = None) -> Dict[str, int]:
+        return self.main_transformation.read_followup_result(
+            result_b, n_shots=n_shots)
+
     def check_output_relationship(
             self,
             result_a: Dict[str, int],
@@ -44,16 +135,35 @@ class ChainedTransformation(MetamorphicTransformation):
     def is_semantically_equivalent(self) -> bool:
         return self.main_transformation.is_semantically_equivalent()
 
-    def derive(self, code_of_source: str) -> str:
-        """Apply the main transformation and update the metadata and count."""
+    def derive(self, code_of_source: str) -> CircuitProgram:
+        """Apply the main transformation and update the metadata and count.
+
+        Note that the program is passed along the chain without being
+        written to source code, thus pass the program of the previous
+        transformation to avoid parsing it again.
+        """
         print(f"Applying: {self.main_transformation}")
-        new_source_code = \
-            self.main_transformation.derive(code_of_source)
+        program = CircuitProgram.of(code_of_source)
+        new_program = \
+            self.main_transformation.derive(program)
+        if program is self.current_program:
+            self.invalidate_preconditions(program, new_program)
+        self.record_application()
+        return new_program
+
+    def derive_object(self, program: ObjectProgram) -> ObjectProgram:
+        """Apply the main transformation to the program object."""
+        print(f"Applying: {self.main_transformation}")
+        new_program = self.main_transformation.derive_object(program)
+        self.record_application()
+        return new_program
+
+    def record_application(self):
+        """Update the metadata and count after applying the main one."""
         self.metadata[self.transf_applied_count] = \
             self.main_transformation.metadata
         self.transf_applied_count += 1
         self.last_applied_transformation = self.main_transformation
-        return new_source_code
 
     def get_name_current_transf(self):
         return self.main_transformation.__class__.__name__
@@ -8,6 +8,7 @@ from typing import List, Tuple, Dict, Any
 from lib.mr import MetamorphicTransformation
 
 import lib.metamorph as metamorph
+from lib.circuit_object import ObjectProgram
 from lib.qfl import detect_divergence
 
 
@@ -19,7 +20,23 @@ class ChangeBackend(MetamorphicTransformation):
     def is_semantically_equivalent(self) -> bool:
         return True
 
-    def derive(self, code_of_source: str) -> str:
+    def check_precondition_object(self, program: ObjectProgram) -> bool:
+        return True
+
+    def derive_object(self, program: ObjectProgram) -> ObjectProgram:
+        """Change the backend of the program object (see derive)."""
+        available_backends = [
+            backend for backend in self.mr_config["available_backends"]
+            if backend != program.backend]
+        target_backend = str(np.random.choice(available_backends))
+        print(f"Follow: replace backend {program.backend} -> " +
+              f"{target_backend}")
+        self.metadata = {
+            "initial_backend": str(program.backend),
+            "new_backend": target_backend}
+        return program.with_settings(backend=target_backend)
+
+    def derive(self, code_of_source: str) -> metamorph.CircuitProgram:
         """Change the backend used in the source code.
 
         Args:
@@ -30,7 +47,8 @@ class ChangeBackend(MetamorphicTransformation):
             The source code of the circuit with the backend changed.
         """
         available_backends = self.mr_config["available_backends"]
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
         execution_section = sections["EXECUTION"]
         mr_metadata = {}
 
@@ -63,7 +81,7 @@ class ChangeBackend(MetamorphicTransformation):
 
         self.metadata = mr_metadata
 
-        return metamorph.reconstruct_sections(sections)
+        return program.with_sections(sections)
 
     def check_output_relationship(
             self,
@@ -10,8 +10,11 @@ from lib.mr import MetamorphicTransformation
 
 class ChangeCouplingMap(MetamorphicTransformation):
 
+    precondition_sections = ["USELESS_ENTITIES"]
+
     def check_precondition(self, code_of_source: str) -> bool:
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
         if "USELESS_ENTITIES" not in sections.keys():
             return True
         new_register_added = "add_register" in sections["USELESS_ENTITIES"]
@@ -20,7 +23,7 @@ class ChangeCouplingMap(MetamorphicTransformation):
     def is_semantically_equivalent(self) -> bool:
         return True
 
-    def derive(self, code_of_source: str) -> str:
+    def derive(self, code_of_source: str) -> metamorph.CircuitProgram:
         """Change the coupling map.
 
 
@@ -41,14 +44,15 @@ class ChangeCouplingMap(MetamorphicTransformation):
         force_connected = self.mr_config.get('force_connected', True)
         force_symmetric = self.mr_config.get('force_connected', True)
 
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
         opt_level_section = sections["OPTIMIZATION_LEVEL"]
         mr_metadata = {}
 
         tree = ast.parse(opt_level_section)
 
         source_code_circuit = sections["CIRCUIT"]
-        registers = metamorph.get_registers_used(source_code_circuit)
+        registers = program.get_registers("CIRCUIT")
         # we assume to have exactly one quantum and one classical register
         # and they have the same number of qubits
         quantum_reg = [r for r in registers
@@ -112,4 +116,4 @@ class ChangeCouplingMap(MetamorphicTransformation):
 
         self.metadata = mr_metadata
 
-        return metamorph.reconstruct_sections(sections)
+        return program.with_sections(sections)
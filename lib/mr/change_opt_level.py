@@ -6,6 +6,7 @@ import numpy as np
 from lib.mr import MetamorphicTransformation
 
 import lib.metamorph as metamorph
+from lib.circuit_object import ObjectProgram
 
 from typing import List, Tuple, Dict, Any
 
@@ -13,17 +14,33 @@ from typing import List, Tuple, Dict, Any
 class ChangeOptLevel(MetamorphicTransformation):
 
     def check_precondition(self, code_of_source: str) -> bool:
-        return metamorph.check_function_call_in_code(
-            code_of_source, "transpile")
+        return metamorph.CircuitProgram.of(code_of_source).has_call(
+            "transpile")
 
     def is_semantically_equivalent(self) -> bool:
         return True
 
-    def derive(self, code_of_source: str) -> str:
+    def check_precondition_object(self, program: ObjectProgram) -> bool:
+        return True
+
+    def derive_object(self, program: ObjectProgram) -> ObjectProgram:
+        """Change the optimization level of the program object."""
+        levels = [level for level in self.mr_config["levels"]
+                  if level != program.opt_level]
+        target_opt_level = int(np.random.choice(levels))
+        print(f"Follow: optimization level changed:" +
+              f" {program.opt_level} -> {target_opt_level}")
+        self.metadata = {
+            "initial_level": int(program.opt_level),
+            "new_level": target_opt_level}
+        return program.with_settings(opt_level=target_opt_level)
+
+    def derive(self, code_of_source: str) -> metamorph.CircuitProgram:
         """Change the optimization level (via transpile).
         """
 
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
         opt_level_section = sections["OPTIMIZATION_LEVEL"]
         mr_metadata = {}
 
@@ -59,4 +76,4 @@ class ChangeOptLevel(MetamorphicTransformation):
 
         self.metadata = mr_metadata
 
-        return metamorph.reconstruct_sections(sections)
+        return program.with_sections(sections)
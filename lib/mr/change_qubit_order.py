@@ -5,26 +5,51 @@ from typing import List, Tuple, Dict, Any
 from lib.mr import MetamorphicTransformation
 
 import lib.metamorph as metamorph
+from lib.circuit_object import ObjectProgram
+from lib.bit_permutation import permute_counts
 from lib.qfl import detect_divergence
 
 
 class ChangeQubitOrder(MetamorphicTransformation):
 
+    precondition_sections = []
+
     def check_precondition(self, code_of_source: str) -> bool:
         return True
 
     def is_semantically_equivalent(self) -> bool:
         return False
 
-    def derive(self, code_of_source: str) -> str:
+    def check_precondition_object(self, program: ObjectProgram) -> bool:
+        return True
+
+    def derive_object(self, program: ObjectProgram) -> ObjectProgram:
+        """Scramble the order of the qubits of the program object."""
+        scramble_percentage = self.mr_config['scramble_percentage']
+        n_idx = program.n_qubits
+        idx_to_scramble = np.random.choice(
+            list(range(n_idx)),
+            size=int(n_idx * scramble_percentage), replace=False)
+        mapping = metamorph.create_random_mapping(idx_to_scramble)
+        print("Follow: indices mapping: ", mapping)
+        operations = [
+            (gate_name, params, [mapping.get(q, q) for q in qubits])
+            for gate_name, params, qubits in program.operations]
+        self.full_mapping = {**mapping, **{
+            i: i for i in range(n_idx) if i not in mapping.keys()}}
+        self.metadata = {"mapping": str(mapping)}
+        return program.with_settings(operations=operations)
+
+    def derive(self, code_of_source: str) -> metamorph.CircuitProgram:
         """Scramble the order of qubits."""
         scramble_percentage = self.mr_config['scramble_percentage']
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
         source_code_circuit = sections["CIRCUIT"]
         tree = ast.parse(source_code_circuit)
         mr_metadata = {}
 
-        registers = metamorph.get_registers_used(source_code_circuit)
+        registers = program.get_registers("CIRCUIT")
         # we assume to have exactly one quantum and one classical register
         # and they have the same number of qubits
         quantum_reg = [r for r in registers
@@ -74,33 +99,10 @@ class ChangeQubitOrder(MetamorphicTransformation):
 
         self.metadata = mr_metadata
 
-        return metamorph.reconstruct_sections(sections)
-
-    def check_output_relationship(
-            self,
-            result_a: Dict[str, int],
-            result_b: Dict[str, int]) -> bool:
-        """Check that the two results are equivalent.
-
-        Note that we read the followup output according to the qubit mapping.
-        """
-        result_b = {
-            self._read_str_with_mapping(bitstring, self.full_mapping): freq
-            for bitstring, freq in result_b.items()
-        }
-        exec_metadata = {
-            "res_A": result_a,
-            "res_B": result_b
-        }
-        detectors = self.detectors
-        return detect_divergence(exec_metadata, detectors)
-
-    def _read_str_with_mapping(
-            self,
-            bitstring: str,
-            direct_mapping: Dict[int, int]) -> str:
-        """Given a bitstring convert it to the original mapping."""
-        n_bits = len(bitstring)
-        bitstring = bitstring[::-1]
-        return "".join([bitstring[direct_mapping[i]]
-                        for i in range(n_bits)])[::-1]
+        return program.with_sections(sections)
+
+    def read_followup_result(
+            self, result_b: Dict[str, int],
+            n_shots: int = None) -> Dict[str, int]:
+        """Read the followup output according to the qubit mapping."""
+        return permute_counts(result_b, self.full_mapping)
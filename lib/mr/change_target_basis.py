@@ -8,6 +8,7 @@ from typing import List, Tuple, Dict, Any
 from lib.mr import MetamorphicTransformation
 
 import lib.metamorph as metamorph
+from lib.circuit_object import ObjectProgram
 from lib.qfl import detect_divergence
 
 
@@ -19,12 +20,24 @@ class ChangeTargetBasis(MetamorphicTransformation):
     def is_semantically_equivalent(self) -> bool:
         return True
 
-    def derive(self, code_of_source: str) -> str:
+    def check_precondition_object(self, program: ObjectProgram) -> bool:
+        return True
+
+    def derive_object(self, program: ObjectProgram) -> ObjectProgram:
+        """Change the basic gates of the program object (see derive)."""
+        universal_gate_sets = self.mr_config["universal_gate_sets"]
+        target_gates = list(np.random.choice(universal_gate_sets)["gates"])
+        print("Follow: gateset replaced with: ", target_gates)
+        self.metadata = {"new_basis_gates": target_gates}
+        return program.with_settings(target_gates=target_gates)
+
+    def derive(self, code_of_source: str) -> metamorph.CircuitProgram:
         """Change the basic gates used in the source code (via transpile).
         """
         universal_gate_sets = self.mr_config["universal_gate_sets"]
         target_gates = np.random.choice(universal_gate_sets)["gates"]
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
         opt_level_section = sections["OPTIMIZATION_LEVEL"]
         mr_metadata = {}
 
@@ -56,7 +69,7 @@ class ChangeTargetBasis(MetamorphicTransformation):
 
         self.metadata = mr_metadata
 
-        return metamorph.reconstruct_sections(sections)
+        return program.with_sections(sections)
 
     def check_output_relationship(
             self,
@@ -15,23 +15,26 @@ from lib.generation_strategy_python import Fuzzer
 
 class InjectNullEffect(MetamorphicTransformation):
 
+    precondition_sections = ["CIRCUIT"]
+
     def check_precondition(self, code_of_source: str) -> bool:
         return metamorph.check_single_circuit(code_of_source)
 
     def is_semantically_equivalent(self) -> bool:
         return True
 
-    def derive(self, code_of_source: str) -> str:
+    def derive(self, code_of_source: str) -> metamorph.CircuitProgram:
         """Inject a subcircuit and its inverse with a null effect overall."""
         min_n_ops = self.mr_config["min_n_ops"]
         max_n_ops = self.mr_config["max_n_ops"]
         fuzzer_object = self.mr_config["fuzzer_object"]
         gate_set = self.mr_config["gate_set"]
 
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
         source_code_circuit = sections["CIRCUIT"]
         mr_metadata = {}
-        registers = metamorph.get_registers_used(source_code_circuit)
+        registers = program.get_registers("CIRCUIT")
         # we assume to have exactly one quantum and one classical register
         # and they have the same number of qubits
         quantum_reg = [r for r in registers
@@ -89,7 +92,7 @@ class InjectNullEffect(MetamorphicTransformation):
 
         self.metadata = mr_metadata
 
-        return metamorph.reconstruct_sections(sections)
+        return program.with_sections(sections)
 
     def check_output_relationship(
             self,
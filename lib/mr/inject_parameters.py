@@ -40,14 +40,13 @@ class InjectParameters(MetamorphicTransformation):
                     self.total_parameters += len(params)
                     self.concrete_values += [p.value for p in params]
 
-        tree = ast.parse(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
         counter = ConcreteParametersCounter()
-        counter.generic_visit(tree)
+        counter.generic_visit(program.get_source_tree())
         self.concrete_values = counter.concrete_values
         # print("All concrete values:", self.concrete_values)
 
-        sections = metamorph.get_sections(code_of_source)
-        execution_area = sections["EXECUTION"]
+        execution_area = program.get_section("EXECUTION")
         single_circuit_execution = execution_area.count("execute(") == 1
 
         return len(self.concrete_values) > 0 and single_circuit_execution
@@ -55,7 +54,7 @@ class InjectParameters(MetamorphicTransformation):
     def is_semantically_equivalent(self) -> bool:
         return True
 
-    def derive(self, code_of_source: str) -> str:
+    def derive(self, code_of_source: str) -> metamorph.CircuitProgram:
         """Add unused Quantum registers.
         """
         min_n_params = self.mr_config["min_n_params"]
@@ -65,7 +64,8 @@ class InjectParameters(MetamorphicTransformation):
 
         values_to_change = random.randint(min_n_params, max_n_params)
 
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
 
         if "PARAMETERS" not in sections.keys():
             sections = metamorph.add_section(
@@ -154,4 +154,4 @@ class InjectParameters(MetamorphicTransformation):
 
         self.metadata = mr_metadata
 
-        return metamorph.reconstruct_sections(sections)
+        return program.with_sections(sections)
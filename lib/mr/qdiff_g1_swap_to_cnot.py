@@ -36,9 +36,9 @@ class QdiffG1SwapToCnot(MetamorphicTransformation):
                         (node.args[0].func.id == "SwapGate")):
                     self.swap_counter += 1
 
-        tree = ast.parse(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
         counter = SwapCounter()
-        counter.generic_visit(tree)
+        counter.generic_visit(program.get_source_tree())
         self.tot_n_swap_gates = counter.swap_counter
 
         return self.tot_n_swap_gates > 0
@@ -46,7 +46,7 @@ class QdiffG1SwapToCnot(MetamorphicTransformation):
     def is_semantically_equivalent(self) -> bool:
         return True
 
-    def derive(self, code_of_source: str) -> str:
+    def derive(self, code_of_source: str) -> metamorph.CircuitProgram:
         """Replace a swap gate with two CNOT gates."""
         min_to_change = self.mr_config['min_to_change']
         max_to_change = self.mr_config['max_to_change']
@@ -57,7 +57,8 @@ class QdiffG1SwapToCnot(MetamorphicTransformation):
         # randomize the vector
         self.to_be_changed_vector = np.random.permutation(to_be_changed_vector)
 
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
         source_code_circuit = sections["CIRCUIT"]
         tree = ast.parse(source_code_circuit)
 
@@ -161,4 +162,4 @@ class QdiffG1SwapToCnot(MetamorphicTransformation):
 
         self.metadata = mr_metadata
 
-        return metamorph.reconstruct_sections(sections)
+        return program.with_sections(sections)
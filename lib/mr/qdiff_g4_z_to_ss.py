@@ -13,11 +13,12 @@ from lib.qfl import detect_divergence
 
 class QdiffG4ZtoSS(MetamorphicTransformation):
 
+    precondition_sections = ["CIRCUIT"]
+
     def check_precondition(self, code_of_source: str) -> bool:
         """Check if there is any Z gate."""
-        sections = metamorph.get_sections(code_of_source)
-        source_code_circuit = sections["CIRCUIT"]
-        instructions = metamorph.get_instructions(source_code_circuit)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        instructions = program.get_instructions("CIRCUIT")
         self.instruction_z_gate = [
             i for i in instructions if i["gate"] == "ZGate"]
         self.tot_n_z_gates = len(self.instruction_z_gate)
@@ -26,14 +27,15 @@ class QdiffG4ZtoSS(MetamorphicTransformation):
     def is_semantically_equivalent(self) -> bool:
         return True
 
-    def derive(self, code_of_source: str) -> str:
+    def derive(self, code_of_source: str) -> metamorph.CircuitProgram:
         """Replace a Z gate with two S gates."""
         min_to_change = self.mr_config['min_to_change']
         max_to_change = self.mr_config['max_to_change']
         n_gate_to_change = random.randint(min_to_change, max_to_change)
         max_to_change = min(n_gate_to_change, self.tot_n_z_gates)
 
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
         source_code_circuit = sections["CIRCUIT"]
 
         z_gates_to_replace = random.sample(
@@ -77,4 +79,4 @@ class QdiffG4ZtoSS(MetamorphicTransformation):
 
         self.metadata = mr_metadata
 
-        return metamorph.reconstruct_sections(sections)
+        return program.with_sections(sections)
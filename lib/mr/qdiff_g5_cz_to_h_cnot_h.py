@@ -13,11 +13,12 @@ from lib.qfl import detect_divergence
 
 class QdiffG5CZtoHCnotH(MetamorphicTransformation):
 
+    precondition_sections = ["CIRCUIT"]
+
     def check_precondition(self, code_of_source: str) -> bool:
         """Check if there is any CZ gate."""
-        sections = metamorph.get_sections(code_of_source)
-        source_code_circuit = sections["CIRCUIT"]
-        instructions = metamorph.get_instructions(source_code_circuit)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        instructions = program.get_instructions("CIRCUIT")
         self.instruction_cz_gate = [
             i for i in instructions if i["gate"] == "CZGate"]
         self.tot_n_cz_gates = len(self.instruction_cz_gate)
@@ -26,14 +27,15 @@ class QdiffG5CZtoHCnotH(MetamorphicTransformation):
     def is_semantically_equivalent(self) -> bool:
         return True
 
-    def derive(self, code_of_source: str) -> str:
+    def derive(self, code_of_source: str) -> metamorph.CircuitProgram:
         """Replace a CZ gate with H CNOT H."""
         min_to_change = self.mr_config['min_to_change']
         max_to_change = self.mr_config['max_to_change']
         n_gate_to_change = random.randint(min_to_change, max_to_change)
         max_to_change = min(n_gate_to_change, self.tot_n_cz_gates)
 
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
         source_code_circuit = sections["CIRCUIT"]
 
         cz_gates_to_replace = random.sample(
@@ -82,4 +84,4 @@ class QdiffG5CZtoHCnotH(MetamorphicTransformation):
 
         self.metadata = mr_metadata
 
-        return metamorph.reconstruct_sections(sections)
+        return program.with_sections(sections)
@@ -13,24 +13,24 @@ from lib.qfl import detect_divergence
 
 class QdiffG6TwoCzToId(MetamorphicTransformation):
 
+    precondition_sections = ["CIRCUIT"]
+
     def check_precondition(self, code_of_source: str) -> bool:
         """Check if there are two CZ gates on the same bit."""
-        sections = metamorph.get_sections(code_of_source)
-        source_code_circuit = sections["CIRCUIT"]
-
-        pairs = metamorph.get_consecutive_gates(
-            source_code_circuit, gate_name="CZGate")
+        program = metamorph.CircuitProgram.of(code_of_source)
+        pairs = program.get_consecutive_gates(gate_name="CZGate")
         self.pairs = pairs
         return len(self.pairs) > 0
 
     def is_semantically_equivalent(self) -> bool:
         return True
 
-    def derive(self, code_of_source: str) -> str:
+    def derive(self, code_of_source: str) -> metamorph.CircuitProgram:
         """Replace two CZ gates on the same bit with an Identity gate."""
         add_identity_matrix = self.mr_config['add_identity_matrix']
 
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
         source_code_circuit = sections["CIRCUIT"]
 
         pair_to_replace = random.choice(self.pairs)
@@ -61,4 +61,4 @@ class QdiffG6TwoCzToId(MetamorphicTransformation):
 
         self.metadata = mr_metadata
 
-        return metamorph.reconstruct_sections(sections)
+        return program.with_sections(sections)
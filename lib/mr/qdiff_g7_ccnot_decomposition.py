@@ -13,11 +13,12 @@ from lib.qfl import detect_divergence
 
 class QdiffG7CCNOTDecomposition(MetamorphicTransformation):
 
+    precondition_sections = ["CIRCUIT"]
+
     def check_precondition(self, code_of_source: str) -> bool:
         """Check if there is any CCNOT gate."""
-        sections = metamorph.get_sections(code_of_source)
-        source_code_circuit = sections["CIRCUIT"]
-        instructions = metamorph.get_instructions(source_code_circuit)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        instructions = program.get_instructions("CIRCUIT")
         self.instruction_ccx_gate = [
             i for i in instructions if i["gate"] == "CCXGate"]
         self.tot_n_ccx_gates = len(self.instruction_ccx_gate)
@@ -26,7 +27,7 @@ class QdiffG7CCNOTDecomposition(MetamorphicTransformation):
     def is_semantically_equivalent(self) -> bool:
         return True
 
-    def derive(self, code_of_source: str) -> str:
+    def derive(self, code_of_source: str) -> metamorph.CircuitProgram:
         """Replace a CCX gate (Toffoli) with its decomposition.
 
         Follow the question:
@@ -37,7 +38,8 @@ class QdiffG7CCNOTDecomposition(MetamorphicTransformation):
         n_gate_to_change = random.randint(min_to_change, max_to_change)
         max_to_change = min(n_gate_to_change, self.tot_n_ccx_gates)
 
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
         source_code_circuit = sections["CIRCUIT"]
 
         ccx_gates_to_replace = random.sample(
@@ -135,4 +137,4 @@ class QdiffG7CCNOTDecomposition(MetamorphicTransformation):
 
         self.metadata = mr_metadata
 
-        return metamorph.reconstruct_sections(sections)
+        return program.with_sections(sections)
@@ -1,5 +1,4 @@
 import ast
-from functools import reduce
 import numpy as np
 import re
 import random
@@ -8,11 +7,15 @@ from typing import List, Tuple, Dict, Any
 from lib.mr import MetamorphicTransformation
 
 import lib.metamorph as metamorph
+from lib.bit_permutation import permute_counts
+from lib.joint_counts import JointCounts
 from lib.qfl import detect_divergence
 
 
 class RunIndependentPartitions(MetamorphicTransformation):
 
+    precondition_sections = ["CIRCUIT"]
+
     def check_precondition(self, code_of_source: str) -> bool:
         # NB: this checks that there is also only one circuit (implicitly)
         return metamorph.check_separable(
@@ -22,15 +25,16 @@ class RunIndependentPartitions(MetamorphicTransformation):
     def is_semantically_equivalent(self) -> bool:
         return False
 
-    def derive(self, code_of_source: str) -> str:
+    def derive(self, code_of_source: str) -> metamorph.CircuitProgram:
         """Run the n_partitions separately and aggregate.
         """
         n_partitions = self.mr_config["n_partitions"]
 
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
         mr_metadata = {}
         # print(code_of_source)
-        circuits = metamorph.get_circuits_used(circ_definition=sections["CIRCUIT"])
+        circuits = program.get_circuits("CIRCUIT")
 
         # after the precondition we are guardanteed that there is only
         # one circuit
@@ -55,10 +59,11 @@ class RunIndependentPartitions(MetamorphicTransformation):
         all_available_qubits = set(list(range(main_circuit['size'])))
         unused_qubits = all_available_qubits.difference(all_used_qubits)
 
-        connected_qubit_clusters = metamorph.cluster_qubits(
-            circuit_code=circuit,
+        qubit_clusters = program.get_qubit_clusters(
             circuit_name=main_circuit['name'],
             register_name=main_circuit['quantum_register'])
+        connected_qubit_clusters = qubit_clusters.get_clusters()
+        mr_metadata["cluster_sizes"] = qubit_clusters.get_cluster_sizes()
 
         print(connected_qubit_clusters)
 
@@ -204,48 +209,31 @@ class RunIndependentPartitions(MetamorphicTransformation):
         mr_metadata["mapping"] = self.full_mapping
         self.metadata = mr_metadata
 
-        return metamorph.reconstruct_sections(sections)
+        return program.with_sections(sections)
 
-    def check_output_relationship(
-            self,
-            result_a: Dict[str, int],
-            result_b: Dict[str, int]) -> bool:
-        """Check that the two results are equivalent.
+    def read_followup_result(
+            self, result_b: List[Dict[str, int]],
+            n_shots: int = None) -> Dict[str, int]:
+        """Reconstruct the followup output (one count per partition).
 
         Note that we read the followup output according to the qubit mapping.
         """
-        result_b = self._reconstruct(result_b)
-        exec_metadata = {
-            "res_A": result_a,
-            "res_B": result_b
-        }
-        detectors = self.detectors
-        return detect_divergence(exec_metadata, detectors)
-
-    def _read_str_with_mapping(
-            self,
-            bitstring: str,
-            direct_mapping: Dict[int, int]) -> str:
-        """Given a bitstring convert it to the original mapping."""
-        n_bits = len(bitstring)
-        bitstring = bitstring[::-1]
-        return "".join([bitstring[direct_mapping[i]]
-                        for i in range(n_bits)])[::-1]
-
-    def _reconstruct(self, counts: List[Dict[str, int]]):
+        return self._reconstruct(result_b, n_shots=n_shots)
+
+    def _reconstruct(self, counts: List[Dict[str, int]],
+                     n_shots: int = None):
         """Pass the count results.
 
+        The joint counts are a sample of n_shots (by default the shots of
+        each partition), the exact probabilities their joint distribution.
         NB: list the circuit working on lower qubit indices first.
         """
-        result_concatenated = reduce(lambda counts_1, counts_2: {
-            k2 + k1: v1 * v2 for k1, v1 in counts_1.items()
-            for k2, v2 in counts_2.items()
-        }, counts)
-        result_b = {
-            self._read_str_with_mapping(bitstring, self.full_mapping): freq
-            for bitstring, freq in result_concatenated.items()
-        }
-        return result_b
+        joint_counts = JointCounts(counts)
+        if joint_counts.is_sampled():
+            result_concatenated = joint_counts.sample(n_shots)
+        else:
+            result_concatenated = joint_counts.distribution()
+        return permute_counts(result_concatenated, self.full_mapping)
 
     def _circuit_specific_bindings(
             self, new_circuit_code: str, old_binding_code: str):
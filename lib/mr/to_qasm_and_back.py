@@ -14,8 +14,11 @@ from lib.qfl import detect_divergence
 
 class ToQasmAndBack(MetamorphicTransformation):
 
+    precondition_sections = ["EXECUTION", "QASM_CONVERSION"]
+
     def check_precondition(self, code_of_source: str) -> bool:
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
         execution_area = sections["EXECUTION"]
 
         no_conversion = "QASM_CONVERSION" not in sections.keys()
@@ -26,7 +29,7 @@ class ToQasmAndBack(MetamorphicTransformation):
     def is_semantically_equivalent(self) -> bool:
         return True
 
-    def derive(self, code_of_source: str) -> str:
+    def derive(self, code_of_source: str) -> metamorph.CircuitProgram:
         """Add QASM section to convert it and back before execution.
         """
         qasm_version = self.mr_config["qasm_version"]
@@ -34,7 +37,8 @@ class ToQasmAndBack(MetamorphicTransformation):
 
         before_section = random.choice(before_sections)
 
-        sections = metamorph.get_sections(code_of_source)
+        program = metamorph.CircuitProgram.of(code_of_source)
+        sections = program.sections
 
         sections = metamorph.add_section(
             sections=sections,
@@ -59,4 +63,4 @@ class ToQasmAndBack(MetamorphicTransformation):
 
         self.metadata = mr_metadata
 
-        return metamorph.reconstruct_sections(sections)
+        return program.with_sections(sections)
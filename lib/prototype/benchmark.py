@@ -40,6 +40,9 @@ from typing import Dict, Any, List
 from utils import iterate_over
 from utils import iterate_parallel
 from utils import load_config_and_check
+from result_cache import get_result_cache
+from result_cache import get_execution_key
+from result_cache import execute_with_cache
 
 
 TEST_CONFIGURATION = 4
@@ -197,6 +200,13 @@ def generate_once_and_derive(benchmark_name: str, benchmark_config: Dict[str, An
             break
 
 
+def run_executor(executor, qasm_content: str, n_shots: int):
+    """Load the QASM program in the executor and execute it."""
+    executor.from_qasm(qasm_content)
+    executor.execute(n_shots)
+    return executor.get_result()
+
+
 def joined_execution(benchmark_name: str, benchmark_config: Dict[str, Any], config: Dict[str, Any]):
     """Jointly execute the programs A and B in a sequential way."""
     click.echo("Joint execution...")
@@ -207,6 +217,7 @@ def joined_execution(benchmark_name: str, benchmark_config: Dict[str, Any], conf
         (
             get_benchmark_folder(
                 config, benchmark_name, "programs", sample_name),
+            benchmark_config[sample_name]["execution_object"],
             eval(benchmark_config[sample_name]["execution_object"])(
                 repetitions=n_shots),
             get_benchmark_folder(
@@ -214,19 +225,25 @@ def joined_execution(benchmark_name: str, benchmark_config: Dict[str, Any], conf
         )
         for sample_name in ['sample_a', 'sample_b']
     ]
+    cache = get_result_cache(
+        config.get("result_cache"),
+        default_folder=os.path.join(config["folder_benchmark"], "result_cache"))
 
     # use the executors sequentially
-    for program_folder, executor, out_folder in executors:
+    for program_folder, platform, executor, out_folder in executors:
 
         for circuit_id, qasm_content in iterate_over(program_folder, ".qasm"):
-            # load the program
-            executor.from_qasm(qasm_content)
-            # execute the program
-            executor.execute(n_shots)
-            result = executor.get_result()
+            # load and execute the program (or reuse a recorded execution)
+            key = get_execution_key(
+                program=qasm_content, platform=platform, shots=n_shots)
+            result = execute_with_cache(
+                cache, key,
+                execute=lambda: run_executor(executor, qasm_content, n_shots))
             with open(os.path.join(out_folder, f"{circuit_id}.json"), "w") as execution_file:
                 print(f"Saving execution of: {circuit_id}.json")
                 json.dump(result, execution_file)
+    if cache is not None:
+        click.echo(f"Result cache: {cache.get_hit_rates()}")
 
 
 def create_benchmark(config: Dict[str, Any]):
@@ -284,7 +301,8 @@ def run_test(name, res_a, res_b, b_name, detector, detector_pred_folder):
         "benchmark_name": b_name,
         "random_seed": random_seed
     }
-    detector_object = eval(detector["detector_object"])()
+    detector_object = get_detector(
+        detector["detector_object"], kwargs=detector.get("kwargs"))
     try:
         statistic, p_value = detector_object.check(res_a, res_b, random_seed)
         comparison["statistic"] = statistic
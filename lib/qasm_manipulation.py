@@ -3,6 +3,8 @@ import numpy as np
 import uuid
 from typing import Dict, Any, List
 
+from lib.bit_permutation import permute_counts
+
 
 def remove_all_measurements(qasm_program: str):
     lines = qasm_program.split("\n")
@@ -108,22 +110,13 @@ def create_random_mapping(qasm_content: str, seed: int = None) -> Dict[int, int]
     return {f: s for f, s in zip(start_qubits, end_qubits)}
 
 
-def read_str_with_mapping(bitstring: str, direct_mapping: Dict[int, int]):
-    """Given a bitstring convert it to the original mapping."""
-    n_bits = len(bitstring)
-    return "".join([bitstring[direct_mapping[i]] for i in range(n_bits)])
-
-
 def convert_result_to_mapping(result: Dict[str, int], qubits_mapping: Dict[int, int]):
     """Convert the result via the given mapping.
 
     because a qubit maping will make also the result scrambled thus we have
     to reverse the mapping and read the results.
     """
-    return {
-        read_str_with_mapping(bitstring, qubits_mapping): freq
-        for bitstring, freq in result.items()
-    }
+    return permute_counts(result, qubits_mapping, little_endian=False)
 
 
 qasm_content = """
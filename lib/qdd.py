@@ -32,6 +32,11 @@ from qfl import dump_metadata
 from qfl import setup_environment
 from qfl import estimate_n_samples_needed
 
+from result_cache import ExecutionResultCache
+from result_cache import get_result_cache
+from result_cache import get_execution_key
+from result_cache import execute_with_cache
+
 from tqdm import tqdm
 
 # LEVEL 3
@@ -75,6 +80,45 @@ def save_rerun_data(
     update_database(con=con, table_name='RERUN', record=all_metadata)
 
 
+# the results of an execution: its profiling (e.g. time) is not reused
+CACHED_EXEC_METADATA = ["res_A", "platform_A", "res_B", "platform_B"]
+
+
+def get_platform_description(config: Dict[str, Any]) -> str:
+    """Describe how the programs are executed (all the settings involved)."""
+    return json.dumps({
+        "mode": config["mode"],
+        "platforms": config.get("platforms", []),
+        "qconvert_path": config.get("qconvert_path"),
+    }, sort_keys=True)
+
+
+def execute_qasm_program_via_cache(
+        config: Dict[str, Any],
+        program_id: str,
+        metadata_qasm: Dict[str, Any],
+        cache: ExecutionResultCache, draw: int = 0):
+    """Execute the QASM program, reusing the recorded draw (if any).
+
+    Via the cache only the results are kept (see CACHED_EXEC_METADATA).
+    """
+    if cache is None:
+        return execute_qasm_program(config, program_id, metadata_qasm)
+    with open(metadata_qasm["qasm_filepath"], 'r') as f:
+        qasm_content = f.read()
+    key = get_execution_key(
+        program=qasm_content,
+        platform=get_platform_description(config),
+        shots=estimate_n_samples_needed(
+            config, n_measured_qubits=metadata_qasm["n_qubits"]))
+    return execute_with_cache(
+        cache, key, draw=draw,
+        execute=lambda: {
+            k: v for k, v in execute_qasm_program(
+                config, program_id, metadata_qasm).items()
+            if k in CACHED_EXEC_METADATA})
+
+
 def get_program_ids_in_folder(program_folder: str) -> List[str]:
     """Get all program files."""
     return [f.replace(".json", "") for f in os.listdir(program_folder)
@@ -141,15 +185,20 @@ def debug_loop(
     """Debug a single divergent case."""
     con = get_database_connection(config)
     metadata_qasm = get_qasm_metadata(config, program_id)
+    cache = get_result_cache(
+        config.get("result_cache"),
+        default_folder=join(config["experiment_folder"], "result_cache"))
     for i in range(max_runs_per_suspect_bug):
         print(f"Execution iteration {i}", end=" - ")
-        exec_metadata = execute_qasm_program(
-            config, program_id, metadata_qasm)
+        exec_metadata = execute_qasm_program_via_cache(
+            config, program_id, metadata_qasm, cache, draw=i)
         div_metadata = detect_divergence(exec_metadata, detectors=config["detectors"])
         save_rerun_data(
             config, con, program_id=program_id,
             metadata_qasm=metadata_qasm,
             exec_metadata=exec_metadata, div_metadata=div_metadata)
+    if cache is not None:
+        print(f"Result cache: {cache.get_hit_rates()}")
     con.close()
 
 # LEVEL 1
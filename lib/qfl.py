@@ -7,6 +7,8 @@ Programming Mantra:
 - every function should have 3-5 lines + return statement.
 - max one if per function (which gives +3 lines to use).
 """
+import bisect
+import math
 import random
 import click
 import multiprocessing
@@ -27,6 +29,7 @@ from lib.utils import run_single_program_in_memory
 from lib.utils_db import get_database_connection
 from lib.utils_db import update_database
 from lib.utils_db import get_program_ids_in_table
+from lib.utils_db import check_table_exists
 
 import lib.generation_strategy
 from lib.generation_strategy import *
@@ -90,37 +93,122 @@ def dump_all_metadata(
 # LEVEL 3
 
 
+class DivergenceScanner(object):
+    """Incremental multiple-testing state over the p-values in QFLDATA.
+
+    The scanner keeps the p-values sorted in memory and reads from the
+    database only the records added since its last refresh. Thus a new
+    record costs a binary search, and each scan walks only the prefix of
+    divergent programs (plus one). The decisions are the same of a batch
+    scan over the whole table.
+    """
+
+    def __init__(self, test_name: str = 'ks', alpha_level: float = 0.05,
+                 method: str = "holm"):
+        self.pval_col = f"divergence.{test_name}.p-value"
+        self.alpha_level = alpha_level
+        self.method = method
+        # records: (sorting key, program_id, p-value)
+        self.sorted_records = []
+        self.last_rowid = 0
+        self.last_divergence_rowid = 0
+        self.reported_program_ids = set()
+
+    def add(self, rowid: int, program_id: str, p_value: float):
+        """Insert a new p-value (missing values are sorted last as NaN)."""
+        p_value = float("nan") if p_value is None else float(p_value)
+        is_nan = math.isnan(p_value)
+        key = (is_nan, 0 if is_nan else p_value, rowid)
+        bisect.insort(self.sorted_records, (key, program_id, p_value))
+
+    def refresh(self, con):
+        """Read the records and divergences added since the last refresh."""
+        if check_table_exists(con, "QFLDATA"):
+            new_rows = con.execute(f"""
+                SELECT rowid, program_id, [{self.pval_col}] FROM QFLDATA
+                WHERE rowid > ? ORDER BY rowid""",
+                (self.last_rowid,)).fetchall()
+            for rowid, program_id, p_value in new_rows:
+                self.add(rowid, program_id, p_value)
+                self.last_rowid = rowid
+        if check_table_exists(con, "DIVERGENCE"):
+            new_rows = con.execute("""
+                SELECT rowid, program_id FROM DIVERGENCE
+                WHERE rowid > ? ORDER BY rowid""",
+                (self.last_divergence_rowid,)).fetchall()
+            for rowid, program_id in new_rows:
+                self.reported_program_ids.add(program_id)
+                self.last_divergence_rowid = rowid
+
+    def get_threshold(self, ordinal_i: int, k: int):
+        """Get the threshold of the i-th smallest p-value (out of k)."""
+        if self.method == 'holm':
+            return self.alpha_level / (k - ordinal_i + 1)
+        elif self.method == 'bonferroni':
+            return self.alpha_level / (k)
+        elif self.method == 'bh':
+            return (self.alpha_level / (k)) * ordinal_i
+
+    def get_divergent_program_ids(self):
+        """Get all the divergent programs, in order of p-value."""
+        k = len(self.sorted_records)
+        for i, (_, program_id, P_i) in enumerate(self.sorted_records):
+            if P_i > self.get_threshold(ordinal_i=i + 1, k=k):
+                print(f"i*: {i}")
+                return [r[1] for r in self.sorted_records[:i]]
+        return [r[1] for r in self.sorted_records]
+
+    def scan(self):
+        """Get the divergent programs which were not reported yet."""
+        new_program_ids = [
+            program_id for program_id in self.get_divergent_program_ids()
+            if program_id not in self.reported_program_ids]
+        self.reported_program_ids.update(new_program_ids)
+        return new_program_ids
+
+
+DIVERGENCE_SCANNERS = {}
+
+
+def get_divergence_scanner(config: Dict[str, Any], test_name: str,
+                           alpha_level: float, method: str):
+    """Get the scanner of the experiment, one per process and setting."""
+    key = (config["experiment_folder"], test_name, alpha_level, method)
+    if key not in DIVERGENCE_SCANNERS:
+        DIVERGENCE_SCANNERS[key] = DivergenceScanner(
+            test_name=test_name, alpha_level=alpha_level, method=method)
+    return DIVERGENCE_SCANNERS[key]
+
+
+def read_records(con, table_name: str, program_ids: List[str],
+                 chunk_size: int = 500):
+    """Read the full records of the given programs (in the given order)."""
+    chunks = [
+        pd.read_sql(
+            f"SELECT * FROM {table_name} WHERE program_id IN " +
+            f"({', '.join(['?'] * len(program_ids[i:i + chunk_size]))})",
+            con, params=program_ids[i:i + chunk_size])
+        for i in range(0, len(program_ids), chunk_size)
+    ]
+    df = pd.concat(chunks)
+    position = {program_id: i for i, program_id in enumerate(program_ids)}
+    return df.iloc[df["program_id"].map(position).argsort()]
+
+
 def scan_for_divergence(config: Dict[str, Any], test_name: str = 'ks',
                         alpha_level: int = 0.05, method="holm"):
-    """Scan for divergence in the table."""
+    """Scan for divergence in the table.
+
+    Note that the scan is incremental: the scanner of this process reads
+    only the records added since its previous scan.
+    """
     con = get_database_connection(config, "qfl.db")
-    df = pd.read_sql("SELECT * FROM QFLDATA", con)
-    pval_col = f"divergence.{test_name}.p-value"
-    df_sorted_pvals = df.sort_values(by=[pval_col])
-    k = len(df_sorted_pvals)
-    i_star = None
-    for i, (idx, row) in enumerate(df_sorted_pvals.iterrows()):
-        ordinal_i = i + 1
-        P_i = row[pval_col]
-        if method == 'holm':
-            threshold = alpha_level / (k - ordinal_i + 1)
-        elif method == 'bonferroni':
-            threshold = alpha_level / (k)
-        elif method == 'bh':
-            threshold = (alpha_level / (k)) * ordinal_i
-        # print(f"(i: {ordinal_i}) current p-value: {P_i} vs threshold: {threshold}")
-        if P_i > threshold:
-            i_star = i
-            print(f"i*: {i_star}")
-            break
-    if i_star is None:
-        df_divergent = df_sorted_pvals
-    else:
-        df_divergent = df_sorted_pvals.iloc[:i_star]
-    all_program_ids = get_program_ids_in_table(con, table_name='DIVERGENCE')
-    new_df_divergent = df_divergent[
-        ~df_divergent["program_id"].isin(all_program_ids)]
-    if len(new_df_divergent) > 0:
+    scanner = get_divergence_scanner(
+        config, test_name=test_name, alpha_level=alpha_level, method=method)
+    scanner.refresh(con)
+    new_program_ids = scanner.scan()
+    if len(new_program_ids) > 0:
+        new_df_divergent = read_records(con, "QFLDATA", new_program_ids)
         print(f"{len(new_df_divergent)} new divergent programs found.")
         print(new_df_divergent)
         for record in new_df_divergent.to_dict(orient='records'):
@@ -129,13 +217,79 @@ def scan_for_divergence(config: Dict[str, Any], test_name: str = 'ks',
 
 
 def detect_divergence(exec_metadata, detectors: List[Dict[str, Any]] = None):
-    """Detect divergence with all the detectors and save the results."""
+    """Detect divergence with all the detectors and save the results.
+
+    The two results are aligned once and shared by all the detectors.
+    """
+    results = {}
+    aligned = AlignedCounts(
+        result_A=exec_metadata['res_A'], result_B=exec_metadata['res_B'])
+    for detector_config in detectors:
+        detector_name = detector_config["name"]
+        start_check = timer()
+        detector = get_detector(
+            detector_config["detector_object"],
+            kwargs=detector_config.get("kwargs"))
+        stat, pval = detector.check_aligned(aligned)
+        end_check = timer()
+        time_check = end_check - start_check
+        results[detector_name] = {"statistic": stat, "p-value": pval, "time": time_check}
+    return results
+
+
+def detect_divergence_exactly(
+        exec_metadata, detectors: List[Dict[str, Any]] = None,
+        distance: str = "total_variation", tolerance: float = 1e-6):
+    """Detect divergence between exact distributions (no sampling).
+
+    The same decision (see ExactDistance_Detector) is stored under the
+    name of each detector, thus the divergence scan works as usual.
+    """
+    start_check = timer()
+    detector = ExactDistance_Detector(distance=distance, tolerance=tolerance)
+    stat, pval = detector.check(
+        result_A=exec_metadata['res_A'], result_B=exec_metadata['res_B'])
+    time_check = timer() - start_check
+    return {
+        detector_config["name"]: {
+            "statistic": stat, "p-value": pval, "time": time_check}
+        for detector_config in detectors
+    }
+
+
+def apply_sequential_decision(div_metadata, decision: str):
+    """Replace the p-values by the decision of the sequential test.
+
+    The detectors ran on counts that stopped as soon as the KS test looked
+    significant, thus their p-values are nominal (each look is a new chance
+    to be small). As for ExactDistance_Detector, the p-value becomes 0 for
+    'divergent' and 1 for 'equivalent' (the errors of these decisions are
+    bounded by the alpha and beta of GroupSequentialKSTest), while the
+    nominal one is kept as nominal_p-value.
+    """
+    p_value = 0. if decision == "divergent" else 1.
+    return {
+        detector_name: {
+            **results, "nominal_p-value": results["p-value"],
+            "p-value": p_value}
+        for detector_name, results in div_metadata.items()
+    }
+
+
+def detect_divergence_with_reference(
+        exec_metadata, detectors: List[Dict[str, Any]] = None):
+    """Detect divergence of a sample (res_B) from an exact reference (res_A).
+
+    Each detector runs its one-sample counterpart (see
+    get_reference_detector) and its results keep the detector name.
+    """
     results = {}
     for detector_config in detectors:
         detector_name = detector_config["name"]
         start_check = timer()
-        detector = eval(detector_config["detector_object"])()
-        stat, pval = detector.check(result_A=exec_metadata['res_A'], result_B=exec_metadata['res_B'])
+        detector = get_reference_detector(detector_config)
+        stat, pval = detector.check_reference(
+            reference=exec_metadata['res_A'], result=exec_metadata['res_B'])
         end_check = timer()
         time_check = end_check - start_check
         results[detector_name] = {"statistic": stat, "p-value": pval, "time": time_check}
@@ -0,0 +1,111 @@
+import sqlite3 as sl
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib.qfl import DivergenceScanner
+from lib.qfl import apply_sequential_decision
+
+
+PVAL_COL = "divergence.ks.p-value"
+
+
+def batch_scan(df, alpha_level, method):
+    """Divergent programs of the whole table (as the batch scan did)."""
+    df_sorted_pvals = df.sort_values(by=[PVAL_COL])
+    k = len(df_sorted_pvals)
+    i_star = None
+    for i, (idx, row) in enumerate(df_sorted_pvals.iterrows()):
+        ordinal_i = i + 1
+        P_i = row[PVAL_COL]
+        if method == 'holm':
+            threshold = alpha_level / (k - ordinal_i + 1)
+        elif method == 'bonferroni':
+            threshold = alpha_level / (k)
+        elif method == 'bh':
+            threshold = (alpha_level / (k)) * ordinal_i
+        if P_i > threshold:
+            i_star = i
+            break
+    if i_star is None:
+        return list(df_sorted_pvals["program_id"])
+    return list(df_sorted_pvals.iloc[:i_star]["program_id"])
+
+
+def random_p_values(rng, n, n_divergent, nan_fraction=0.):
+    """Distinct p-values: n_divergent tiny ones, the others uniform."""
+    p_values = np.concatenate([
+        rng.uniform(0, 1e-6, size=n_divergent),
+        rng.uniform(0, 1, size=n - n_divergent)])
+    rng.shuffle(p_values)
+    p_values[rng.uniform(size=n) < nan_fraction] = np.nan
+    return p_values
+
+
+def insert(con, program_ids, p_values):
+    pd.DataFrame({"program_id": program_ids, PVAL_COL: p_values}).to_sql(
+        "QFLDATA", con, if_exists="append", index=False)
+
+
+@pytest.mark.parametrize("method", ["holm", "bonferroni", "bh"])
+@pytest.mark.parametrize("nan_fraction", [0., 0.2])
+def test_incremental_scan_as_batch_scan(method, nan_fraction):
+    rng = np.random.default_rng(42)
+    con = sl.connect(":memory:")
+    scanner = DivergenceScanner(
+        test_name="ks", alpha_level=0.05, method=method)
+    reported_incremental, reported_batch = set(), set()
+    for i_batch, n in enumerate([1, 5, 20, 100, 300]):
+        program_ids = [f"p_{i_batch}_{i}" for i in range(n)]
+        insert(con, program_ids, random_p_values(
+            rng, n, n_divergent=n // 5, nan_fraction=nan_fraction))
+        scanner.refresh(con)
+        new_ids = scanner.scan()
+        df = pd.read_sql("SELECT * FROM QFLDATA", con)
+        expected = batch_scan(df, alpha_level=0.05, method=method)
+        assert sorted(scanner.get_divergent_program_ids()) == sorted(expected)
+        assert set(new_ids) == set(expected) - reported_batch
+        reported_incremental.update(new_ids)
+        reported_batch.update(expected)
+    assert reported_incremental == reported_batch
+
+
+def test_scan_with_nan_p_values_sorted_last():
+    con = sl.connect(":memory:")
+    insert(con, ["a", "b", "c"], [np.nan, 1e-9, np.nan])
+    scanner = DivergenceScanner(test_name="ks", method="holm")
+    scanner.refresh(con)
+    df = pd.read_sql("SELECT * FROM QFLDATA", con)
+    # NaN is never above a threshold, thus it does not stop the scan
+    assert scanner.get_divergent_program_ids()[0] == "b"
+    assert sorted(scanner.scan()) == sorted(
+        batch_scan(df, alpha_level=0.05, method="holm"))
+
+
+def test_scan_reports_each_program_once():
+    con = sl.connect(":memory:")
+    insert(con, ["a", "b", "c"], [1e-9, 0.5, 0.9])
+    scanner = DivergenceScanner(test_name="ks", method="holm")
+    scanner.refresh(con)
+    assert scanner.scan() == ["a"]
+    insert(con, ["d"], [1e-10])
+    scanner.refresh(con)
+    assert scanner.scan() == ["d"]
+    assert scanner.scan() == []
+
+
+def test_sequential_decision_replaces_the_nominal_p_values():
+    div_metadata = {"ks": {"statistic": 0.3, "p-value": 0.01, "time": 1.}}
+    divergent = apply_sequential_decision(div_metadata, "divergent")
+    equivalent = apply_sequential_decision(div_metadata, "equivalent")
+    assert divergent["ks"]["p-value"] == 0.
+    assert equivalent["ks"]["p-value"] == 1.
+    assert divergent["ks"]["nominal_p-value"] == 0.01
+    assert divergent["ks"]["statistic"] == 0.3
+    con = sl.connect(":memory:")
+    insert(con, ["a", "b", "c"], [
+        divergent["ks"]["p-value"], equivalent["ks"]["p-value"], 0.5])
+    scanner = DivergenceScanner(test_name="ks", method="holm")
+    scanner.refresh(con)
+    assert scanner.scan() == ["a"]
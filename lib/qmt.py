@@ -8,6 +8,8 @@ Programming Mantra:
 - every function should have 3-5 lines + return statement.
 - max one if per function (which gives +3 lines to use).
 """
+import ast
+from contextlib import nullcontext
 from datetime import datetime
 import os
 from os.path import join
@@ -17,7 +19,11 @@ import multiprocessing
 import time
 from timeit import default_timer as timer
 from typing import Dict, List, Tuple, Any, Callable
+from queue import Empty
 import random
+import re
+import signal
+import sys
 import uuid
 import traceback
 
@@ -29,6 +35,8 @@ from termcolor import colored
 
 
 from lib.utils import break_function_with_timeout
+from lib.utils import FileLock
+from lib.utils import PersistentProcess
 from lib.utils import load_config_and_check
 from lib.utils import create_folder_structure
 from lib.utils import dump_metadata
@@ -39,6 +47,7 @@ from lib.utils import iterdict_types
 from lib.utils_db import get_database_connection
 from lib.utils_db import update_database
 from lib.utils_db import get_program_ids_in_table
+from lib.utils_db import DatabaseWriter
 
 from lib.generation_strategy_python import *
 from lib.detectors import *
@@ -47,15 +56,36 @@ from lib.qfl import estimate_n_samples_needed
 from lib.qfl import setup_environment
 from lib.qfl import scan_for_divergence
 from lib.qfl import detect_divergence
+from lib.qfl import detect_divergence_exactly
+from lib.qfl import detect_divergence_with_reference
+from lib.qfl import apply_sequential_decision
+
+from lib.exact_distribution import is_exactly_simulable
+from lib.exact_distribution import get_exact_probabilities
+from lib.exact_distribution import hash_program
+from lib.exact_distribution import ProgramResultCache
+from lib.transpile_cache import install_transpile_cache
+from lib.section_snapshots import install_section_snapshots
+from lib.section_snapshots import get_section_snapshots
+from lib.circuit_object import ObjectProgram
 
 from lib.metamorph import *
 from lib.metamorph import MetamorphicRelationship
 from lib.metamorph import Pipeline
+from lib.metamorph import get_sections
+from lib.metamorph import reconstruct_sections
 
 from lib.mr import MetamorphicTransformation
 from lib.mr.chain import ChainedTransformation
 
 
+# metadata of the execution modes, stored only when the mode is in use
+OPTIONAL_EXEC_METADATA = [
+    "adaptive_shots", "exact_distribution", "exact_reference",
+    "equivalence_prefilter", "batched_execution", "transpile_cache",
+    "object_mode", "fanout", "section_snapshots"]
+
+
 def dump_all_metadata(
         out_folder, program_id, **kwargs):
     """Dump all metadata."""
@@ -75,26 +105,283 @@ def dump_all_metadata(
     return all_metadata
 
 
+# PARALLEL WORKERS
+
+
+WORKER_CONTEXT = {"worker_id": None, "coverage_lock": None}
+
+
+def init_worker_context(worker_id: int, coverage_lock):
+    """Store the identity of the current worker and its shared lock."""
+    WORKER_CONTEXT["worker_id"] = worker_id
+    WORKER_CONTEXT["coverage_lock"] = coverage_lock
+
+
+def shared_resource(resource: str):
+    """Return the lock guarding a resource shared among the workers.
+
+    Note that in a serial run there is no lock, thus we get a no-op context.
+    """
+    lock = WORKER_CONTEXT[f"{resource}_lock"]
+    return lock if lock is not None else nullcontext()
+
+
+def get_coverage_settings(config: Dict[str, Any]):
+    """Get the coverage settings, with a private data file per worker."""
+    settings = {
+        "data_suffix": False,
+        "config_file": config["coverage_settings_filepath"]}
+    worker_id = WORKER_CONTEXT["worker_id"]
+    if worker_id is not None:
+        settings["data_file"] = join(
+            config["experiment_folder"], f".coverage.worker_{worker_id}")
+    return settings
+
+
+def get_backends_in_use(config: Dict[str, Any]) -> List[str]:
+    """Collect the Aer backends that the programs of this run can ask for."""
+    backends = set(config["generation_strategy"]["backends"])
+    for strategies_key in ["morphq_metamorphic_strategies",
+                           "qdiff_diff_testing"]:
+        strategies = config.get(strategies_key) or {}
+        change_backend_config = strategies.get("ChangeBackend") or {}
+        backends.update(change_backend_config.get("available_backends", []))
+    return sorted(backends)
+
+
+def warm_up_executor(worker_id: int, coverage_lock, backends: List[str]):
+    """Prepare a persistent executor before its first program couple.
+
+    It gets the worker identity and lock, and builds the Aer backends once
+    (the heavy imports are already there since we are in lib.qmt).
+    """
+    init_worker_context(worker_id, coverage_lock)
+    # the executor is killed on timeout, even in the middle of a simulation
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    from qiskit import Aer
+    for backend in backends:
+        try:
+            Aer.get_backend(backend)
+        except Exception as e:
+            print(f"Could not warm up backend {backend}: {e}")
+
+
+def create_executor(config: Dict[str, Any]):
+    """Create the persistent process running the program couples."""
+    return PersistentProcess(
+        initializer=warm_up_executor,
+        initargs=(WORKER_CONTEXT["worker_id"], WORKER_CONTEXT["coverage_lock"],
+                  get_backends_in_use(config)),
+        max_tasks=config.get("max_couples_per_executor", None),
+        name="executor")
+
+
+# DATABASE WRITER
+
+
+def scan_qfl_database_for_divergence(config: Dict[str, Any]):
+    """Scan the qfl.db for divergence with the settings of the config."""
+    scan_for_divergence(
+        config,
+        method=config["divergence_threshold_method"],
+        test_name=config["divergence_primary_test"],
+        alpha_level=config["divergence_alpha_level"])
+
+
+def write_records_from_queue(config: Dict[str, Any], db_queue):
+    """Write the records of the queue in qfl.db and scan for divergence.
+
+    The records are written in batches, and the divergence scan runs after
+    each batch. This is the only process writing to qfl.db, it stops when
+    it gets None or when its parent is gone.
+    """
+    # on Ctrl-C the parent stops us, once the producers are stopped
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    writer = DatabaseWriter(
+        join(config["experiment_folder"], "qfl.db"),
+        batch_size=config.get("db_batch_size", 100),
+        flush_interval=config.get("db_flush_interval", 5))
+    parent_pid = os.getppid()
+    is_over = False
+    while not is_over:
+        try:
+            item = db_queue.get(timeout=writer.flush_interval)
+        except Empty:
+            item = ()
+        is_over = item is None or os.getppid() != parent_pid
+        if item:
+            writer.append(*item)
+        if (is_over or writer.is_flush_due()) and \
+                "QFLDATA" in writer.flush():
+            scan_qfl_database_for_divergence(config)
+    writer.close()
+
+
+def start_database_writer(config: Dict[str, Any]):
+    """Start the process writing the records that get in the queue."""
+    db_queue = multiprocessing.Queue()
+    writer_process = multiprocessing.Process(
+        target=write_records_from_queue, name="db_writer",
+        args=(config, db_queue))
+    writer_process.start()
+    return writer_process, db_queue
+
+
+def stop_database_writer(writer_process, db_queue):
+    """Let the writer flush the records left in the queue, then stop."""
+    db_queue.put(None)
+    writer_process.join()
+
+
 # LEVEL 3
 
 
+# programs prepared by the pre-filter for the execution of the same couple
+PREPARED_PROGRAMS = {}
+
+
 def execute_single_py_program(filepath: str):
-    """Execute a single python program."""
+    """Execute a single python program.
+
+    With the section snapshots installed (see setup_section_snapshots) it
+    resumes from the snapshot of its longest prefix already run.
+    """
     py_content = open(filepath, "r").read()
+    snapshots = get_section_snapshots()
+    if snapshots is not None:
+        return snapshots.execute(py_content)
     GLOBALS = {"RESULT": 0}
     exec(py_content, GLOBALS)
     return GLOBALS["RESULT"]
 
 
-def fuzz_source_program(
-        generator: Fuzzer,
-        experiment_folder: str = None,
+def prepare_py_program_in_batches(filepath: str) -> Tuple[Dict[str, Any], str]:
+    """Run the program up to its execution, to then execute it in batches.
+
+    It returns the namespace after the sections before EXECUTION and the
+    code of EXECUTION (and the sections after it) where the number of
+    shots is the variable BATCH_SHOTS. A program already prepared by the
+    pre-filter (see PREPARED_PROGRAMS) is not prepared again.
+    """
+    if filepath in PREPARED_PROGRAMS:
+        return PREPARED_PROGRAMS.pop(filepath)
+    sections = get_sections(open(filepath, "r").read())
+    names = list(sections.keys())
+    i_execution = names.index("EXECUTION")
+    setup_code = reconstruct_sections(
+        {name: sections[name] for name in names[:i_execution]})
+    execution_code = reconstruct_sections(
+        {name: sections[name] for name in names[i_execution:]})
+    batch_code = re.sub(
+        r"shots\s*=\s*\d+", "shots=BATCH_SHOTS", execution_code)
+    snapshots = get_section_snapshots()
+    if snapshots is not None:
+        return snapshots.run_sections(
+            {name: sections[name] for name in names[:i_execution]}), \
+            batch_code
+    GLOBALS = {"RESULT": 0}
+    exec(setup_code, GLOBALS)
+    return GLOBALS, batch_code
+
+
+def execute_py_program_batch(
+        namespace: Dict[str, Any], batch_code: str, shots: int):
+    """Execute a batch of shots of a prepared program (see above)."""
+    GLOBALS = {**namespace, "BATCH_SHOTS": shots}
+    exec(batch_code, GLOBALS)
+    return GLOBALS["RESULT"]
+
+
+def get_executed_circuit(namespace: Dict[str, Any], batch_code: str):
+    """Get the circuit executed by a prepared program (see above).
+
+    It returns None if the program does not execute a single circuit.
+    """
+    circuit_ids = re.findall(r"execute\(\s*([a-zA-Z0-9_]+)", batch_code)
+    if len(circuit_ids) != 1:
+        return None
+    return namespace.get(circuit_ids[0])
+
+
+def match_get_backend(node: ast.AST) -> str:
+    """Match `Aer.get_backend('name')` and return the name (else None)."""
+    if (isinstance(node, ast.Call) and
+            isinstance(node.func, ast.Attribute) and
+            node.func.attr == "get_backend" and len(node.args) == 1 and
+            isinstance(node.args[0], ast.Constant)):
+        return node.args[0].value
+    return None
+
+
+def match_execute_counts(node: ast.AST) -> Tuple[str, str, int]:
+    """Match `execute(qc, backend=b, shots=n).result().get_counts(qc)`.
+
+    It returns the circuit id, the backend id and the shots (else None).
+    """
+    try:
+        get_counts, result = node.func, node.func.value.func
+        execute_call = node.func.value.func.value
+        keywords = {k.arg: k.value for k in execute_call.keywords}
+        if (get_counts.attr == "get_counts" and result.attr == "result" and
+                execute_call.func.id == "execute" and
+                set(keywords.keys()) == {"backend", "shots"} and
+                len(execute_call.args) == 1 and
+                execute_call.args[0].id == node.args[0].id):
+            return (execute_call.args[0].id, keywords["backend"].id,
+                    int(keywords["shots"].value))
+    except (AttributeError, IndexError, TypeError, ValueError):
+        pass
+    return None
+
+
+def parse_single_execution(filepath: str) -> Tuple[str, str, int]:
+    """Get circuit id, backend name and shots of a plain execution.
+
+    Plain means that the last section is EXECUTION, which only imports,
+    gets an Aer backend, executes a single circuit and returns its counts
+    (as the generated programs). It returns None otherwise.
+    """
+    sections = get_sections(open(filepath, "r").read())
+    if list(sections.keys())[-1] != "EXECUTION":
+        return None
+    backends, execution = {}, None
+    for node in ast.parse(sections["EXECUTION"]).body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            continue
+        if not (isinstance(node, ast.Assign) and len(node.targets) == 1 and
+                isinstance(node.targets[0], ast.Name)):
+            return None
+        target = node.targets[0].id
+        if match_get_backend(node.value) is not None:
+            backends[target] = match_get_backend(node.value)
+        elif (target == "counts" and execution is None and
+                match_execute_counts(node.value) is not None):
+            execution = match_execute_counts(node.value)
+        elif not (target == "RESULT" and isinstance(node.value, ast.Name) and
+                  node.value.id == "counts"):
+            return None
+    if execution is None or execution[1] not in backends:
+        return None
+    circuit_id, backend_id, shots = execution
+    return circuit_id, backends[backend_id], shots
+
+
+def merge_results(result: Any, new_result: Any) -> Any:
+    """Sum the counts of two results (or of their lists, one per circuit)."""
+    if isinstance(new_result, list):
+        return [merge_results(r, new_r)
+                for r, new_r in zip(result or [None] * len(new_result),
+                                    new_result)]
+    merged = dict(result or {})
+    for outcome, count in new_result.items():
+        merged[outcome] = merged.get(outcome, 0) + count
+    return merged
+
+
+def sample_generation_settings(
         config_generation: Dict[str, Any] = None,
-        config: Dict[str, Any] = None,
-        feedback=None):
-    """Fuzz a quantum circuit in Qiskit according to the given strategy."""
-    start_generation = timer()
-    program_id = uuid.uuid4().hex
+        config: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Sample the settings of a new program according to the strategy."""
     selected_gate_set = config_generation["gate_set"]
     if config_generation["gate_set_dropout"] is not None:
         dropout = config_generation["gate_set_dropout"]
@@ -122,16 +409,56 @@ def fuzz_source_program(
 
     shots = estimate_n_samples_needed(
         config, n_measured_qubits=n_qubits)
+    return {
+        "gate_set": selected_gate_set,
+        "optimizations": selected_optimizations,
+        "n_qubits": n_qubits,
+        "n_ops": n_ops,
+        "opt_level": opt_level,
+        "target_gates": target_gates,
+        "shots": shots,
+        "backend": np.random.choice(config_generation["backends"]),
+    }
+
+
+def get_source_metadata(
+        program_id: str, settings: Dict[str, Any], py_file_path: str,
+        time_generation: float, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe the generated source program."""
+    return {
+        'program_id': program_id,
+        'selected_gate_set': [g["name"] for g in settings["gate_set"]],
+        'selected_optimization': settings["optimizations"],
+        'shots': settings["shots"],
+        'n_qubits': settings["n_qubits"],
+        'n_ops': settings["n_ops"],
+        'opt_level': settings["opt_level"],
+        'target_gates': settings["target_gates"],
+        'py_file_path': py_file_path,
+        'time_generation': time_generation,
+        **metadata
+    }
+
+
+def fuzz_source_program(
+        generator: Fuzzer,
+        experiment_folder: str = None,
+        config_generation: Dict[str, Any] = None,
+        config: Dict[str, Any] = None,
+        feedback=None):
+    """Fuzz a quantum circuit in Qiskit according to the given strategy."""
+    start_generation = timer()
+    settings = sample_generation_settings(config_generation, config)
 
     py_file_content, metadata = generator.generate_file(
-        gate_set=selected_gate_set,
-        n_qubits=n_qubits,
-        n_ops=n_ops,
-        optimizations=selected_optimizations,
-        backend=np.random.choice(config_generation["backends"]),
-        shots=shots,
-        level_auto_optimization=opt_level,
-        target_gates=target_gates)
+        gate_set=settings["gate_set"],
+        n_qubits=settings["n_qubits"],
+        n_ops=settings["n_ops"],
+        optimizations=settings["optimizations"],
+        backend=settings["backend"],
+        shots=settings["shots"],
+        level_auto_optimization=settings["opt_level"],
+        target_gates=settings["target_gates"])
 
     program_id = uuid.uuid4().hex
     py_file_path = join(
@@ -140,35 +467,93 @@ def fuzz_source_program(
         f.write(py_file_content)
     end_generation = timer()
     time_generation = end_generation - start_generation
-    metadata = {
-        'program_id': program_id,
-        'selected_gate_set': [g["name"] for g in selected_gate_set],
-        'selected_optimization': selected_optimizations,
-        'shots': shots,
-        'n_qubits': n_qubits,
-        'n_ops': n_ops,
-        'opt_level': opt_level,
-        'target_gates': target_gates,
-        'py_file_path': py_file_path,
-        'time_generation': time_generation,
-        **metadata
-    }
+    metadata = get_source_metadata(
+        program_id, settings, py_file_path, time_generation, metadata)
     return program_id, metadata
 
 
+def fuzz_source_object(
+        generator: Fuzzer,
+        experiment_folder: str = None,
+        config_generation: Dict[str, Any] = None,
+        config: Dict[str, Any] = None):
+    """Fuzz a quantum circuit as an object (see fuzz_source_program).
+
+    Its source file is written only on demand (see emit_program_source),
+    at the py_file_path of its metadata.
+    """
+    start_generation = timer()
+    settings = sample_generation_settings(config_generation, config)
+
+    program, metadata = generator.generate_program_object(
+        gate_set=settings["gate_set"],
+        n_qubits=settings["n_qubits"],
+        n_ops=settings["n_ops"],
+        backend=settings["backend"],
+        shots=settings["shots"],
+        level_auto_optimization=settings["opt_level"],
+        target_gates=settings["target_gates"])
+
+    program_id = uuid.uuid4().hex
+    py_file_path = join(
+        experiment_folder, "programs", "source", f"{program_id}.py")
+    time_generation = timer() - start_generation
+    metadata = get_source_metadata(
+        program_id, settings, py_file_path, time_generation, metadata)
+    return program_id, metadata, program
+
+
+def emit_program_source(metadata: Dict[str, Any], program: ObjectProgram):
+    """Write the source code of the program object at its py_file_path."""
+    with open(metadata["py_file_path"], "w") as f:
+        f.write(program.to_source())
+
+
 def execute_programs(
         metadata_source:  Dict[str, Any],
         metadata_followup: Dict[str, Any]):
     """Execute programs and return the metadata with results."""
+    return execute_runs(
+        run_source=lambda: execute_program(metadata_source),
+        run_followup=lambda: execute_program(metadata_followup))
+
+
+def execute_program(metadata: Dict[str, Any]):
+    """Execute the program, from its prepared form if there is one.
+
+    The program is prepared if the pre-filter prepared it (see
+    PREPARED_PROGRAMS), then it runs all its shots in a single batch.
+    """
+    if metadata["py_file_path"] not in PREPARED_PROGRAMS:
+        return execute_single_py_program(metadata["py_file_path"])
+    return execute_py_program_batch(
+        *prepare_py_program_in_batches(metadata["py_file_path"]),
+        shots=metadata["shots"])
+
+
+def execute_program_objects(
+        source: ObjectProgram, followup: ObjectProgram,
+        config: Dict[str, Any]):
+    """Execute the program objects (as execute_programs, without files)."""
+    transpile_cache = setup_transpile_cache(config)
+    exec_metadata = execute_runs(
+        run_source=source.execute, run_followup=followup.execute)
+    if transpile_cache is not None:
+        exec_metadata["transpile_cache"] = transpile_cache.get_hit_rates()
+    return exec_metadata
+
+
+def execute_runs(run_source: Callable, run_followup: Callable):
+    """Run source and follow-up, and return the metadata with results."""
     exceptions = {'source': None, 'followup': None}
     start_exec = timer()
     try:
-        res_a = execute_single_py_program(metadata_source["py_file_path"])
+        res_a = run_source()
     except Exception as e:
         exceptions['source'] = str(e)
         res_a = {"0": 1}
     try:
-        res_b = execute_single_py_program(metadata_followup["py_file_path"])
+        res_b = run_followup()
     except Exception as e:
         exceptions['followup'] = str(e)
         res_b = {"0": 1}
@@ -190,22 +575,628 @@ def execute_programs(
     return exec_metadata
 
 
+def execute_programs_batched(
+        metadata_source: Dict[str, Any],
+        metadata_followup: Dict[str, Any],
+        config: Dict[str, Any]):
+    """Execute the circuits of the two programs in a single Aer job.
+
+    See execute_programs_in_jobs.
+    """
+    run_options = config["batched_execution"].get("run_options") or {}
+    start_exec = timer()
+    results, exceptions, jobs = execute_programs_in_jobs(
+        {'source': metadata_source, 'followup': metadata_followup},
+        run_options=run_options)
+    end_exec = timer()
+    time_exec = end_exec - start_exec
+    if exceptions['followup'] is not None or exceptions['source'] is not None:
+        print(colored(f"Exceptions from execution: {exceptions}", 'red'))
+    exec_metadata = {
+        "res_A": results['source'],
+        "platform_A": "source",
+        "res_B": results['followup'],
+        "platform_B": "follow_up",
+        "exceptions": exceptions,
+        "time_exec": time_exec,
+        "batched_execution": {
+            "n_jobs": len(jobs),
+            "batched": any(len(names) > 1 for names in jobs.values()),
+        }
+    }
+    return exec_metadata
+
+
+def execute_programs_in_jobs(
+        all_metadata: Dict[str, Dict[str, Any]],
+        run_options: Dict[str, Any] = None):
+    """Execute the circuits of the programs (by name) in shared Aer jobs.
+
+    The programs are built up to their execution, then the circuits that
+    share backend and shots go in the same job, so that Aer runs them as
+    parallel experiments and the job setup is paid once. The execute call
+    transpiles each circuit as in the program itself. A program whose
+    execution is not plain (see parse_single_execution), or whose
+    backend or shots differ (e.g. ChangeBackend), runs on its own. If a
+    shared job fails, its programs run on their own to find the culprit.
+    It returns the results, the exceptions (by name) and the jobs.
+    """
+    from qiskit import Aer, execute
+    run_options = run_options or {}
+    exceptions = {name: None for name in all_metadata.keys()}
+    prepared, executions, results = {}, {}, {}
+    for name, metadata in all_metadata.items():
+        try:
+            prepared[name] = prepare_py_program_in_batches(
+                metadata["py_file_path"])
+            executions[name] = parse_single_execution(metadata["py_file_path"])
+        except Exception as e:
+            exceptions[name] = str(e)
+    jobs = {}
+    for name, execution in executions.items():
+        if execution is not None:
+            _, backend_name, shots = execution
+            jobs.setdefault((backend_name, shots), []).append(name)
+    for (backend_name, shots), names in jobs.items():
+        circuits = [prepared[name][0][executions[name][0]] for name in names]
+        try:
+            job_result = execute(
+                circuits, backend=Aer.get_backend(backend_name), shots=shots,
+                **run_options).result()
+            for i, name in enumerate(names):
+                results[name] = job_result.get_counts(i)
+        except Exception as e:
+            print(f"Batched execution failed ({e}), run one by one.")
+    for name, metadata in all_metadata.items():
+        if name in results:
+            continue
+        try:
+            if name not in prepared:
+                raise Exception(exceptions[name])
+            execution = executions[name]
+            shots = metadata["shots"] if execution is None else execution[2]
+            results[name] = execute_py_program_batch(
+                *prepared[name], shots=shots)
+        except Exception as e:
+            exceptions[name] = str(e)
+            results[name] = {"0": 1}
+    return results, exceptions, jobs
+
+
+def execute_programs_exactly(
+        metadata_source: Dict[str, Any],
+        metadata_followup: Dict[str, Any],
+        config: Dict[str, Any]):
+    """Compute the exact output distributions of the programs, if possible.
+
+    It applies when both programs execute a single circuit with the same
+    execution section (e.g. not after ChangeBackend, whose point is to
+    sample on another backend), with at most max_qubits and no mid-circuit
+    measurement. Otherwise (or if the exact simulation fails) they run
+    all their shots as usual, reusing the circuits already built.
+    """
+    max_qubits = config["exact_distribution"].get("max_qubits", 20)
+    exceptions = {'source': None, 'followup': None}
+    all_metadata = {'source': metadata_source, 'followup': metadata_followup}
+    prepared, results = {}, {}
+    start_exec = timer()
+    for name, metadata in all_metadata.items():
+        try:
+            prepared[name] = prepare_py_program_in_batches(
+                metadata["py_file_path"])
+        except Exception as e:
+            exceptions[name] = str(e)
+    circuits = {name: get_executed_circuit(*prepared_program)
+                for name, prepared_program in prepared.items()}
+    is_exact = (
+        len(prepared) == 2 and
+        prepared['source'][1] == prepared['followup'][1] and
+        all(circuit is not None and
+            is_exactly_simulable(circuit, max_qubits=max_qubits)
+            for circuit in circuits.values()))
+    exact_results, exact_error = None, None
+    if is_exact:
+        exact_results, exact_error = get_exact_results(circuits)
+    for name, metadata in all_metadata.items():
+        try:
+            if name not in prepared:
+                results[name] = {"0": 1}
+            elif exact_results is not None:
+                results[name] = exact_results[name]
+            else:
+                results[name] = execute_py_program_batch(
+                    *prepared[name], shots=metadata["shots"])
+        except Exception as e:
+            exceptions[name] = str(e)
+            results[name] = {"0": 1}
+    end_exec = timer()
+    time_exec = end_exec - start_exec
+    if exceptions['followup'] is not None or exceptions['source'] is not None:
+        print(colored(f"Exceptions from execution: {exceptions}", 'red'))
+    exec_metadata = {
+        "res_A": results['source'],
+        "platform_A": "source",
+        "res_B": results['followup'],
+        "platform_B": "follow_up",
+        "exceptions": exceptions,
+        "time_exec": time_exec,
+        "exact_distribution": {
+            "exact": exact_results is not None, "exact_error": exact_error}
+    }
+    return exec_metadata
+
+
+def get_exact_results(circuits: Dict[str, Any]):
+    """Compute the exact distributions of all the circuits (by name).
+
+    A failure of the exact simulation is ours, not of the programs: it
+    returns None and the error, thus the programs are sampled instead.
+    """
+    try:
+        return {name: get_exact_probabilities(circuit)
+                for name, circuit in circuits.items()}, None
+    except Exception as e:
+        print(colored(f"Exact simulation failed, sampling: {e}", 'yellow'))
+        return None, str(e)
+
+
+# exact distributions of the source programs run by this process
+REFERENCE_CACHE = ProgramResultCache()
+
+
+def get_reference_distribution(
+        metadata_source: Dict[str, Any], max_qubits: int = 20):
+    """Get the exact distribution of the source program (cached).
+
+    It returns the distribution (None if the source cannot be simulated
+    exactly), whether it comes from the cache, and the source program
+    prepared for sampling when it had to be prepared.
+    """
+    key = hash_program(open(metadata_source["py_file_path"], "r").read())
+    is_cached, distribution = REFERENCE_CACHE.lookup(key)
+    if is_cached:
+        return distribution, True, None
+    prepared = prepare_py_program_in_batches(metadata_source["py_file_path"])
+    circuit = get_executed_circuit(*prepared)
+    if (circuit is not None and
+            is_exactly_simulable(circuit, max_qubits=max_qubits)):
+        distribution = get_exact_probabilities(circuit)
+    REFERENCE_CACHE.put(key, distribution)
+    return distribution, False, prepared
+
+
+def execute_programs_with_reference(
+        metadata_source: Dict[str, Any],
+        metadata_followup: Dict[str, Any],
+        config: Dict[str, Any]):
+    """Sample only the follow-up, the source gives its exact distribution.
+
+    The distribution of the source is cached by its code, thus all its
+    follow-ups reuse it. If the source cannot be simulated exactly, or a
+    detector has no one-sample counterpart, the source is sampled too.
+    """
+    max_qubits = config["exact_reference"].get("max_qubits", 20)
+    exceptions = {'source': None, 'followup': None}
+    start_exec = timer()
+    reference, cache_hit, prepared_a = None, False, None
+    try:
+        reference, cache_hit, prepared_a = get_reference_distribution(
+            metadata_source, max_qubits=max_qubits)
+    except Exception as e:
+        exceptions['source'] = str(e)
+    use_reference = reference is not None and all(
+        get_reference_detector(detector_config) is not None
+        for detector_config in config["detectors"])
+    try:
+        if use_reference:
+            res_a = reference
+        elif prepared_a is not None:
+            res_a = execute_py_program_batch(
+                *prepared_a, shots=metadata_source["shots"])
+        else:
+            res_a = execute_program(metadata_source)
+    except Exception as e:
+        exceptions['source'] = str(e)
+        res_a = {"0": 1}
+    try:
+        res_b = execute_program(metadata_followup)
+    except Exception as e:
+        exceptions['followup'] = str(e)
+        res_b = {"0": 1}
+    end_exec = timer()
+    time_exec = end_exec - start_exec
+    if exceptions['followup'] is not None or exceptions['source'] is not None:
+        print(colored(f"Exceptions from execution: {exceptions}", 'red'))
+    exec_metadata = {
+        "res_A": res_a,
+        "platform_A": "source",
+        "res_B": res_b,
+        "platform_B": "follow_up",
+        "exceptions": exceptions,
+        "time_exec": time_exec,
+        "exact_reference": {
+            "used": use_reference,
+            "cache_hit": cache_hit,
+            "cache_hits": REFERENCE_CACHE.hits,
+            "cache_misses": REFERENCE_CACHE.misses,
+        }
+    }
+    return exec_metadata
+
+
+# decisions of the equivalence pre-filter (by the hashes of the two programs)
+PREFILTER_CACHE = ProgramResultCache()
+PREFILTER_STATS = {
+    "n_couples": 0, "n_skipped": 0, "n_executed": 0,
+    "time_prefilter": 0., "time_exec": 0., "time_reused": 0.}
+
+
+def decide_equivalence(
+        metadata_source: Dict[str, Any],
+        metadata_followup: Dict[str, Any],
+        transformation: MetamorphicTransformation,
+        max_qubits: int = 10,
+        tolerance: float = 1e-6):
+    """Decide if the two programs surely give the same output distribution.
+
+    Both programs are built (and transpiled) in this process, without
+    executing them, and they are left in PREPARED_PROGRAMS for the
+    execution of the couple (if it is not skipped). They are 'equivalent'
+    if their exact distributions match, with the follow-up read through
+    the declared qubit mapping of the transformation. They are 'undecided'
+    when they cannot be simulated exactly or when they do not run the same
+    EXECUTION section (e.g. ChangeBackend, whose point is to run on another
+    backend). Otherwise they are 'different'. It returns the decision, the
+    distributions and the time spent to prepare the programs (reused by
+    their execution).
+    """
+    start_prepare = timer()
+    try:
+        prepared = [
+            prepare_py_program_in_batches(metadata["py_file_path"])
+            for metadata in [metadata_source, metadata_followup]]
+    except Exception:
+        return "undecided", None, None, 0.
+    time_prepare = timer() - start_prepare
+    # if they get executed, they start from the programs prepared here
+    for metadata, prepared_program in zip(
+            [metadata_source, metadata_followup], prepared):
+        PREPARED_PROGRAMS[metadata["py_file_path"]] = prepared_program
+    circuits = [get_executed_circuit(*prepared_program)
+                for prepared_program in prepared]
+    if (prepared[0][1] != prepared[1][1] or any(
+            circuit is None or
+            not is_exactly_simulable(circuit, max_qubits=max_qubits)
+            for circuit in circuits)):
+        return "undecided", None, None, time_prepare
+    try:
+        res_a = get_exact_probabilities(circuits[0])
+        res_b = get_exact_probabilities(circuits[1])
+        distance = total_variation_distance(
+            res_a, transformation.read_followup_result(res_b))
+    except Exception as e:
+        # a failure of the exact simulation is ours: execute the couple
+        print(colored(f"Pre-filter undecided: {e}", 'yellow'))
+        return "undecided", None, None, time_prepare
+    decision = "equivalent" if distance <= tolerance else "different"
+    return decision, res_a, res_b, time_prepare
+
+
+def prefilter_equivalent_couple(
+        metadata_source: Dict[str, Any],
+        metadata_followup: Dict[str, Any],
+        transformation: MetamorphicTransformation,
+        config: Dict[str, Any]):
+    """Skip the execution of a couple that is provably equivalent.
+
+    It returns the metadata of the pre-filter, and the execution metadata
+    (with the exact distributions) if the execution is skipped, else None.
+    The decisions are cached by the code of the two programs.
+    """
+    prefilter_config = config["equivalence_prefilter"]
+    start_prefilter = timer()
+    key = "-".join([
+        hash_program(open(metadata["py_file_path"], "r").read())
+        for metadata in [metadata_source, metadata_followup]])
+    cache_hit, entry = PREFILTER_CACHE.lookup(key)
+    time_prepare = 0.
+    if not cache_hit:
+        *entry, time_prepare = decide_equivalence(
+            metadata_source, metadata_followup, transformation,
+            max_qubits=prefilter_config.get("max_qubits", 10),
+            tolerance=prefilter_config.get("tolerance", 1e-6))
+        PREFILTER_CACHE.put(key, entry)
+    decision, res_a, res_b = entry
+    time_prefilter = timer() - start_prefilter
+    PREFILTER_STATS["n_couples"] += 1
+    PREFILTER_STATS["time_prefilter"] += time_prefilter
+    is_skipped = decision == "equivalent"
+    PREFILTER_STATS["n_skipped"] += int(is_skipped)
+    prefilter_metadata = {
+        "decision": decision,
+        "skipped": is_skipped,
+        "cache_hit": cache_hit,
+        "time": time_prefilter,
+        "time_prepare": time_prepare,
+    }
+    if not is_skipped:
+        return prefilter_metadata, None
+    exec_metadata = {
+        "res_A": res_a,
+        "platform_A": "source",
+        "res_B": res_b,
+        "platform_B": "follow_up",
+        "exceptions": {'source': None, 'followup': None},
+        "time_exec": time_prefilter,
+        "exact_distribution": {"exact": True}
+    }
+    return prefilter_metadata, exec_metadata
+
+
+def summarize_prefilter(prefilter_metadata: Dict[str, Any]):
+    """Add the skip rate and time saved so far (in this process).
+
+    An executed couple reuses the programs prepared by the pre-filter,
+    thus without the pre-filter it would have cost its execution time
+    plus their preparation time (time_reused). The time saved is the
+    average of that cost for each skipped couple, plus the preparations
+    reused, minus the time spent in the pre-filter.
+    """
+    stats = PREFILTER_STATS
+    avg_time_full_exec = (stats["time_exec"] + stats["time_reused"]) / \
+        max(1, stats["n_executed"])
+    return {
+        **prefilter_metadata,
+        "skip_rate": stats["n_skipped"] / stats["n_couples"],
+        "estimated_time_saved":
+            stats["n_skipped"] * avg_time_full_exec +
+            stats["time_reused"] - stats["time_prefilter"],
+    }
+
+
+def setup_transpile_cache(config: Dict[str, Any]):
+    """Install the transpile cache of the config in this process.
+
+    It returns the cache (None if the config does not use it). The QPY
+    store defaults to the transpile_cache folder of the experiment.
+    """
+    cache_config = config.get("transpile_cache")
+    if cache_config is None:
+        return None
+    return install_transpile_cache(
+        max_size=cache_config.get("max_size", 256),
+        folder=cache_config.get("folder") or join(
+            config["experiment_folder"], "transpile_cache"))
+
+
+def setup_section_snapshots(config: Dict[str, Any]):
+    """Install the section snapshots of the config in this process.
+
+    It returns the snapshots (None if the config does not use them).
+    """
+    snapshots_config = config.get("section_snapshots")
+    if snapshots_config is None:
+        return None
+    return install_section_snapshots(
+        max_size=snapshots_config.get("max_size", 32))
+
+
+# the alternative ways to execute a couple (at most one in a config)
+EXECUTION_MODES = [
+    "exact_distribution", "exact_reference", "adaptive_shots",
+    "batched_execution"]
+
+
+def check_execution_mode_config(config: Dict[str, Any]):
+    """Check that the config sets at most one of the EXECUTION_MODES."""
+    modes = [key for key in EXECUTION_MODES if config.get(key) is not None]
+    if len(modes) > 1:
+        raise ValueError(
+            "A couple is executed in a single mode, but the config sets " +
+            f"{', '.join(modes)}: set to null all of them but one.")
+
+
+def execute_couple_in_mode(
+        metadata_source: Dict[str, Any],
+        metadata_followup: Dict[str, Any],
+        transformation: MetamorphicTransformation,
+        config: Dict[str, Any]):
+    """Execute the couple in the execution mode of the config.
+
+    See check_execution_mode_config: at most one mode is set.
+    """
+    if config.get("exact_distribution") is not None:
+        return execute_programs_exactly(
+            metadata_source=metadata_source,
+            metadata_followup=metadata_followup,
+            config=config)
+    elif config.get("exact_reference") is not None:
+        return execute_programs_with_reference(
+            metadata_source=metadata_source,
+            metadata_followup=metadata_followup,
+            config=config)
+    elif config.get("adaptive_shots") is not None:
+        return execute_programs_adaptively(
+            metadata_source=metadata_source,
+            metadata_followup=metadata_followup,
+            transformation=transformation,
+            config=config)
+    elif config.get("batched_execution") is not None:
+        return execute_programs_batched(
+            metadata_source=metadata_source,
+            metadata_followup=metadata_followup,
+            config=config)
+    return execute_programs(
+        metadata_source=metadata_source,
+        metadata_followup=metadata_followup)
+
+
+def execute_couple(
+        metadata_source: Dict[str, Any],
+        metadata_followup: Dict[str, Any],
+        transformation: MetamorphicTransformation,
+        config: Dict[str, Any]):
+    """Execute the couple, unless the equivalence pre-filter skips it.
+
+    The pre-filter (if enabled) runs first, and the couples it cannot skip
+    run in the configured mode. The programs use the transpile cache of
+    the config (if any), and its section snapshots (if any).
+    """
+    transpile_cache = setup_transpile_cache(config)
+    snapshots = setup_section_snapshots(config)
+    prefilter_metadata, exec_metadata = None, None
+    if config.get("equivalence_prefilter") is not None:
+        prefilter_metadata, exec_metadata = prefilter_equivalent_couple(
+            metadata_source, metadata_followup, transformation, config)
+    if exec_metadata is None:
+        exec_metadata = execute_couple_in_mode(
+            metadata_source, metadata_followup, transformation, config)
+        if prefilter_metadata is not None:
+            PREFILTER_STATS["n_executed"] += 1
+            PREFILTER_STATS["time_exec"] += exec_metadata["time_exec"]
+            PREFILTER_STATS["time_reused"] += \
+                prefilter_metadata["time_prepare"]
+    # the programs prepared for a skipped couple are not needed
+    PREPARED_PROGRAMS.clear()
+    if prefilter_metadata is not None:
+        exec_metadata["equivalence_prefilter"] = \
+            summarize_prefilter(prefilter_metadata)
+    if transpile_cache is not None:
+        exec_metadata["transpile_cache"] = transpile_cache.get_hit_rates()
+    if snapshots is not None:
+        exec_metadata["section_snapshots"] = snapshots.get_hit_rates()
+    return exec_metadata
+
+
+def check_output_relationship(
+        transformation: MetamorphicTransformation,
+        exec_metadata: Dict[str, Any],
+        config: Dict[str, Any]):
+    """Check the output relationship.
+
+    Exact results are compared by their distance, a sample against an
+    exact reference with the one-sample detectors. The samples stopped
+    early by the adaptive shots get the p-values of their decision (see
+    apply_sequential_decision).
+    """
+    if exec_metadata.get("exact_reference", {}).get("used", False):
+        return detect_divergence_with_reference(
+            {"res_A": exec_metadata["res_A"],
+             "res_B": transformation.read_followup_result(
+                 exec_metadata["res_B"])},
+            detectors=config["detectors"])
+    adaptive_decision = exec_metadata.get("adaptive_shots", {}).get("decision")
+    if adaptive_decision in ["divergent", "equivalent"]:
+        return apply_sequential_decision(
+            transformation.check_output_relationship(
+                result_a=exec_metadata["res_A"],
+                result_b=exec_metadata["res_B"]),
+            decision=adaptive_decision)
+    if not exec_metadata.get("exact_distribution", {}).get("exact", False):
+        return transformation.check_output_relationship(
+            result_a=exec_metadata["res_A"],
+            result_b=exec_metadata["res_B"])
+    exact_config = config.get("exact_distribution") or {}
+    return detect_divergence_exactly(
+        {"res_A": exec_metadata["res_A"],
+         "res_B": transformation.read_followup_result(exec_metadata["res_B"])},
+        detectors=config["detectors"],
+        distance=exact_config.get("distance", "total_variation"),
+        tolerance=exact_config.get("tolerance", 1e-6))
+
+
+def execute_programs_adaptively(
+        metadata_source: Dict[str, Any],
+        metadata_followup: Dict[str, Any],
+        transformation: MetamorphicTransformation,
+        config: Dict[str, Any]):
+    """Execute programs in batches of shots until the decision is settled.
+
+    After each batch of both programs a group-sequential KS test (see
+    GroupSequentialKSTest) looks at the counts so far, and it stops the
+    execution once the two outputs are surely divergent or equivalent, or
+    when the programs get all their shots. If the follow-up outputs one
+    count per circuit (e.g. RunIndependentPartitions) the test does not
+    apply, thus the rest of the shots run in a single batch.
+    """
+    adaptive_config = config["adaptive_shots"]
+    max_shots = metadata_source["shots"]
+    sequential_test = GroupSequentialKSTest(
+        max_shots=max_shots,
+        alpha=adaptive_config.get("alpha", 0.05),
+        beta=adaptive_config.get("beta", 0.05),
+        threshold=adaptive_config.get(
+            "threshold", config.get("qdiff_user_defined_threshold", 0.1)),
+        spending_exponent=adaptive_config.get("spending_exponent", 1.))
+    batch_shots = adaptive_config.get("batch_shots", 256)
+    exceptions = {'source': None, 'followup': None}
+    res_a, res_b, shots_done = None, None, 0
+    start_exec = timer()
+    try:
+        prepared_a = prepare_py_program_in_batches(
+            metadata_source["py_file_path"])
+    except Exception as e:
+        exceptions['source'] = str(e)
+    try:
+        prepared_b = prepare_py_program_in_batches(
+            metadata_followup["py_file_path"])
+    except Exception as e:
+        exceptions['followup'] = str(e)
+    while (sequential_test.decision == "continue" and
+            shots_done < max_shots and
+            exceptions['source'] is None and exceptions['followup'] is None):
+        shots = min(batch_shots, max_shots - shots_done)
+        try:
+            res_a = merge_results(
+                res_a, execute_py_program_batch(*prepared_a, shots))
+        except Exception as e:
+            exceptions['source'] = str(e)
+        try:
+            res_b = merge_results(
+                res_b, execute_py_program_batch(*prepared_b, shots))
+        except Exception as e:
+            exceptions['followup'] = str(e)
+        shots_done += shots
+        if isinstance(res_a, dict) and isinstance(res_b, dict):
+            sequential_test.update(AlignedCounts(
+                res_a, transformation.read_followup_result(
+                    res_b, n_shots=sum(res_a.values()))))
+        else:
+            batch_shots = max_shots
+    if exceptions['source'] is not None or res_a is None:
+        res_a = {"0": 1}
+    if exceptions['followup'] is not None or res_b is None:
+        res_b = {"0": 1}
+    end_exec = timer()
+    time_exec = end_exec - start_exec
+    if exceptions['followup'] is not None or exceptions['source'] is not None:
+        print(colored(f"Exceptions from execution: {exceptions}", 'red'))
+    print(f"Adaptive shots: {shots_done}/{max_shots} " +
+          f"({sequential_test.decision}, {sequential_test.n_looks} looks)")
+    exec_metadata = {
+        "res_A": res_a,
+        "platform_A": "source",
+        "res_B": res_b,
+        "platform_B": "follow_up",
+        "exceptions": exceptions,
+        "time_exec": time_exec,
+        "adaptive_shots": {
+            "shots": shots_done,
+            "max_shots": max_shots,
+            "n_looks": sequential_test.n_looks,
+            "decision": sequential_test.decision,
+        }
+    }
+    return exec_metadata
+
+
 def create_follow(metadata: Dict[str, Any], config: Dict[str, Any]):
     """Change the backend of the passed pyfile."""
     start_metamorph = timer()
     filepath = metadata["py_file_path"]
     file_content = open(filepath, "r").read()
 
-    max_n_transf = config["pipeline"]["max_transformations_per_program"]
-
-    if config["transformation_mode"] == "morphq":
-        transf_available = config["morphq_metamorphic_strategies"]
-    elif config["transformation_mode"] == "qdiff":
-        transf_available = config["qdiff_metamorphic_strategies"]
-        # reduce the number of transformations to apply of one, to apply a
-        # differential testing transformation at the end of the chain
-        # aka a change of backend or optimization level
-        max_n_transf = max(1, max_n_transf - 1)
+    transf_available, max_n_transf = get_available_transformations(config)
     n_transf_to_apply = \
         random.randint(1, max_n_transf)
 
@@ -215,38 +1206,37 @@ def create_follow(metadata: Dict[str, Any], config: Dict[str, Any]):
         detectors_config=config["detectors"],
         seed=None
     )
-    metamorphed_file_content = file_content
-    safe_counter = 0
+    # the program is parsed once and passed along the chain
+    metamorphed_program = CircuitProgram.of(file_content)
     name_of_transformations_applied = []
     time_of_transformations_applied = []
     while transformation.transf_applied_count < n_transf_to_apply:
-        transformation.select_random_transformation()
         start_transformation = timer()
-        safe_counter += 1
-        if safe_counter > 100:
+        # sample only among the transformations whose precondition holds
+        if not transformation.select_applicable_transformation(
+                metamorphed_program):
             if len(name_of_transformations_applied) == 0:
                 raise Exception("Could not apply any transformation. " +
                                 "Source = Follow.")
             else:
                 print("No more available transformations. Stop metamorph.")
                 break
-        if transformation.check_precondition(metamorphed_file_content):
-            metamorphed_file_content = \
-                transformation.derive(metamorphed_file_content)
-            end_transformation = timer()
-            time_transformation = end_transformation - start_transformation
-            time_of_transformations_applied.append(time_transformation)
-            name_of_transformations_applied.append(
-                transformation.get_name_current_transf()
-            )
-            # remember that by construction the transformations of qdiff
-            # are semantically preserving, thus the last transformation to
-            # check is always equivalence
-            if not transformation.is_semantically_equivalent():
-                print(transformation.get_name_current_transf() +
-                      " is not semantically equivalent. " +
-                      "Thus we stop chain of transformations.")
-                break
+        metamorphed_program = \
+            transformation.derive(metamorphed_program)
+        end_transformation = timer()
+        time_transformation = end_transformation - start_transformation
+        time_of_transformations_applied.append(time_transformation)
+        name_of_transformations_applied.append(
+            transformation.get_name_current_transf()
+        )
+        # remember that by construction the transformations of qdiff
+        # are semantically preserving, thus the last transformation to
+        # check is always equivalence
+        if not transformation.is_semantically_equivalent():
+            print(transformation.get_name_current_transf() +
+                  " is not semantically equivalent. " +
+                  "Thus we stop chain of transformations.")
+            break
     print("N. applied transformations: ", transformation.transf_applied_count)
 
     # append the change of backend or optimization level
@@ -258,12 +1248,12 @@ def create_follow(metadata: Dict[str, Any], config: Dict[str, Any]):
             detectors_config=config["detectors"],
             seed=None
         )
-        transformation.select_random_transformation()
-        if transformation.check_precondition(metamorphed_file_content):
+        if transformation.select_applicable_transformation(
+                metamorphed_program):
             print("Applying last transformation that serve as " +
                   "the differential testing setup.")
-            metamorphed_file_content = \
-                transformation.derive(metamorphed_file_content)
+            metamorphed_program = \
+                transformation.derive(metamorphed_program)
             name_of_transformations_applied.append(
                 transformation.get_name_current_transf()
             )
@@ -273,45 +1263,179 @@ def create_follow(metadata: Dict[str, Any], config: Dict[str, Any]):
     mr_metadata = transformation.metadata
     transformation = transformation.get_last_applied_transformation()
 
-    experiment_folder = config["experiment_folder"]
-    program_id = metadata["program_id"]
-    new_filepath = join(
-        experiment_folder, "programs", "followup", f"{program_id}.py")
-    with open(new_filepath, "w") as f:
-        f.write(metamorphed_file_content)
+    new_metadata = get_followup_metadata(
+        metadata, config, mr_metadata=mr_metadata,
+        names=name_of_transformations_applied,
+        times=time_of_transformations_applied)
+    with open(new_metadata["py_file_path"], "w") as f:
+        f.write(metamorphed_program.to_source())
 
     end_metamorph = timer()
-    time_metamorph = end_metamorph - start_metamorph
+    new_metadata["time_metamorph"] = end_metamorph - start_metamorph
+    return new_metadata, transformation
+
+
+def get_available_transformations(config: Dict[str, Any]):
+    """Get the config of the transformations to chain and their max number."""
+    max_n_transf = config["pipeline"]["max_transformations_per_program"]
 
+    if config["transformation_mode"] == "morphq":
+        transf_available = config["morphq_metamorphic_strategies"]
+    elif config["transformation_mode"] == "qdiff":
+        transf_available = config["qdiff_metamorphic_strategies"]
+        # reduce the number of transformations to apply of one, to apply a
+        # differential testing transformation at the end of the chain
+        # aka a change of backend or optimization level
+        max_n_transf = max(1, max_n_transf - 1)
+    return transf_available, max_n_transf
+
+
+def get_followup_metadata(
+        metadata: Dict[str, Any], config: Dict[str, Any],
+        mr_metadata: Dict[str, Any], names: List[str], times: List[float]):
+    """Describe the follow-up of the program with the given metadata."""
+    experiment_folder = config["experiment_folder"]
+    program_id = metadata["program_id"]
     new_metadata = {**metadata, }
-    new_metadata["py_file_path"] = new_filepath
+    new_metadata["py_file_path"] = join(
+        experiment_folder, "programs", "followup", f"{program_id}.py")
     new_metadata["metamorphic_info"] = mr_metadata
-    new_metadata["metamorphic_transformations"] = \
-        name_of_transformations_applied
-    new_metadata["time_metamorph"] = time_metamorph
-    new_metadata["metamorphic_transformations_times"] = \
-        time_of_transformations_applied
-    return new_metadata, transformation
+    new_metadata["metamorphic_transformations"] = names
+    # set by the caller, once the follow-up is ready
+    new_metadata["time_metamorph"] = None
+    new_metadata["metamorphic_transformations_times"] = times
+    return new_metadata
+
+
+def create_follow_object(
+        metadata: Dict[str, Any], program: ObjectProgram,
+        config: Dict[str, Any]):
+    """Derive the follow-up of the program object (see create_follow).
+
+    Only the transformations with an object mode are chained. It returns
+    None if none of them applies (then the couple goes via source code).
+    """
+    start_metamorph = timer()
+    transf_available, max_n_transf = get_available_transformations(config)
+    n_transf_to_apply = random.randint(1, max_n_transf)
+
+    transformation = ChainedTransformation(
+        name="Chain",
+        metamorphic_strategies_config=transf_available,
+        detectors_config=config["detectors"],
+        seed=None
+    )
+    followup = program
+    name_of_transformations_applied = []
+    time_of_transformations_applied = []
+    while transformation.transf_applied_count < n_transf_to_apply:
+        start_transformation = timer()
+        if not transformation.select_applicable_object_transformation(
+                followup):
+            break
+        followup = transformation.derive_object(followup)
+        time_of_transformations_applied.append(
+            timer() - start_transformation)
+        name_of_transformations_applied.append(
+            transformation.get_name_current_transf())
+        if not transformation.is_semantically_equivalent():
+            break
+    if len(name_of_transformations_applied) == 0:
+        return None
+
+    # append the change of backend or optimization level
+    if config["transformation_mode"] == "qdiff":
+        transformation = ChainedTransformation(
+            name="Chain",
+            metamorphic_strategies_config=config["qdiff_diff_testing"],
+            detectors_config=config["detectors"],
+            seed=None
+        )
+        if transformation.select_applicable_object_transformation(followup):
+            followup = transformation.derive_object(followup)
+            name_of_transformations_applied.append(
+                transformation.get_name_current_transf())
+        else:
+            print("Warning: could not apply diff testing transformation.")
+
+    mr_metadata = transformation.metadata
+    transformation = transformation.get_last_applied_transformation()
+    new_metadata = get_followup_metadata(
+        metadata, config, mr_metadata=mr_metadata,
+        names=name_of_transformations_applied,
+        times=time_of_transformations_applied)
+    new_metadata["time_metamorph"] = timer() - start_metamorph
+    return new_metadata, transformation, followup
+
+
+def is_object_mode(config: Dict[str, Any], generator: Fuzzer) -> bool:
+    """Check if the couples are generated and run as objects."""
+    return (config.get("object_mode") is not None and
+            getattr(generator, "supports_object_mode", False))
 
 
-def produce_and_test_single_program_couple(config, generator):
-    """Fuzz a program and morph it, run both."""
+def is_couple_to_keep(
+        exec_metadata: Dict[str, Any], div_metadata: Dict[str, Any],
+        config: Dict[str, Any]) -> bool:
+    """Check if the couple crashed or diverged (uncorrected alpha level).
+
+    The level is not corrected for multiple tests, thus all the couples
+    that the divergence scan can flag are kept.
+    """
+    crashed = any(
+        e is not None for e in exec_metadata["exceptions"].values())
+    alpha_level = config["divergence_alpha_level"]
+    diverged = any(
+        result["p-value"] < alpha_level for result in div_metadata.values())
+    return crashed or diverged
+
+
+def produce_and_test_single_program_couple(config, generator, seed=None):
+    """Fuzz a program and morph it, run both.
+
+    It returns the table name and the record to store in qfl.db (None if
+    the follow-up could not be created).
+    """
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+    # the executor process survives the couple: stop tracking in any case
+    coverage_obj = start_coverage_tracking(config)
+    try:
+        return fuzz_and_run_couple(config, generator)
+    finally:
+        stop_coverage_tracking(coverage_obj)
+
+
+def fuzz_and_run_couple(config, generator):
+    """Fuzz a program and morph it, run both (see above)."""
     experiment_folder = config["experiment_folder"]
-    if config["track_coverage"]:
-        coverage_obj = Coverage(
-            data_suffix=False,
-            config_file=config["coverage_settings_filepath"])
-        coverage_obj.load()
-        coverage_obj.start()
-        coverage.process_startup()
-    program_id, metadata_source = fuzz_source_program(
-        generator,
-        experiment_folder=experiment_folder,
-        config_generation=config["generation_strategy"],
-        config=config)
+    objects = None
+    if is_object_mode(config, generator):
+        program_id, metadata_source, source_object = fuzz_source_object(
+            generator,
+            experiment_folder=experiment_folder,
+            config_generation=config["generation_strategy"],
+            config=config)
+    else:
+        program_id, metadata_source = fuzz_source_program(
+            generator,
+            experiment_folder=experiment_folder,
+            config_generation=config["generation_strategy"],
+            config=config)
+        source_object = None
     try:
-        metadata_followup, transformation = create_follow(
-            metadata_source, config)
+        if source_object is not None:
+            objects = create_follow_object(
+                metadata_source, source_object, config)
+            if objects is None:
+                # no transformation with an object mode: go via source
+                emit_program_source(metadata_source, source_object)
+        if objects is None:
+            metadata_followup, transformation = create_follow(
+                metadata_source, config)
+        else:
+            metadata_followup, transformation, followup_object = objects
     except Exception as e:
         print(f"Program id: {program_id}")
         print(colored(f"Could not create followup. Exception: {e}", 'red'))
@@ -321,20 +1445,167 @@ def produce_and_test_single_program_couple(config, generator):
     abs_start_time = time.time()
     current_date = datetime.today().strftime('%Y-%m-%d-%H:%M:%S')
     print(f"Executing: {program_id} ({current_date})")
-    exec_metadata = execute_programs(
-        metadata_source=metadata_source,
-        metadata_followup=metadata_followup)
+    if objects is None:
+        exec_metadata = execute_couple(
+            metadata_source=metadata_source,
+            metadata_followup=metadata_followup,
+            transformation=transformation,
+            config=config)
+    else:
+        exec_metadata = execute_program_objects(
+            source_object, followup_object, config)
     # not that if the transformation is a chain of transformations,
     # then we only check the output relationship of the last transformation
-    div_metadata = transformation.check_output_relationship(
-        result_a=exec_metadata["res_A"],
-        result_b=exec_metadata["res_B"])
+    div_metadata = check_output_relationship(
+        transformation, exec_metadata, config)
+    if objects is not None:
+        # the sources are written only for the couples we keep
+        to_keep = is_couple_to_keep(exec_metadata, div_metadata, config)
+        if to_keep:
+            emit_program_source(metadata_source, source_object)
+            emit_program_source(metadata_followup, followup_object)
+        exec_metadata["object_mode"] = {"source_emitted": to_keep}
+    # the record goes to the database writer (and its divergence scan)
+    return record_couple(
+        config, program_id, metadata_source, metadata_followup,
+        exec_metadata, div_metadata, abs_start_time)
+
+
+def produce_and_test_program_fanout(config, generator, seed=None):
+    """Fuzz a program, derive K follow-ups from it and run them.
+
+    The K follow-ups come from K independent chains of transformations
+    and the source is executed once for all of them (in the same Aer jobs
+    as the follow-ups if the execution is batched). It returns the table
+    name and record of each couple, which have their own program_id and
+    share the source_id.
+    """
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+    coverage_obj = start_coverage_tracking(config)
+    try:
+        return fuzz_and_run_fanout(config, generator)
+    finally:
+        stop_coverage_tracking(coverage_obj)
+
+
+def fuzz_and_run_fanout(config, generator):
+    """Fuzz a program, derive K follow-ups and run them (see above)."""
+    experiment_folder = config["experiment_folder"]
+    source_id, metadata_source = fuzz_source_program(
+        generator,
+        experiment_folder=experiment_folder,
+        config_generation=config["generation_strategy"],
+        config=config)
+    couples = []
+    for i_followup in range(config["followups_per_source"]):
+        metadata_couple_source = {
+            **metadata_source,
+            "program_id": uuid.uuid4().hex, "source_id": source_id}
+        try:
+            couples.append((metadata_couple_source, *create_follow(
+                metadata_couple_source, config)))
+        except Exception as e:
+            print(f"Program id: {metadata_couple_source['program_id']}")
+            print(colored(
+                f"Could not create followup. Exception: {e}", 'red'))
+            if "Source = Follow" not in str(e):
+                traceback.print_exc()
+    if len(couples) == 0:
+        return []
+    abs_start_time = time.time()
+    current_date = datetime.today().strftime('%Y-%m-%d-%H:%M:%S')
+    print(f"Executing: {source_id} and {len(couples)} follow-ups " +
+          f"({current_date})")
+    all_exec_metadata = execute_fanout(
+        metadata_source,
+        [metadata_followup for _, metadata_followup, _ in couples],
+        config)
+    records = []
+    for (metadata_couple_source, metadata_followup, transformation), \
+            exec_metadata in zip(couples, all_exec_metadata):
+        div_metadata = check_output_relationship(
+            transformation, exec_metadata, config)
+        records.append(record_couple(
+            config, metadata_couple_source["program_id"],
+            metadata_couple_source, metadata_followup,
+            exec_metadata, div_metadata, abs_start_time))
+    return records
+
+
+def execute_fanout(
+        metadata_source: Dict[str, Any],
+        metadata_followups: List[Dict[str, Any]],
+        config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Execute the source once and its follow-ups.
+
+    With batched execution the programs go in shared Aer jobs (see
+    execute_programs_in_jobs), otherwise they run one after the other.
+    It returns the execution metadata of each couple, where the execution
+    time is the total one shared among the couples. The programs use the
+    transpile cache and the section snapshots of the config (if any).
+    """
+    all_metadata = {
+        "source": metadata_source,
+        **{f"followup_{i}": metadata
+           for i, metadata in enumerate(metadata_followups)}}
+    transpile_cache = setup_transpile_cache(config)
+    snapshots = setup_section_snapshots(config)
+    start_exec = timer()
+    if config.get("batched_execution") is not None:
+        results, exceptions, _ = execute_programs_in_jobs(
+            all_metadata,
+            run_options=config["batched_execution"].get("run_options"))
+    else:
+        results, exceptions = {}, {}
+        for name, metadata in all_metadata.items():
+            exceptions[name] = None
+            try:
+                results[name] = execute_single_py_program(
+                    metadata["py_file_path"])
+            except Exception as e:
+                exceptions[name] = str(e)
+                results[name] = {"0": 1}
+    time_exec = timer() - start_exec
+    if any(e is not None for e in exceptions.values()):
+        print(colored(f"Exceptions from execution: {exceptions}", 'red'))
+    return [{
+        "res_A": results["source"],
+        "platform_A": "source",
+        "res_B": results[f"followup_{i}"],
+        "platform_B": "follow_up",
+        "exceptions": {
+            "source": exceptions["source"],
+            "followup": exceptions[f"followup_{i}"]},
+        "time_exec": time_exec / len(metadata_followups),
+        "fanout": {
+            "source_id": metadata_source["program_id"],
+            "n_followups": len(metadata_followups),
+            "time_exec_total": time_exec,
+        },
+        **({} if transpile_cache is None else {
+            "transpile_cache": transpile_cache.get_hit_rates()}),
+        **({} if snapshots is None else {
+            "section_snapshots": snapshots.get_hit_rates()}),
+    } for i in range(len(metadata_followups))]
+
+
+def record_couple(
+        config: Dict[str, Any], program_id: str,
+        metadata_source: Dict[str, Any], metadata_followup: Dict[str, Any],
+        exec_metadata: Dict[str, Any], div_metadata: Dict[str, Any],
+        abs_start_time: float):
+    """Dump the metadata of the couple and return its table and record."""
+    experiment_folder = config["experiment_folder"]
     all_metadata = dump_all_metadata(
         out_folder=join(experiment_folder, "programs", "metadata"),
         program_id=program_id,
         source=metadata_source, followup=metadata_followup,
         divergence=div_metadata,
         time_exec=exec_metadata["time_exec"],
+        **{key: exec_metadata[key] for key in OPTIONAL_EXEC_METADATA
+           if key in exec_metadata},
         abs_start_time=int(abs_start_time),
         exceptions=exec_metadata["exceptions"])
     dump_metadata(
@@ -342,33 +1613,211 @@ def produce_and_test_single_program_couple(config, generator):
         metadata_filepath=join(
             experiment_folder, "programs",
             "metadata_exec", f"{program_id}.json"))
-    con = get_database_connection(config, "qfl.db")
     # remove metamorphic info because they are not uniform to the
     # table schema for all the relationships
     if "metamorphic_info" in all_metadata["followup"].keys():
         del all_metadata["followup"]["metamorphic_info"]
     if ((exec_metadata["exceptions"]["source"] is not None) or
             (exec_metadata["exceptions"]["followup"] is not None)):
-        update_database(con, table_name="CRASHDATA", record=all_metadata)
-    else:
-        update_database(con, table_name="QFLDATA", record=all_metadata)
-        scan_for_divergence(
-            config,
-            method=config["divergence_threshold_method"],
-            test_name=config["divergence_primary_test"],
-            alpha_level=config["divergence_alpha_level"])
-    if config["track_coverage"]:
-        coverage_obj.stop()
+        return "CRASHDATA", all_metadata
+    return "QFLDATA", all_metadata
+
+
+def start_coverage_tracking(config: Dict[str, Any]):
+    """Start tracking the coverage (if enabled) and return its object."""
+    if not config["track_coverage"]:
+        return None
+    coverage_obj = Coverage(**get_coverage_settings(config))
+    coverage_obj.load()
+    coverage_obj.start()
+    coverage.process_startup()
+    return coverage_obj
+
+
+def stop_coverage_tracking(coverage_obj: Coverage):
+    """Stop tracking the coverage and save it (shared with the others)."""
+    if coverage_obj is None:
+        return
+    coverage_obj.stop()
+    with shared_resource("coverage"):
         coverage_obj.save()
 
 
 # LEVEL 2:
 
 
+def save_coverage_checkpoint(config, cov, counter_programs):
+    """Combine the coverage data files and dump a json report."""
+    filename = str(counter_programs).zfill(10) + ".json"
+    print("Saving coverage...")
+    elements = os.listdir(config["experiment_folder"])
+    files_to_combine = [
+        join(config["experiment_folder"], f)
+        for f in elements
+        if (os.path.isfile(join(config["experiment_folder"], f))
+            and ".coverage" in f)
+    ]
+    with shared_resource("coverage"):
+        cov.combine(files_to_combine)
+    cov.load()
+    coverage = cov.json_report(outfile=join(
+        config["experiment_folder"], "coverage_reports", filename))
+    print(f"Coverage saved! ({coverage:.2f}%) " +
+          f"[programs: {counter_programs}]")
+
+
+def increase_checkpoint_interval(between_saves, between_saves_cap):
+    """Double the interval between two coverage checkpoints (up to a cap)."""
+    # we have a variable size of the checkpoint interval at the
+    # start to have fine grade info about the coverage
+    # increase the time to the next coverage checkpoint
+    if between_saves < between_saves_cap:
+        between_saves = between_saves * 2
+    # if you reach the maximum stop the interval growth
+    if between_saves >= between_saves_cap:
+        between_saves = between_saves_cap
+    return between_saves
+
+
+# the execution modes of a single couple, not supported by the fan-out
+NOT_IN_FANOUT = [
+    "exact_distribution", "exact_reference", "adaptive_shots",
+    "equivalence_prefilter", "object_mode"]
+
+
+def check_fanout_config(config: Dict[str, Any]):
+    """Check that followups_per_source is not combined with NOT_IN_FANOUT."""
+    if config.get("followups_per_source") is None:
+        return
+    conflicts = [key for key in NOT_IN_FANOUT if config.get(key) is not None]
+    if len(conflicts) > 0:
+        raise ValueError(
+            "followups_per_source (fan-out) runs the programs with plain " +
+            "or batched execution only: set to null either it or " +
+            f"{', '.join(conflicts)}.")
+
+
+def run_program_couple(config, generator, executor, seed=None):
+    """Run a program couple, in the executor if there is a time budget.
+
+    With followups_per_source it runs a source and its follow-ups (within
+    the same time budget). It returns the table name and record for the
+    database of each couple (empty if none).
+    """
+    routine = produce_and_test_single_program_couple
+    if config.get("followups_per_source") is not None:
+        routine = produce_and_test_program_fanout
+    budget_time = config["budget_time_per_program_couple"]
+    if budget_time is None:
+        records = routine(config, generator, seed)
+    else:
+        records, _ = executor.run(
+            routine=routine,
+            seconds_to_wait=budget_time,
+            message="Change 'budget_time_per_program_couple'" +
+                    " in config yaml file.",
+            args=(config, generator, seed)
+        )
+    if records is None:
+        return []
+    if isinstance(records, tuple):
+        return [records]
+    return records
+
+
+def worker_loop(config, worker_id, seed_sequence, counter,
+                coverage_lock, db_queue):
+    """Fuzz program couples forever as one of the parallel workers.
+
+    Every couple gets its own seed drawn from the RNG stream of the worker,
+    so that the workers never generate the same programs.
+    """
+    init_worker_context(worker_id, coverage_lock)
+    generator = eval(config["generation_strategy"]["generator_object"])()
+    rng = np.random.default_rng(seed_sequence)
+    budget_time = config["budget_time_per_program_couple"]
+    executor = create_executor(config)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            with counter.get_lock():
+                counter.value += 1
+            seed = int(rng.integers(2**32))
+            current_date = datetime.today().strftime('%Y-%m-%d-%H:%M:%S')
+            print(f"--------- [worker {worker_id}] New programs pair... " +
+                  f"[timer: {budget_time} sec] ({current_date}) ----------")
+            for record in run_program_couple(
+                    config, generator, executor, seed):
+                db_queue.put(record)
+    finally:
+        executor.kill()
+
+
+def parallel_loop(config):
+    """Start the fuzzing loop on multiple workers.
+
+    The workers send their records to a single database writer, and share
+    the coverage data guarded by a lock. This process only keeps track of
+    the coverage checkpoints.
+    """
+    n_workers = config["workers"]
+    counter = multiprocessing.Value('i', 0)
+    # a file lock: a couple killed on timeout does not keep it held
+    coverage_lock = FileLock(
+        join(config["experiment_folder"], "coverage.lock"))
+    init_worker_context(None, coverage_lock)
+    writer_process, db_queue = start_database_writer(config)
+    seed_sequences = np.random.SeedSequence(
+        config["generation_strategy"]["random_seed"]).spawn(n_workers)
+    workers = [
+        multiprocessing.Process(
+            target=worker_loop, name=f"worker_{worker_id}",
+            args=(config, worker_id, seed_sequences[worker_id], counter,
+                  coverage_lock, db_queue))
+        for worker_id in range(n_workers)
+    ]
+    print(f"Starting {n_workers} workers...")
+    for worker in workers:
+        worker.start()
+    # stop the workers also when the global budget kills this process
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        if config["track_coverage"]:
+            cov = Coverage(
+                data_suffix=False,
+                config_file=config["coverage_settings_filepath"])
+            between_saves = \
+                config["programs_between_coverage_checkpoints_start"]
+            between_saves_cap = \
+                config["programs_between_coverage_checkpoints_cap"]
+            next_checkpoint = between_saves
+        while True:
+            time.sleep(1)
+            if config["track_coverage"] and counter.value >= next_checkpoint:
+                save_coverage_checkpoint(config, cov, next_checkpoint)
+                between_saves = increase_checkpoint_interval(
+                    between_saves, between_saves_cap)
+                next_checkpoint = \
+                    (next_checkpoint // between_saves + 1) * between_saves
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+        stop_database_writer(writer_process, db_queue)
+
+
 def loop(config):
     """Start fuzzing loop."""
+    check_execution_mode_config(config)
+    check_fanout_config(config)
+    if config.get("workers", 1) > 1:
+        return parallel_loop(config)
     generator = eval(config["generation_strategy"]["generator_object"])()
     budget_time = config["budget_time_per_program_couple"]
+    executor = create_executor(config)
+    writer_process, db_queue = start_database_writer(config)
+    # flush the database writer also when the global budget kills us
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     if config["track_coverage"]:
         data_file = join(config["experiment_folder"], "coverage.db")
         print("Data file: ", data_file)
@@ -378,48 +1827,28 @@ def loop(config):
         between_saves = config["programs_between_coverage_checkpoints_start"]
         between_saves_cap = config["programs_between_coverage_checkpoints_cap"]
     counter_programs = 0
-    # for i in range(3):
-    while True:
-        counter_programs += 1
-        if config["track_coverage"] and counter_programs % between_saves == 0:
-            filename = str(counter_programs).zfill(10) + ".json"
-            print("Saving coverage...")
-            elements = os.listdir(config["experiment_folder"])
-            files_to_combine = [
-                join(config["experiment_folder"], f)
-                for f in elements
-                if (os.path.isfile(join(config["experiment_folder"], f))
-                    and ".coverage" in f)
-            ]
-            cov.combine(files_to_combine)
-            cov.load()
-            coverage = cov.json_report(outfile=join(
-                config["experiment_folder"], "coverage_reports", filename))
-            print(f"Coverage saved! ({coverage:.2f}%) " +
-                  f"[programs: {counter_programs}]")
-            # we have a variable size of the checkpoint interval at the
-            # start to have fine grade info about the coverage
-            # increase the time to the next coverage checkpoint
-            if between_saves < between_saves_cap:
-                between_saves = between_saves * 2
-            # if you reach the maximum stop the interval growth
-            if between_saves >= between_saves_cap:
-                between_saves = between_saves_cap
-
-        if budget_time is not None:
-            current_date = datetime.today().strftime('%Y-%m-%d-%H:%M:%S')
-            print(f"--------- New programs pair... " +
-                  f"[timer: {budget_time} sec] ({current_date}) ----------")
-            break_function_with_timeout(
-                routine=produce_and_test_single_program_couple,
-                seconds_to_wait=budget_time,
-                message="Change 'budget_time_per_program_couple'" +
-                        " in config yaml file.",
-                args=(config, generator)
-            )
-        else:
-            print("New program couple.. [no timer]")
-            produce_and_test_single_program_couple(config, generator)
+    try:
+        # for i in range(3):
+        while True:
+            counter_programs += 1
+            if (config["track_coverage"] and
+                    counter_programs % between_saves == 0):
+                save_coverage_checkpoint(config, cov, counter_programs)
+                between_saves = increase_checkpoint_interval(
+                    between_saves, between_saves_cap)
+
+            if budget_time is not None:
+                current_date = datetime.today().strftime('%Y-%m-%d-%H:%M:%S')
+                print(f"--------- New programs pair... " +
+                      f"[timer: {budget_time} sec] ({current_date}) " +
+                      "----------")
+            else:
+                print("New program couple.. [no timer]")
+            for record in run_program_couple(config, generator, executor):
+                db_queue.put(record)
+    finally:
+        executor.kill()
+        stop_database_writer(writer_process, db_queue)
 
 
 # LEVEL 1:
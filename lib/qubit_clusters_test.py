@@ -0,0 +1,104 @@
+import re
+import sys
+from itertools import combinations
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from lib.metamorph import QubitClusters
+from lib.metamorph import cluster_qubits
+
+
+def connected_components(instructions, circuit_name, register_name):
+    """Clusters as connected components of the interaction graph."""
+    graph = nx.Graph()
+    for instruction in instructions:
+        if instruction["circuit_id"] != circuit_name:
+            continue
+        qubits = [
+            qubit for register, qubit in
+            zip(instruction["qregs"], instruction["qbits"])
+            if register == register_name]
+        graph.add_nodes_from(qubits)
+        graph.add_edges_from(combinations(qubits, 2))
+    return set([frozenset(g) for g in nx.connected_components(graph)])
+
+
+def random_instructions(rng, n_instructions, n_qubits):
+    """Random gates on 1-3 qubits of two circuits and two registers."""
+    instructions = []
+    for _ in range(n_instructions):
+        n_args = int(rng.integers(1, 4))
+        instructions.append({
+            "circuit_id": str(rng.choice(["qc", "qc_2"])),
+            "qregs": [str(r) for r in rng.choice(["qr", "qr_2"], n_args)],
+            "qbits": rng.choice(n_qubits, n_args, replace=False).tolist(),
+        })
+    return instructions
+
+
+@pytest.mark.parametrize("n_instructions", [0, 1, 5, 20, 100])
+def test_clusters_as_connected_components(n_instructions):
+    rng = np.random.default_rng(n_instructions)
+    for _ in range(10):
+        instructions = random_instructions(rng, n_instructions, n_qubits=10)
+        clusters = QubitClusters.of(
+            instructions, circuit_name="qc", register_name="qr")
+        expected = connected_components(instructions, "qc", "qr")
+        assert set(clusters.get_clusters()) == expected
+        assert clusters.n_clusters == len(expected)
+        assert sorted(clusters.get_cluster_sizes()) == sorted(
+            [len(c) for c in expected])
+
+
+def test_clusters_are_incremental():
+    rng = np.random.default_rng(0)
+    instructions = random_instructions(rng, 50, n_qubits=12)
+    clusters = QubitClusters("qc", "qr")
+    for i, instruction in enumerate(instructions):
+        clusters.add_instruction(instruction)
+        assert set(clusters.get_clusters()) == connected_components(
+            instructions[:i + 1], "qc", "qr")
+
+
+def test_clusters_ordered_by_smallest_qubit():
+    instructions = [
+        {"circuit_id": "qc", "qregs": ["qr", "qr"], "qbits": [5, 1]},
+        {"circuit_id": "qc", "qregs": ["qr", "qr"], "qbits": [3, 0]},
+        {"circuit_id": "qc", "qregs": ["qr"], "qbits": [2]},
+    ]
+    clusters = QubitClusters.of(instructions, "qc", "qr")
+    assert clusters.get_clusters() == [
+        frozenset([0, 3]), frozenset([1, 5]), frozenset([2])]
+    assert clusters.get_cluster_sizes() == [2, 2, 1]
+
+
+def cluster_qubits_via_regex(circuit_code, circuit_name, register_name):
+    """Cluster the qubits of the lines of the circuit (as before)."""
+    graph = nx.Graph()
+    for line in circuit_code.split("\n"):
+        if f"{circuit_name}." not in line:
+            continue
+        qubits = [int(q) for q in re.findall(
+            fr"{register_name}\[(\d+)\]", line)]
+        graph.add_nodes_from(qubits)
+        graph.add_edges_from(combinations(qubits, 2))
+    return set([frozenset(g) for g in nx.connected_components(graph)])
+
+
+@pytest.mark.skipif(
+    sys.version_info >= (3, 9),
+    reason="get_instructions reads the subscripts as ast.Index (Python 3.8)")
+def test_cluster_qubits_as_regex_clustering():
+    rng = np.random.default_rng(1)
+    for _ in range(10):
+        lines = []
+        for _ in range(15):
+            qubits = rng.choice(8, int(rng.integers(1, 3)), replace=False)
+            gate = "HGate" if len(qubits) == 1 else "CXGate"
+            qargs = ", ".join([f"qr[{q}]" for q in qubits])
+            lines.append(f"qc.append({gate}(), qargs=[{qargs}], cargs=[])")
+        code = "\n".join(lines)
+        assert cluster_qubits(code, "qc", "qr") == \
+            cluster_qubits_via_regex(code, "qc", "qr")
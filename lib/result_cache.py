@@ -0,0 +1,141 @@
+"""Persistent store of execution results, shared across runs.
+
+The debugging loop re-executes the same QASM program many times, and the
+cross-platform experiments and benchmarks rerun identical programs. The
+key of an execution is the hash of the canonical program together with
+its platform (the full description of how it is executed) and shots.
+Every execution is an independent draw, thus the key keeps a pool of
+results: the i-th draw of a loop gets the i-th result of the pool
+(executing and recording it if missing), so that the draws of the same
+loop are never the same result.
+The store is a folder with one json file per key, bounded in the number of
+keys (the least recently used are evicted).
+"""
+
+import hashlib
+import json
+import os
+import re
+from typing import Any, Callable, Dict, List
+
+
+def canonical_qasm(qasm_content: str) -> str:
+    """Canonical QASM: without comments, blank lines and extra spaces."""
+    lines = []
+    for line in qasm_content.split("\n"):
+        line = re.sub(r"\s+", " ", line.split("//")[0]).strip()
+        if line != "":
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def get_execution_key(
+        program: str, platform: str, shots: int = None) -> str:
+    """Key of the execution of the (QASM) program with the given settings."""
+    description = json.dumps({
+        "program": canonical_qasm(program), "platform": platform,
+        "shots": shots}, sort_keys=True)
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+class ExecutionResultCache(object):
+    """Folder of execution results, with a pool of draws per key.
+
+    max_entries bounds the number of keys (evicting the least recently
+    used file), max_pool_size the number of draws kept per key.
+    """
+
+    def __init__(self, folder: str, max_entries: int = 10000,
+                 max_pool_size: int = 10):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.max_pool_size = max_pool_size
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        os.makedirs(folder, exist_ok=True)
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.json")
+
+    def read_pool(self, key: str) -> List[Any]:
+        """Read the results recorded for the key (empty if none)."""
+        try:
+            with open(self.get_path(key), "r") as f:
+                pool = json.load(f)["results"]
+            # mark it as recently used
+            os.utime(self.get_path(key))
+            return pool
+        except (OSError, ValueError, KeyError):
+            return []
+
+    def write_pool(self, key: str, pool: List[Any]):
+        """Write the results of the key (via rename: no half-written file)."""
+        tmp_path = f"{self.get_path(key)}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"results": pool}, f)
+            os.replace(tmp_path, self.get_path(key))
+        except (OSError, TypeError) as e:
+            print(f"Could not store the execution result {key}: {e}")
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used keys beyond max_entries."""
+        paths = [os.path.join(self.folder, f) for f in os.listdir(self.folder)
+                 if f.endswith(".json")]
+        if len(paths) <= self.max_entries:
+            return
+        paths = sorted(paths, key=os.path.getmtime)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+                self.stats["evictions"] += 1
+            except OSError:
+                pass
+
+    def lookup(self, key: str, draw: int = 0) -> Any:
+        """Get the given draw of the execution (None if not recorded)."""
+        pool = self.read_pool(key)
+        if draw < len(pool):
+            self.stats["hits"] += 1
+            return pool[draw]
+        self.stats["misses"] += 1
+        return None
+
+    def record(self, key: str, result: Any):
+        """Record a new result of the execution (if the pool is not full)."""
+        pool = self.read_pool(key)
+        if len(pool) < self.max_pool_size:
+            self.write_pool(key, pool + [result])
+
+    def get_or_execute(self, key: str, execute: Callable[[], Any],
+                       draw: int = 0) -> Any:
+        """Get the given draw, executing (and recording) it if missing."""
+        result = self.lookup(key, draw=draw)
+        if result is None:
+            result = execute()
+            self.record(key, result)
+        return result
+
+    def get_hit_rates(self) -> Dict[str, float]:
+        """Get the counters and the hit rate of the cache."""
+        n_lookups = max(1, self.stats["hits"] + self.stats["misses"])
+        return {**self.stats, "hit_rate": self.stats["hits"] / n_lookups}
+
+
+def get_result_cache(cache_config: Dict[str, Any],
+                     default_folder: str) -> ExecutionResultCache:
+    """Create the result cache of the config (None if not configured)."""
+    if cache_config is None:
+        return None
+    return ExecutionResultCache(
+        folder=cache_config.get("folder") or default_folder,
+        max_entries=cache_config.get("max_entries", 10000),
+        max_pool_size=cache_config.get("max_pool_size", 10))
+
+
+def execute_with_cache(cache: ExecutionResultCache, key: str,
+                       execute: Callable[[], Any], draw: int = 0) -> Any:
+    """Execute via the cache, or directly when there is no cache."""
+    if cache is None:
+        return execute()
+    return cache.get_or_execute(key, execute, draw=draw)
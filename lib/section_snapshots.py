@@ -0,0 +1,200 @@
+"""Snapshots of the namespace of the programs after each of their sections.
+
+Most MRs change only the late sections of a program (e.g. ChangeBackend
+only EXECUTION, ChangeOptLevel only OPTIMIZATION_LEVEL), yet the follow-up
+runs again from the PROLOGUE: imports, circuit construction and
+transpilation included. Here a program runs section by section, and the
+namespace after each section is kept in an LRU, keyed by the hash of the
+(normalized) sections up to it. A program whose prefix has a snapshot
+resumes from a copy of it, and runs only the sections after the prefix.
+
+The snapshots live in the memory of the process, thus they serve the
+follow-ups executed in the same process of their source. As in the
+transpile cache, a stochastic transpilation (a coupling map without
+seed_transpiler) is never frozen: the namespaces after the section that
+runs it are not snapshotted.
+"""
+
+import ast
+import copy
+import hashlib
+import types
+from typing import Any, Dict, List
+
+from lib.exact_distribution import ProgramResultCache
+from lib.metamorph import get_sections
+from lib.transpile_cache import is_deterministic
+
+
+def get_prefix_keys(sections: Dict[str, str]) -> List[str]:
+    """Get the key of each prefix of the sections (chained hashes)."""
+    keys, key = [], ""
+    for name, content in sections.items():
+        key = hashlib.sha256(
+            f"{key}\n# NAME: {name}\n{content}".encode("utf-8")).hexdigest()
+        keys.append(key)
+    return keys
+
+
+def has_stochastic_transpile(section: str) -> bool:
+    """Check if the section calls transpile stochastically.
+
+    The keyword options of each call to transpile are checked as in the
+    transpile cache (see is_deterministic): an option that is not a
+    literal (e.g. a variable coupling map) counts as given, and a call
+    with **kwargs or a section that does not parse counts as stochastic.
+    """
+    try:
+        tree = ast.parse(section)
+    except SyntaxError:
+        return True
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        func_name = getattr(node.func, "id", getattr(node.func, "attr", None))
+        if func_name != "transpile":
+            continue
+        if any(keyword.arg is None for keyword in node.keywords):
+            return True
+        options = {
+            keyword.arg: keyword.value.value
+            if isinstance(keyword.value, ast.Constant) else keyword.value
+            for keyword in node.keywords}
+        if not is_deterministic(options):
+            return True
+    return False
+
+
+def has_code_before_sections(py_content: str) -> bool:
+    """Check if there is code before the first section (not in any)."""
+    preamble = py_content.split("# SECTION\n")[0]
+    return any(
+        line.strip() != "" and not line.strip().startswith("#")
+        for line in preamble.split("\n"))
+
+
+def can_snapshot(namespace: Dict[str, Any]) -> bool:
+    """Check that a copy of the namespace behaves as the namespace.
+
+    The functions defined by the program refer to the namespace itself
+    (their globals), thus they would not see the copy.
+    """
+    return not any(
+        isinstance(value, types.FunctionType) and
+        value.__globals__ is namespace
+        for value in namespace.values())
+
+
+def copy_namespace(namespace: Dict[str, Any]) -> Dict[str, Any]:
+    """Deep copy the namespace, sharing the modules and the builtins.
+
+    The values are copied together, thus those referring to each other
+    (e.g. a circuit and its registers) still do in the copy.
+    """
+    memo = {
+        id(value): value for name, value in namespace.items()
+        if name == "__builtins__" or isinstance(value, types.ModuleType)}
+    return copy.deepcopy(namespace, memo)
+
+
+class SectionSnapshots(object):
+    """LRU of the namespaces after the sections of the programs."""
+
+    def __init__(self, max_size: int = 32):
+        self.snapshots = ProgramResultCache(max_size=max_size)
+        self.stats = {
+            "resumed": 0, "from_scratch": 0,
+            "sections_skipped": 0, "sections_run": 0, "stochastic": 0}
+
+    def resume(self, keys: List[str]):
+        """Get a copy of the snapshot of the longest prefix (if any).
+
+        It returns the number of sections of the prefix and the namespace
+        (0 and a fresh namespace if there is no snapshot).
+        """
+        for n_sections in range(len(keys), 0, -1):
+            if keys[n_sections - 1] in self.snapshots.entries:
+                _, snapshot = self.snapshots.lookup(keys[n_sections - 1])
+                self.stats["resumed"] += 1
+                self.stats["sections_skipped"] += n_sections
+                return n_sections, copy_namespace(snapshot)
+        self.stats["from_scratch"] += 1
+        return 0, {"RESULT": 0}
+
+    def store(self, key: str, namespace: Dict[str, Any]):
+        """Store a copy of the namespace (if it can be copied)."""
+        if not can_snapshot(namespace):
+            return
+        try:
+            self.snapshots.put(key, copy_namespace(namespace))
+        except Exception as e:
+            print(f"Could not snapshot the program namespace: {e}")
+
+    def run_sections(self, sections: Dict[str, str],
+                     n_to_snapshot: int = None) -> Dict[str, Any]:
+        """Run the sections (from the longest snapshot) and get the namespace.
+
+        It snapshots the namespace after each of the first n_to_snapshot
+        sections it runs (by default all of them), and never after a
+        section with a stochastic transpilation (see
+        has_stochastic_transpile).
+        """
+        if n_to_snapshot is None:
+            n_to_snapshot = len(sections)
+        for i, content in enumerate(list(sections.values())[:n_to_snapshot]):
+            if has_stochastic_transpile(content):
+                n_to_snapshot = i
+                self.stats["stochastic"] += 1
+                break
+        keys = get_prefix_keys(sections)
+        n_done, namespace = self.resume(keys)
+        contents = list(sections.values())
+        for i in range(n_done, len(sections)):
+            exec(contents[i], namespace)
+            self.stats["sections_run"] += 1
+            if i < n_to_snapshot:
+                self.store(keys[i], namespace)
+        return namespace
+
+    def execute(self, py_content: str) -> Any:
+        """Execute the program (as exec) and return its RESULT.
+
+        The namespace after the last section is not snapshotted, since no
+        other program resumes from it. A program with code before its
+        first section runs with a plain exec.
+        """
+        sections = get_sections(py_content)
+        if len(sections) == 0 or has_code_before_sections(py_content):
+            GLOBALS = {"RESULT": 0}
+            exec(py_content, GLOBALS)
+            return GLOBALS["RESULT"]
+        namespace = self.run_sections(
+            sections, n_to_snapshot=len(sections) - 1)
+        return namespace["RESULT"]
+
+    def get_hit_rates(self) -> Dict[str, float]:
+        """Get the counters and the rate of programs resumed."""
+        n_programs = max(1, self.stats["resumed"] +
+                         self.stats["from_scratch"])
+        return {
+            **self.stats,
+            "hit_rate": self.stats["resumed"] / n_programs,
+        }
+
+
+SECTION_SNAPSHOTS = {"snapshots": None}
+
+
+def install_section_snapshots(max_size: int = 32) -> SectionSnapshots:
+    """Make the programs of this process run via section snapshots.
+
+    It is installed once per process, and it returns the snapshots.
+    """
+    if SECTION_SNAPSHOTS["snapshots"] is None:
+        SECTION_SNAPSHOTS["snapshots"] = SectionSnapshots(max_size=max_size)
+    return SECTION_SNAPSHOTS["snapshots"]
+
+
+def get_section_snapshots() -> SectionSnapshots:
+    """Get the snapshots installed in this process (None if none)."""
+    return SECTION_SNAPSHOTS["snapshots"]
@@ -0,0 +1,127 @@
+from qiskit import ClassicalRegister
+from qiskit import QuantumCircuit
+from qiskit import QuantumRegister
+
+from lib.section_snapshots import SectionSnapshots
+from lib.section_snapshots import can_snapshot
+from lib.section_snapshots import copy_namespace
+from lib.section_snapshots import get_prefix_keys
+from lib.section_snapshots import has_stochastic_transpile
+
+
+PROLOGUE = """
+# SECTION
+# NAME: PROLOGUE
+
+from qiskit import QuantumCircuit, ClassicalRegister, QuantumRegister
+from qiskit.circuit.library.standard_gates import *
+"""
+
+CIRCUIT = """
+# SECTION
+# NAME: CIRCUIT
+
+qr = QuantumRegister(2, name='qr')
+cr = ClassicalRegister(2, name='cr')
+qc = QuantumCircuit(qr, cr, name='qc')
+qc.append(HGate(), qargs=[qr[0]], cargs=[])
+qc.append(CXGate(), qargs=[qr[0], qr[1]], cargs=[])
+qc.measure(qr, cr)
+"""
+
+OPTIMIZATION_LEVEL = """
+# SECTION
+# NAME: OPTIMIZATION_LEVEL
+
+from qiskit import transpile
+qc = transpile(qc, basis_gates=None, optimization_level={level}{options})
+"""
+
+EXECUTION = """
+# SECTION
+# NAME: EXECUTION
+
+RESULT = {{"gates": len(qc.data), "qubits": qc.num_qubits, "tag": {tag}}}
+"""
+
+
+def make_program(level=1, options=", coupling_map=None", tag=0):
+    return PROLOGUE + CIRCUIT + \
+        OPTIMIZATION_LEVEL.format(level=level, options=options) + \
+        EXECUTION.format(tag=tag)
+
+
+def test_copy_namespace_keeps_circuit_and_registers_linked():
+    qr = QuantumRegister(2, name="qr")
+    cr = ClassicalRegister(2, name="cr")
+    qc = QuantumCircuit(qr, cr)
+    namespace = {"qr": qr, "cr": cr, "qc": qc, "__builtins__": __builtins__}
+    copied = copy_namespace(namespace)
+    assert copied["qc"] is not qc
+    assert copied["__builtins__"] is __builtins__
+    # appending via the copied register works on the copied circuit
+    copied["qc"].h(copied["qr"][0])
+    copied["qc"].measure(copied["qr"], copied["cr"])
+    assert len(copied["qc"].data) == 3
+    assert len(qc.data) == 0
+
+
+def test_can_snapshot_without_functions_of_the_program():
+    namespace = {"RESULT": 0}
+    exec("x = [1, 2]\nimport math\ny = math.pi", namespace)
+    assert can_snapshot(namespace)
+    exec("def f():\n    return x", namespace)
+    assert not can_snapshot(namespace)
+
+
+def test_follow_up_resumes_from_the_shared_prefix():
+    snapshots = SectionSnapshots()
+    source = make_program(tag=0)
+    followup = make_program(tag=1)
+    assert snapshots.execute(source)["tag"] == 0
+    assert snapshots.stats["from_scratch"] == 1
+    assert snapshots.execute(followup)["tag"] == 1
+    # only EXECUTION differs: it resumes after OPTIMIZATION_LEVEL
+    assert snapshots.stats["resumed"] == 1
+    assert snapshots.stats["sections_skipped"] == 3
+    assert snapshots.execute(make_program(level=3)) == \
+        snapshots.execute(make_program(level=3))
+    assert snapshots.stats["sections_skipped"] == 3 + 2 + 3
+
+
+def test_prefix_keys_chain_the_sections():
+    keys = get_prefix_keys({"A": "x = 1", "B": "y = 2"})
+    assert keys[0] == get_prefix_keys({"A": "x = 1", "B": "y = 3"})[0]
+    assert keys[1] != get_prefix_keys({"A": "x = 1", "B": "y = 3"})[1]
+    assert keys[1] != get_prefix_keys({"A": "x = 2", "B": "y = 2"})[1]
+
+
+def test_has_stochastic_transpile():
+    assert not has_stochastic_transpile(
+        "qc = transpile(qc, optimization_level=3, coupling_map=None)")
+    assert not has_stochastic_transpile("qc = transpile(qc)")
+    assert not has_stochastic_transpile(
+        "qc = transpile(qc, coupling_map=[[0, 1]], seed_transpiler=7)")
+    assert has_stochastic_transpile(
+        "qc = transpile(qc, coupling_map=[[0, 1]])")
+    assert has_stochastic_transpile(
+        "qc = qiskit.transpile(qc, coupling_map=cmap)")
+    assert has_stochastic_transpile(
+        "qc = transpile(qc, coupling_map=[[0, 1]], seed_transpiler=None)")
+    assert has_stochastic_transpile("qc = transpile(qc, **options)")
+
+
+def test_stochastic_transpilation_is_not_snapshotted():
+    snapshots = SectionSnapshots()
+    stochastic = make_program(options=", coupling_map=[[0, 1], [1, 0]]")
+    snapshots.execute(stochastic)
+    assert snapshots.stats["stochastic"] == 1
+    # only the prefix before OPTIMIZATION_LEVEL is snapshotted
+    assert len(snapshots.snapshots.entries) == 2
+    snapshots.execute(stochastic)
+    assert snapshots.stats["sections_skipped"] == 2
+    seeded = make_program(
+        options=", coupling_map=[[0, 1], [1, 0]], seed_transpiler=1")
+    snapshots.execute(seeded)
+    snapshots.execute(seeded)
+    assert snapshots.stats["sections_skipped"] == 2 + 2 + 3
@@ -0,0 +1,175 @@
+"""Content-addressed cache of the transpiled circuits.
+
+The generated programs transpile their circuit in the OPTIMIZATION_LEVEL
+section, and their follow-ups (and reruns) often transpile a circuit that
+is structurally identical to one already compiled. The key of a
+transpilation is the hash of the canonical form of the circuit together
+with the transpile options (seed_transpiler included, if any): an
+in-memory LRU sits in front of an on-disk store of QPY files, shared by
+all the processes of a run. The stochastic transpilations (a coupling map
+without seed_transpiler, e.g. after ChangeCouplingMap) are never cached.
+
+The programs do `from qiskit import transpile`, thus once installed (see
+install_transpile_cache) they get the cached transpile without any change
+to their code.
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+from typing import Any, Dict
+
+import qiskit
+from qiskit import QuantumCircuit
+
+try:
+    from qiskit import qpy
+except ImportError:
+    # qiskit-terra < 0.20
+    from qiskit.circuit import qpy_serialization as qpy
+
+
+def canonical_form(circuit: QuantumCircuit) -> str:
+    """Canonical description of the circuit (independent of its name).
+
+    Qubits and clbits are referred to by their index, parameters by their
+    name, thus two circuits built by the same code have the same form.
+    """
+    qubit_index = {qubit: i for i, qubit in enumerate(circuit.qubits)}
+    clbit_index = {clbit: i for i, clbit in enumerate(circuit.clbits)}
+    registers = [(reg.name, reg.size) for reg in circuit.qregs] + \
+        [(reg.name, reg.size) for reg in circuit.cregs]
+    operations = [
+        (instruction.name, [repr(p) for p in instruction.params],
+         [qubit_index[q] for q in qargs], [clbit_index[c] for c in cargs],
+         repr(getattr(instruction, "condition", None)))
+        for instruction, qargs, cargs in circuit.data
+    ]
+    return repr((registers, operations, repr(circuit.global_phase)))
+
+
+def transpilation_key(circuit: QuantumCircuit,
+                      options: Dict[str, Any]) -> str:
+    """Key of the transpilation of the circuit with the given options."""
+    description = canonical_form(circuit) + repr(sorted(
+        (name, repr(value)) for name, value in options.items()))
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+class TranspileCache(object):
+    """In-memory LRU of transpiled circuits, over an on-disk QPY store.
+
+    The store is optional (folder None), and each circuit is a file named
+    by its key, thus the processes sharing the folder share the cache.
+    """
+
+    def __init__(self, max_size: int = 256, folder: str = None):
+        self.max_size = max_size
+        self.folder = folder
+        self.circuits = OrderedDict()
+        self.stats = {
+            "memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0}
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.qpy")
+
+    def lookup(self, key: str) -> QuantumCircuit:
+        """Get the transpiled circuit (None if not cached)."""
+        if key in self.circuits:
+            self.stats["memory_hits"] += 1
+            self.circuits.move_to_end(key)
+            return self.circuits[key].copy()
+        if self.folder is not None and os.path.exists(self.get_path(key)):
+            try:
+                with open(self.get_path(key), "rb") as f:
+                    circuit = qpy.load(f)[0]
+                self.stats["disk_hits"] += 1
+                self.remember(key, circuit)
+                return circuit.copy()
+            except Exception as e:
+                print(f"Could not read the transpiled circuit {key}: {e}")
+        self.stats["misses"] += 1
+        return None
+
+    def remember(self, key: str, circuit: QuantumCircuit):
+        """Keep the circuit in memory, evicting the least recently used."""
+        self.circuits[key] = circuit
+        self.circuits.move_to_end(key)
+        while len(self.circuits) > self.max_size:
+            self.circuits.popitem(last=False)
+
+    def store(self, key: str, circuit: QuantumCircuit):
+        """Store the circuit in memory and on disk."""
+        self.remember(key, circuit.copy())
+        if self.folder is None:
+            return
+        # write and rename, thus the other processes never read half a file
+        tmp_path = f"{self.get_path(key)}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                qpy.dump(circuit, f)
+            os.replace(tmp_path, self.get_path(key))
+        except Exception as e:
+            print(f"Could not store the transpiled circuit {key}: {e}")
+
+    def get_hit_rates(self) -> Dict[str, float]:
+        """Get the counters and the hit rates of the cache."""
+        n_lookups = max(1, self.stats["memory_hits"] +
+                        self.stats["disk_hits"] + self.stats["misses"])
+        return {
+            **self.stats,
+            "memory_hit_rate": self.stats["memory_hits"] / n_lookups,
+            "hit_rate": (self.stats["memory_hits"] +
+                         self.stats["disk_hits"]) / n_lookups,
+        }
+
+
+TRANSPILE_CACHE = {"cache": None, "transpile": None}
+
+
+def is_deterministic(options: Dict[str, Any]) -> bool:
+    """Check if the transpilation with the given options is reproducible.
+
+    With a coupling map, layout and routing are stochastic unless the
+    seed_transpiler is given: caching them would freeze the first random
+    transpilation, hiding the nondeterminism of the compiler.
+    """
+    return (options.get("coupling_map") is None or
+            options.get("seed_transpiler") is not None)
+
+
+def cached_transpile(circuits, *args, **kwargs):
+    """Transpile as qiskit.transpile, reusing the cached transpilations.
+
+    Only single circuits with keyword options are cached (as in the
+    generated programs) and only if the transpilation is deterministic
+    (see is_deterministic), the other calls go to qiskit.transpile.
+    """
+    original_transpile = TRANSPILE_CACHE["transpile"]
+    cache = TRANSPILE_CACHE["cache"]
+    if (not isinstance(circuits, QuantumCircuit) or len(args) > 0 or
+            not is_deterministic(kwargs)):
+        cache.stats["bypassed"] += 1
+        return original_transpile(circuits, *args, **kwargs)
+    key = transpilation_key(circuits, kwargs)
+    transpiled = cache.lookup(key)
+    if transpiled is None:
+        transpiled = original_transpile(circuits, **kwargs)
+        cache.store(key, transpiled)
+    transpiled.name = circuits.name
+    return transpiled
+
+
+def install_transpile_cache(max_size: int = 256, folder: str = None):
+    """Make `from qiskit import transpile` give the cached transpile.
+
+    It is installed once per process, and it returns the cache.
+    """
+    if TRANSPILE_CACHE["cache"] is None:
+        TRANSPILE_CACHE["cache"] = TranspileCache(
+            max_size=max_size, folder=folder)
+        TRANSPILE_CACHE["transpile"] = qiskit.transpile
+        qiskit.transpile = cached_transpile
+    return TRANSPILE_CACHE["cache"]
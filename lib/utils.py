@@ -1,10 +1,12 @@
 import os
+import fcntl
 import json
 import yaml
 from typing import List, Dict, Tuple, Any
 import subprocess
 from subprocess import DEVNULL, STDOUT, check_call
 import multiprocessing
+import traceback
 from itertools import combinations
 from functools import reduce
 import pandas as pd
@@ -197,6 +199,29 @@ def create_folder_structure(parent_folder: str, structure: Dict[str, Any]):
 
 # TIMEOUT HANDLING
 
+class FileLock(object):
+    """Lock shared among processes, released when its holder dies.
+
+    It is an exclusive flock on the given file: contrary to a
+    multiprocessing.Lock, a process killed while holding it (e.g. by
+    break_function_with_timeout) does not leave it held forever.
+    """
+
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+        self.lock_file = None
+
+    def __enter__(self):
+        self.lock_file = open(self.lock_path, "a")
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+        self.lock_file = None
+
+
 def break_function_with_timeout(
         routine: callable = None,
         seconds_to_wait: int = None,
@@ -215,6 +240,112 @@ def break_function_with_timeout(
         p.terminate()
         p.join()
 
+
+def serve_routines(conn, initializer: callable = None, initargs: Tuple = ()):
+    """Run the routines received through the pipe, until told to stop.
+
+    Note that this is the main function of a PersistentProcess.
+    """
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            # the owner of the process is gone
+            break
+        if task is None:
+            break
+        routine, args = task
+        try:
+            conn.send((routine(*args), None))
+        except Exception as e:
+            traceback.print_exc()
+            conn.send((None, str(e)))
+
+
+class PersistentProcess(object):
+    """Long-lived process that runs one routine at a time with a timeout.
+
+    Contrary to break_function_with_timeout, the process survives from one
+    routine to the next, so it pays the imports (and everything the
+    initializer sets up) only once. When a routine exceeds its time budget
+    the process is killed and transparently replaced by a new one.
+    To contain memory growth, the process is also replaced after
+    max_tasks routines (None to never recycle it).
+    """
+
+    def __init__(self,
+                 initializer: callable = None,
+                 initargs: Tuple = (),
+                 max_tasks: int = None,
+                 name: str = "persistent_process"):
+        self.initializer = initializer
+        self.initargs = initargs
+        self.max_tasks = max_tasks
+        self.name = name
+        self.process = None
+        self.conn = None
+        self.n_tasks = 0
+
+    def start(self):
+        """Start a fresh process."""
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=serve_routines, name=self.name,
+            args=(child_conn, self.initializer, self.initargs))
+        self.process.start()
+        child_conn.close()
+        self.n_tasks = 0
+
+    def kill(self):
+        """Kill the process, whatever it is doing."""
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+        self.process = None
+
+    def stop(self):
+        """Let the process finish gracefully."""
+        if self.process is not None and self.process.is_alive():
+            self.conn.send(None)
+            self.process.join(5)
+        self.kill()
+
+    def needs_replacement(self):
+        """Check if the process is dead or has served enough routines."""
+        return (self.process is None or
+                not self.process.is_alive() or
+                (self.max_tasks is not None and
+                 self.n_tasks >= self.max_tasks))
+
+    def run(self,
+            routine: callable = None,
+            seconds_to_wait: int = None,
+            message: str = "Nothing to add.",
+            args: List[Any] = None):
+        """Run the routine in the process, with the given timeout.
+
+        It returns the pair (result of the routine, error message), where
+        the error message is None if the routine completed.
+        """
+        if self.needs_replacement():
+            self.kill()
+            self.start()
+        self.conn.send((routine, tuple(args or ())))
+        self.n_tasks += 1
+        if self.conn.poll(seconds_to_wait):
+            try:
+                return self.conn.recv()
+            except EOFError:
+                print(f"Process died while running: '{routine.__name__}'.")
+                self.kill()
+                return None, "Process died."
+        print(f"Timeout over ({seconds_to_wait} sec)! Killing function: '{routine.__name__}'... " +
+              message)
+        self.kill()
+        return None, "Timeout."
+
 # COMBINATIONS OF COMPARISONS
 
 def read_execution_folder(folder_with_execs, compiler_name):
@@ -1,9 +1,14 @@
 import os
+import re
 import sqlite3 as sl
+import time
 from typing import Dict, List, Tuple, Any
 import pandas as pd
 
 
+INDEXED_COLUMNS = re.compile(r"^(program_id|divergence\..*\.p-value)$")
+
+
 def get_database_connection(config: Dict[str, Any],
                             db_filename: str = "qdd_debugging.db"):
     """Get the database."""
@@ -16,21 +21,180 @@ def update_database(
         table_name: str,
         record: Dict[str, Any]):
     """Update the RERUN database with the following result."""
-    df_single = pd.json_normalize([record])
-    dict_is_col_list = (df_single.applymap(type) == list).all()
-    for c in df_single.columns:
-        if dict_is_col_list[c]:
-            df_single[c] = df_single[c].astype('str')
-    df_single.to_sql(table_name, con, if_exists='append')
+    insert_records(
+        con, table_name, [flatten_record(record)],
+        known_columns=get_table_columns(con, table_name))
 
 
-def get_program_ids_in_table(con: sl.Connection, table_name: str):
-    """Get the program ids in the passed table of the database connection."""
-    table_exists = (con.cursor().execute(f"""
+def flatten_record(record: Dict[str, Any],
+                   parent_key: str = "") -> Dict[str, Any]:
+    """Flatten the nested dictionaries of a record (as pd.json_normalize).
+
+    Note that the lists are stored as their string representation.
+    """
+    flat_record = {}
+    for key, value in record.items():
+        column = f"{parent_key}.{key}" if parent_key else str(key)
+        if isinstance(value, dict):
+            flat_record.update(flatten_record(value, parent_key=column))
+        else:
+            flat_record[column] = \
+                str(value) if isinstance(value, list) else value
+    return flat_record
+
+
+def quote(name: str) -> str:
+    """Quote the name of a table or column for sqlite."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def get_sql_type(value: Any) -> str:
+    """Get the sqlite type of a column (the same chosen by pandas)."""
+    if isinstance(value, (bool, int)):
+        return "INTEGER"
+    if isinstance(value, float):
+        return "REAL"
+    return "TEXT"
+
+
+def get_table_columns(con: sl.Connection, table_name: str) -> List[str]:
+    """Get the columns of the table (empty if the table does not exist)."""
+    return [row[1] for row in
+            con.execute(f"PRAGMA table_info({quote(table_name)})")]
+
+
+def register_schema(
+        con: sl.Connection,
+        table_name: str,
+        flat_records: List[Dict[str, Any]],
+        known_columns: List[str]) -> List[str]:
+    """Create the table, or add the missing columns, to store the records.
+
+    The type of a new column is given by its first non-null value. It
+    returns all the columns of the table.
+    """
+    new_column_types = {}
+    for record in flat_records:
+        for column, value in record.items():
+            if (column not in known_columns and
+                    new_column_types.get(column) is None):
+                new_column_types[column] = \
+                    None if value is None else get_sql_type(value)
+    definitions = [f"{quote(column)} {sql_type or 'TEXT'}"
+                   for column, sql_type in new_column_types.items()]
+    if len(known_columns) == 0:
+        con.execute(f"CREATE TABLE IF NOT EXISTS {quote(table_name)} " +
+                    f"({', '.join(definitions)})")
+    else:
+        for definition in definitions:
+            con.execute(
+                f"ALTER TABLE {quote(table_name)} ADD COLUMN {definition}")
+    create_indexes(con, table_name, list(new_column_types.keys()))
+    return list(known_columns) + list(new_column_types.keys())
+
+
+def create_indexes(con: sl.Connection, table_name: str, columns: List[str]):
+    """Index the program id and the p-values among the given columns."""
+    for column in filter(INDEXED_COLUMNS.match, columns):
+        con.execute(
+            "CREATE INDEX IF NOT EXISTS " +
+            f"{quote(f'ix_{table_name}_{column}')} " +
+            f"ON {quote(table_name)} ({quote(column)})")
+
+
+def insert_records(
+        con: sl.Connection,
+        table_name: str,
+        flat_records: List[Dict[str, Any]],
+        known_columns: List[str]) -> List[str]:
+    """Insert the flat records in a single transaction.
+
+    The records with the same columns share the same prepared statement.
+    It returns all the columns of the table.
+    """
+    records_by_columns = {}
+    for record in flat_records:
+        records_by_columns.setdefault(tuple(record.keys()), []).append(
+            tuple(record.values()))
+    with con:
+        columns = register_schema(
+            con, table_name, flat_records, known_columns)
+        for record_columns, rows in records_by_columns.items():
+            con.executemany(
+                f"INSERT INTO {quote(table_name)} " +
+                f"({', '.join(map(quote, record_columns))}) " +
+                f"VALUES ({', '.join(['?'] * len(record_columns))})", rows)
+    return columns
+
+
+class DatabaseWriter(object):
+    """Buffered writer of records in a sqlite database.
+
+    The records are kept in memory and written in batches, each one in a
+    single transaction, when the batch is full or the oldest buffered
+    record has waited flush_interval seconds. The schema of each table is
+    read once and extended only when a record brings new columns. The
+    database is in WAL mode, thus readers (e.g. the divergence scan or a
+    notebook) do not block the writer.
+    """
+
+    def __init__(self, db_path: str, batch_size: int = 100,
+                 flush_interval: float = 5):
+        self.con = sl.connect(db_path)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffers = {}
+        self.columns = {}
+        self.n_buffered = 0
+        self.oldest_buffered_time = None
+
+    def append(self, table_name: str, record: Dict[str, Any]):
+        """Buffer a record for the given table."""
+        self.buffers.setdefault(table_name, []).append(
+            flatten_record(record))
+        if self.n_buffered == 0:
+            self.oldest_buffered_time = time.time()
+        self.n_buffered += 1
+
+    def is_flush_due(self) -> bool:
+        """Check if the batch is full or has waited long enough."""
+        return self.n_buffered > 0 and (
+            self.n_buffered >= self.batch_size or
+            time.time() - self.oldest_buffered_time >= self.flush_interval)
+
+    def flush(self) -> List[str]:
+        """Write all the buffered records, it returns the tables written."""
+        for table_name, flat_records in self.buffers.items():
+            if table_name not in self.columns:
+                self.columns[table_name] = \
+                    get_table_columns(self.con, table_name)
+            self.columns[table_name] = insert_records(
+                self.con, table_name, flat_records,
+                known_columns=self.columns[table_name])
+        flushed_tables = list(self.buffers.keys())
+        self.buffers = {}
+        self.n_buffered = 0
+        return flushed_tables
+
+    def close(self):
+        """Write what is left and close the database."""
+        self.flush()
+        self.con.close()
+
+
+def check_table_exists(con: sl.Connection, table_name: str) -> bool:
+    """Check if the passed table exists in the database."""
+    return len(con.cursor().execute(f"""
         SELECT tbl_name FROM sqlite_master WHERE type='table'
         AND tbl_name='{table_name}';
-    """).fetchall())
-    if not table_exists:
+    """).fetchall()) > 0
+
+
+def get_program_ids_in_table(con: sl.Connection, table_name: str):
+    """Get the program ids in the passed table of the database connection."""
+    if not check_table_exists(con, table_name):
         return []
     present_program_id = pd.read_sql(f'''
         SELECT DISTINCT program_id